@@ -1,16 +1,13 @@
-from flask import Flask, jsonify, request
-import sqlite3
-from dateutil import parser
+from flask import Flask, Response, jsonify, request
+
+from costco_price_scraper.price_scraper import offer_snapshot
+from costco_price_scraper.utils import matcher, telemetry
 
 app = Flask(__name__)
 
-def date_parse(s):
-    ''' sql udf to convert string to date'''
-    try:
-        t = parser.parse(s, parser.parserinfo(dayfirst=True))
-        return t.strftime('%Y-%m-%d')
-    except:
-        return None
+# Created once at startup, so the request handlers only read
+matcher.create_adjustment_opportunities_table()
+telemetry.create_runs_table()
 
 
 @app.route("/check_sale", methods=["GET"])
@@ -18,46 +15,32 @@ def check_sale():
     # Get the list of item IDs from the query parameters
     item_ids = request.args.getlist("items")
 
-    # Connect to the database
-    conn = sqlite3.connect("scraped_prices.db")
-    conn.create_function("date_parse", 1, date_parse)
-    cursor = conn.cursor()
-
-    # Query the database for sale information
-    cursor.execute(
-        """
-        SELECT item_id, item_name, savings, expiry_date, sale_price
-        FROM items
-        WHERE item_id IN ({})
-         AND strftime('%Y-%m-%d', expiry_date) >= strftime('%Y-%m-%d', 'now', 'localtime')
-        """.format(
-            ",".join(map(str, item_ids))
-        )
-    )
-
-    # Fetch the results
-    results = cursor.fetchall()
-
-    # Close the database connection
-    conn.close()
-
-    total_savings = sum(row[2] for row in results)
-
-    # Convert results to a list of dictionaries
-    sale_info = [
-        {
-            "item_id": row[0],
-            "item_name": row[1],
-            "savings": row[2],
-            "expiry_date": row[3],
-            "sale_price": row[4],
-        }
-        for row in results
-    ]
-    refund_info = {"total_savings": total_savings, "sale_info": sale_info}
+    # Binary search in the mapped offer snapshot, SQLite only when there is none yet
+    refund_info = offer_snapshot.check_sale(item_ids)
+    refund_info["sale_info"] = [offer._asdict() for offer in refund_info["sale_info"]]
 
     return jsonify(refund_info)
 
 
+@app.route("/adjustments", methods=["GET"])
+def adjustments():
+    # Get the username from the query parameters
+    username = request.args.get("username")
+
+    # Read the materialized opportunities with an indexed scan
+    matches = matcher.find_adjustments(username)
+
+    total_savings = sum(match.total_savings for match in matches)
+    adjustment_info = [match._asdict() for match in matches]
+
+    return jsonify({"total_savings": total_savings, "adjustments": adjustment_info})
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Run counts and the spans of the latest run of each kind, for Prometheus to scrape
+    return Response(telemetry.prometheus_text(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,92 @@
+"""
+Delivery benchmark for the price adjustment emails, against the local SMTP stand-in.
+
+Sends a batch of emails with a receipt screenshot attached, once with a new
+connection and login per email (the old `send_email` behaviour) and once through
+`email_delivery.send_batch` over a pool of authenticated connections. A per-reply
+delay on the stand-in stands in for the round trip to the real server.
+
+Usage:
+    python benchmarks/email_delivery_benchmark.py [--emails 50] [--delay 0.005] [--connections 4]
+"""
+import argparse
+import os
+import smtplib
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import smtp_standin  # noqa: E402
+from costco_price_scraper.utils import email_delivery  # noqa: E402
+
+SENDER = "sender@example.com"
+# A 1x1 PNG, repeated to the size of a receipt screenshot
+PNG = (
+    b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89"
+    b"\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82"
+)
+
+
+def make_emails(count, attachment_path):
+    return [
+        email_delivery.OutgoingEmail(f"user{index}@example.com", "Costco Price Adjustment", "<pre>body</pre>",
+                                     [attachment_path])
+        for index in range(count)
+    ]
+
+
+def send_one_connection_per_email(port, emails):
+    for email in emails:
+        # What send_email used to do: read the attachment, connect, log in, send, quit
+        email_delivery._attachment_cache.clear()
+        message = email_delivery.build_message(SENDER, email).as_string()
+        with smtplib.SMTP("127.0.0.1", port) as server:
+            server.login(SENDER, "password")
+            server.sendmail(SENDER, email.to_email, message)
+
+
+def send_pooled(port, emails, connections):
+    pool = email_delivery.SMTPConnectionPool("127.0.0.1", port, SENDER, "password", use_ssl=False, size=connections)
+    with pool:
+        results = email_delivery.send_batch(emails, pool)
+    errors = [error for _, error in results if error is not None]
+    if errors:
+        raise errors[0]
+
+
+def measure(label, func, server):
+    connections, messages = server.connections, len(server.messages)
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    print(f"{label:<28} {seconds * 1000:>10.1f} ms {server.connections - connections:>6} connections "
+          f"{len(server.messages) - messages:>6} messages")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.005, help="seconds added to every stand-in reply")
+    parser.add_argument("--connections", type=int, default=email_delivery.MAX_CONNECTIONS)
+    args = parser.parse_args()
+
+    server = smtp_standin.start(delay=args.delay)
+    port = server.server_address[1]
+
+    with tempfile.TemporaryDirectory() as folder:
+        attachment_path = os.path.join(folder, "receipt.png")
+        with open(attachment_path, "wb") as f:
+            f.write(PNG * 4000)
+        emails = make_emails(args.emails, attachment_path)
+
+        measure("connection per email", lambda: send_one_connection_per_email(port, emails), server)
+        measure(f"pooled ({args.connections} connections)", lambda: send_pooled(port, emails, args.connections),
+                server)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
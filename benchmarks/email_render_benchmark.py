@@ -0,0 +1,68 @@
+"""
+Render benchmark for the price adjustment emails.
+
+Times `construct_adjustment_email_body_and_subject` for digests of growing size and
+`render_digests` for a batch of users, on synthetic `AdjustmentMatch` records.
+
+Usage:
+    python benchmarks/email_render_benchmark.py [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from costco_price_scraper.utils import email_builder  # noqa: E402
+from costco_price_scraper.utils.matcher import AdjustmentMatch  # noqa: E402
+
+DIGEST_SIZES = (10, 100, 1000, 5000)
+BATCH_USERS = 200
+BATCH_ITEMS = 50
+
+
+def make_matches(count):
+    today = date.today()
+    return [
+        AdjustmentMatch(
+            item_id=1000000 + index,
+            item_name=f"Kirkland Signature Item {index}",
+            amount=19.99,
+            unit=1 + index % 3,
+            receipt_date=(today - timedelta(days=index % 30)).isoformat(),
+            receipt_id=f"21134300501862412{index % 50:04d}",
+            sale_price=14.99,
+            savings=5.0,
+            expiry_date=(today + timedelta(days=index % 14)).isoformat(),
+            deadline=(today + timedelta(days=index % 14)).isoformat(),
+            total_savings=5.0 * (1 + index % 3),
+            receipt_path=None,
+        )
+        for index in range(count)
+    ]
+
+
+def best_time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the fastest one counts")
+    args = parser.parse_args()
+
+    print(f"{'items':>8} {'total ms':>10} {'us/item':>10}")
+    for size in DIGEST_SIZES:
+        matches = make_matches(size)
+        seconds = best_time(lambda: email_builder.construct_adjustment_email_body_and_subject(matches), args.repeat)
+        print(f"{size:>8} {seconds * 1000:>10.2f} {seconds * 1e6 / size:>10.2f}")
+
+    matches_by_user = {f"user{index}@example.com": make_matches(BATCH_ITEMS) for index in range(BATCH_USERS)}
+    seconds = best_time(lambda: email_builder.render_digests(matches_by_user), args.repeat)
+    print(f"render_digests: {BATCH_USERS} users x {BATCH_ITEMS} items in {seconds * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
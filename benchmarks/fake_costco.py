@@ -0,0 +1,389 @@
+"""
+Local stand-in for frugalhotspot, the costco.com online offers page and the orders
+GraphQL API, to load-test the pipeline without touching the live sites.
+
+Everything is generated from a seed, so two runs at the same scale see the same data:
+
+- /tag/unadvertised/page/1/: the blog listing, with POSTS * scale recent posts
+- /posts/<n>/: a sales post of POST_ITEMS items
+- /online-offers.html: the coupon book, with OFFERS * scale tiles and a validity disclaimer
+- /ebusiness/order/v1/orders/graphql: the receiptsWithCounts queries, by date range
+  (RECEIPTS * scale receipts per bearer token) and by barcode
+
+Latency, a rate of 503 errors and throttling (429 over --throttle requests per second,
+then 403 blocks, see throttling_standin.py) can be injected.
+
+Point the scrapers at it through the 'Sources' config section, e.g. for main.py:
+
+    COSTCO_SOURCES_BLOG_URL=http://127.0.0.1:8091/tag/unadvertised/
+    COSTCO_SOURCES_COUPON_BOOK_URL=http://127.0.0.1:8091/online-offers.html
+    COSTCO_SOURCES_ORDERS_API_URL=http://127.0.0.1:8091/ebusiness/order/v1/orders/graphql
+
+--load runs the price, coupon, receipt API and matching stages against it in a
+throwaway working directory and prints the per-stage timings, the HTTP metrics and
+the rate limiter state. The browser login and receipt screenshots are not served.
+
+Usage:
+    python benchmarks/fake_costco.py --serve [--port 8091] [--scale 100] [--latency 0.05] [--error-rate 0.01]
+    python benchmarks/fake_costco.py --load [--scale 100] [--accounts 10] [--workers 4] [--throttle 50]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from throttling_standin import ThrottlingStandIn  # noqa: E402
+
+# Volumes at scale 1, about one real week
+POSTS = 2
+POST_ITEMS = 50
+OFFERS = 40
+RECEIPTS = 8
+RECEIPT_ITEMS = 30
+
+BLOG_PATH = "/tag/unadvertised/"
+OFFERS_PATH = "/online-offers.html"
+GRAPHQL_PATH = "/ebusiness/order/v1/orders/graphql"
+
+BRANDS = ("Kirkland Signature", "Charmin", "Bounty", "Tide", "Starbucks", "Keurig", "Ninja", "Dyson",
+          "Samsung", "Vitamix", "Ghirardelli", "Duracell", "Huggies", "Cascade", "Oral-B", "Nature Made")
+PRODUCTS = ("Paper Towels, 12 ct", "Bath Tissue, 30 rolls", "Laundry Pods, 152 ct", "Coffee, 2.5 lbs",
+            "K-Cup Pods, 100 ct", "Air Fryer", "Cordless Vacuum", "Blender", "Chocolate Squares, 23.6 oz",
+            "AA Batteries, 40 ct", "Diapers Size 4, 150 ct", "Dishwasher Pods, 90 ct", "Vitamin D3, 600 ct")
+
+FIRST_ITEM_ID = 1000000
+
+
+class FakeCostco(ThrottlingStandIn):
+    """
+    The stand-in server. Throttling is off when `throttle` is 0.
+    """
+
+    def __init__(self, address, scale=1, latency=0.0, error_rate=0.0, throttle=0, block_after=10,
+                 block_seconds=5.0, seed=0):
+        super().__init__(address, throttle, block_after, block_seconds)
+        self.RequestHandlerClass = _FakeCostcoHandler
+        self.scale = scale
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.posts = max(1, round(POSTS * scale))
+        self.offers = max(1, round(OFFERS * scale))
+        self.receipts = max(1, round(RECEIPTS * scale))
+        self.catalog_size = self.posts * POST_ITEMS + self.offers
+
+    def decide(self):
+        if not self.limit:
+            with self.lock:
+                self.statuses[200] += 1
+            return 200
+        return super().decide()
+
+    def item_name(self, item_id):
+        rng = random.Random(item_id)
+        return f"{rng.choice(BRANDS)} {rng.choice(PRODUCTS)}"
+
+    @lru_cache(maxsize=None)
+    def listing_page(self, base_url):
+        now = datetime.now(timezone.utc)
+        posts = []
+        for index in range(self.posts):
+            posted = (now - timedelta(hours=6 * index)).strftime("%Y-%m-%dT%H:%M:%S%z")
+            posts.append(
+                f'<li class="list-post pclist-layout"><article><div class="grid-header-box">'
+                f'<h2 class="penci-entry-title entry-title grid-title"><a href="{base_url}/posts/{index}/">'
+                f'Costco Unadvertised Deals #{index}</a></h2>'
+                f'<time class="entry-date published" datetime="{posted}">{posted[:10]}</time>'
+                f'</div></article></li>\n'
+            )
+        return _page("Unadvertised &#8211; frugalhotspot", '<ul class="penci-wrapper-data">\n' + "".join(posts) + "</ul>")
+
+    @lru_cache(maxsize=None)
+    def sales_post(self, index):
+        rng = random.Random(self.seed * 1000003 + index)
+        expiry = date.today() + timedelta(days=rng.randint(3, 20))
+        first = FIRST_ITEM_ID + index * POST_ITEMS
+        items = []
+        for item_id in range(first, first + POST_ITEMS):
+            price = rng.randint(5, 400) + 0.99
+            items.append(
+                f"<li>{self.item_name(item_id)} ${price:.2f} "
+                f"(exp {expiry.month}/{expiry.day}/{expiry:%y}. ${rng.randint(1, 60)} saved. Item #{item_id})</li>\n"
+            )
+        return _page(f"Costco Unadvertised Deals #{index}",
+                     '<div class="entry-content"><ul class="wp-block-list">\n' + "".join(items) + "</ul></div>")
+
+    @lru_cache(maxsize=None)
+    def offers_page(self):
+        rng = random.Random(self.seed)
+        today = date.today()
+        valid_from, valid_to = today - timedelta(days=7), today + timedelta(days=20)
+        disclaimer = (f"Pricing shown reflects savings. Valid {valid_from.month}/{valid_from.day}/{valid_from:%y} - "
+                      f"{valid_to.month}/{valid_to.day}/{valid_to:%y}. While supplies last.")
+        first = FIRST_ITEM_ID + self.posts * POST_ITEMS
+        tiles = []
+        for item_id in range(first, first + self.offers):
+            savings = rng.randint(2, 40)
+            if rng.random() < 0.5:
+                price = f'<span>{rng.randint(5, 300)}</span><span>99</span><span>After ${savings} OFF</span>'
+            else:
+                price = f'<span>{savings}</span><span>OFF</span>'
+            location = "In-Warehouse Only" if rng.random() < 0.8 else "Online Only"
+            tiles.append(
+                f'<div class="MuiBox-root mui-17tvcl1"><div class="MuiBox-root mui-1d73mkv">'
+                f'<div class="MuiBox-root mui-9s0b5m"><span>$</span>{price}</div>'
+                f'<p class="MuiTypography-root MuiTypography-bodyCopy mui-13q8pqt">{self.item_name(item_id)}</p>'
+                f'<p class="MuiTypography-root MuiTypography-bodyCopy mui-1nbjwvq">Item {item_id}, Limit 2.</p></div>'
+                f'<div class="MuiTypography-root MuiTypography-bodyCopy mui-qajzra">{location}</div></div>\n'
+            )
+        return _page("Online Offers | Costco",
+                     f'<div class="MuiTypography-root MuiTypography-bodyCopy mui-1f2pcl6">{disclaimer}</div>\n'
+                     f'<div class="MuiBox-root mui-grid">\n' + "".join(tiles) + "</div>")
+
+    def receipt_list(self, token):
+        account = zlib.crc32(token.encode()) % 1000000
+        now = datetime.now()
+        receipts = []
+        for index in range(self.receipts):
+            days_ago = index * 30 // self.receipts
+            barcode = f"21134{account:06d}{index:06d}{days_ago:02d}"
+            receipts.append({
+                "warehouseName": "SEATTLE", "receiptType": "In-Warehouse", "documentType": "WarehouseReceiptDetail",
+                "transactionDateTime": (now - timedelta(days=days_ago)).strftime("%Y-%m-%dT%H:%M:%S"),
+                "transactionBarcode": barcode, "transactionType": "Sales", "total": 0, "totalItemCount": RECEIPT_ITEMS,
+                "itemArray": [], "tenderArray": [], "couponArray": [],
+            })
+        return {"data": {"receiptsWithCounts": {"inWarehouse": len(receipts), "gasStation": 0, "carWash": 0,
+                                                "gasAndCarWash": 0, "receipts": receipts}}}
+
+    def receipt_detail(self, barcode):
+        rng = random.Random(barcode)
+        days_ago = int(barcode[-2:]) if barcode[-2:].isdigit() else 0
+        transaction_date = date.today() - timedelta(days=days_ago)
+        items = []
+        for index in range(RECEIPT_ITEMS):
+            # Two thirds of the purchases are in the sale catalog
+            if rng.random() < 2 / 3:
+                item_id = FIRST_ITEM_ID + rng.randrange(self.catalog_size)
+            else:
+                item_id = 2000000 + rng.randrange(100000)
+            items.append({"itemNumber": str(item_id), "itemDescription01": self.item_name(item_id).upper()[:30],
+                          "unit": rng.randint(1, 3), "amount": round(rng.uniform(3, 300), 2)})
+            if index % 10 == 0:
+                # Bought on sale already: an instant savings line follows the item
+                items.append({"itemNumber": str(300000 + index), "itemDescription01": f"TPD/{item_id}",
+                              "unit": -1, "amount": -round(rng.uniform(1, 20), 2)})
+        receipt = {
+            "warehouseName": "SEATTLE", "receiptType": "In-Warehouse", "documentType": "WarehouseReceiptDetail",
+            "transactionDateTime": f"{transaction_date.isoformat()}T12:00:00",
+            "transactionDate": transaction_date.isoformat(), "transactionBarcode": barcode,
+            "transactionType": "Sales", "total": round(sum(item["amount"] for item in items), 2),
+            "totalItemCount": len(items), "itemArray": items,
+        }
+        return {"data": {"receiptsWithCounts": {"receipts": [receipt]}}}
+
+
+class _FakeCostcoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body, content_type="text/html; charset=utf-8", headers=()):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = self.rfile.read(length) if length else b""
+
+        if server.latency:
+            time.sleep(server.latency * random.uniform(0.5, 1.5))
+        status = server.decide()
+        if status == 429:
+            return self._send(429, "Too Many Requests", headers=[("Retry-After", "1")])
+        if status == 403:
+            return self._send(403, "Access Denied")
+        if server.error_rate and random.random() < server.error_rate:
+            return self._send(503, "Service Unavailable")
+
+        path = re.sub(r"/{2,}", "/", urlsplit(self.path).path)
+        base_url = f"http://{self.headers.get('Host')}"
+        if self.command == "GET" and path.startswith(BLOG_PATH):
+            return self._send(200, server.listing_page(base_url))
+        match = re.fullmatch(r"/posts/(\d+)/", path)
+        if self.command == "GET" and match and int(match.group(1)) < server.posts:
+            return self._send(200, server.sales_post(int(match.group(1))))
+        if self.command == "GET" and path == OFFERS_PATH:
+            return self._send(200, server.offers_page())
+        if self.command == "POST" and path == GRAPHQL_PATH:
+            return self._graphql(payload)
+        return self._send(404, "Not Found")
+
+    def _graphql(self, payload):
+        authorization = self.headers.get("costco-x-authorization", "")
+        if not authorization.startswith("Bearer "):
+            return self._send(401, json.dumps({"errors": [{"message": "Unauthorized"}]}), "application/json")
+        variables = json.loads(payload or b"{}").get("variables", {})
+        if "barcode" in variables:
+            data = self.server.receipt_detail(variables["barcode"])
+        else:
+            data = self.server.receipt_list(authorization[len("Bearer "):])
+        return self._send(200, json.dumps(data), "application/json")
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+def _page(title, content):
+    return (f'<!DOCTYPE html>\n<html lang="en-US">\n<head>\n<meta charset="UTF-8">\n<title>{title}</title>\n'
+            f'</head>\n<body>\n<main>\n{content}\n</main>\n</body>\n</html>\n')
+
+
+def start(port=0, **kwargs):
+    """
+    Start the stand-in on a background thread.
+
+    Returns:
+        FakeCostco: The running server; its port is `server.server_address[1]`.
+    """
+    import threading
+
+    server = FakeCostco(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def source_overrides(server):
+    """Environment overrides pointing the scrapers at the stand-in."""
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    return {
+        "COSTCO_SOURCES_BLOG_URL": base_url + BLOG_PATH,
+        "COSTCO_SOURCES_COUPON_BOOK_URL": base_url + OFFERS_PATH,
+        "COSTCO_SOURCES_ORDERS_API_URL": base_url + GRAPHQL_PATH,
+    }
+
+
+def timed(name, func, timings):
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func()
+    timings.append((name, time.perf_counter() - start_time))
+    return result
+
+
+def load(args):
+    server = start(scale=args.scale, latency=args.latency, error_rate=args.error_rate, throttle=args.throttle,
+                   seed=args.seed)
+    os.environ.update(source_overrides(server))
+    # Pace like against the live hosts only when throttling is being tested
+    if not args.throttle:
+        os.environ.setdefault("COSTCO_RATELIMIT_RATE", "100000")
+        os.environ.setdefault("COSTCO_RATELIMIT_BURST", "1000")
+        os.environ.setdefault("COSTCO_RATELIMIT_MAX_RATE", "100000")
+    os.environ.setdefault("COSTCO_HTTP_BACKOFF_BASE", "0.05")
+
+    from costco_price_scraper.price_scraper import costco_coupon_scraper, price_scraper
+    from costco_price_scraper.receipt_scraper import receipts_db
+    from costco_price_scraper.utils import http_client, matcher, rate_limiter
+
+    usernames = [f"member{index}@example.com" for index in range(args.accounts)]
+    timings = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            receipts_db.create_receipt_items_table()
+            receipts_db.create_receipts_table()
+            blog_items = timed("prices", price_scraper.run_price_scraper, timings)
+            coupon_items = timed("coupons", lambda: costco_coupon_scraper.run_price_scraper(force=True), timings)
+            print(f"prices: {len(blog_items or [])} sale items, coupons: {len(coupon_items or [])} sale items")
+
+            try:
+                from costco_price_scraper.receipt_scraper import receipt_scraper
+            except ImportError as e:
+                print(f"receipts skipped ({e})")
+            else:
+                def account_receipts(username):
+                    return receipt_scraper.store_receipt_items(f"token-{username}", "client", set(), username)
+
+                def all_receipts():
+                    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                        return sum(executor.map(account_receipts, usernames))
+
+                print(f"receipts: {timed('receipts', all_receipts, timings)} receipt items "
+                      f"for {len(usernames)} accounts")
+
+            matcher.create_adjustment_opportunities_table()
+            matches = timed("match", lambda: sum(len(matcher.find_new_adjustments(u)) for u in usernames), timings)
+            print(f"match: {matches} price adjustments")
+        finally:
+            os.chdir(cwd)
+
+    print("Stages:")
+    for name, seconds in timings:
+        print(f"  {name:<10} {seconds:8.2f}s")
+    http_client.print_metrics()
+    rate_limiter.print_states()
+    print(f"Server answered {dict(server.statuses)}")
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--serve", action="store_true", help="run the stand-in until interrupted")
+    mode.add_argument("--load", action="store_true", help="run the pipeline stages against the stand-in")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--scale", type=float, default=1, help="multiplier of the posts, offers and receipts")
+    parser.add_argument("--latency", type=float, default=0.0, help="average seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--throttle", type=int, default=0, help="requests per second before 429s, 0 for none")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--accounts", type=int, default=4, help="accounts whose receipts are fetched (--load)")
+    parser.add_argument("--workers", type=int, default=4, help="accounts fetched at the same time (--load)")
+    args = parser.parse_args()
+
+    if args.load:
+        load(args)
+        return
+
+    server = FakeCostco(("127.0.0.1", args.port), args.scale, args.latency, args.error_rate, args.throttle,
+                        seed=args.seed)
+    print(f"Fake Costco listening on http://127.0.0.1:{args.port}/ ({server.posts} posts, "
+          f"{server.offers} offers, {server.receipts} receipts per account)")
+    for name, value in source_overrides(server).items():
+        print(f"  {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Answered {dict(server.statuses)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Import-time budget check for the main.py subcommands.
+
+Every subcommand is loaded in a fresh interpreter with `python -X importtime`,
+importing exactly the modules it needs before doing any work (see
+`main.STAGE_MODULES`). The check fails when the cold start of a subcommand goes
+over its budget or when it imports a heavy dependency it does not need.
+
+Usage:
+    python benchmarks/importtime_budget.py [--repeat 5] [--scale 1.0] [command ...]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold start budgets in milliseconds, interpreter startup included
+BUDGETS_MS = {
+    "run": 100,
+    "accounts": 100,
+    "stage": 100,
+    "prices": 400,
+    "coupons": 400,
+    "receipts": 100,
+    "email": 100,
+    "daemon": 100,
+}
+
+HEAVY_MODULES = ("selenium", "undetected_chromedriver", "bs4", "html5lib", "requests", "dateutil", "smtplib")
+
+# Heavy dependencies a subcommand is allowed to import before its stage starts
+ALLOWED_HEAVY_MODULES = {
+    "prices": ("bs4", "html5lib", "requests"),
+    "coupons": ("requests",),
+}
+
+
+def measure(command):
+    """
+    Load a subcommand in a fresh interpreter and parse its import times.
+
+    Args:
+        command (str): The subcommand name.
+
+    Returns:
+        tuple: (total import time in ms, set of imported top-level package names)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import main; main.load_stage({command!r})"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    total_us = 0
+    packages = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        packages.add(name.strip().split(".")[0])
+        # Only top-level imports, nested ones are already part of their parent's cumulative time
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative)
+    return total_us / 1000, packages
+
+
+def check(commands, repeat, scale):
+    failures = []
+    for command in commands:
+        try:
+            samples = [measure(command) for _ in range(repeat)]
+        except RuntimeError as e:
+            failures.append(f"{command}: failed to load ({e})")
+            print(f"{command:<10} ERROR {e}")
+            continue
+
+        total_ms = min(sample[0] for sample in samples)
+        packages = samples[0][1]
+        budget_ms = BUDGETS_MS[command] * scale
+        unexpected = sorted(
+            set(HEAVY_MODULES) & packages - set(ALLOWED_HEAVY_MODULES.get(command, ()))
+        )
+
+        status = "OK"
+        if total_ms > budget_ms:
+            status = "OVER BUDGET"
+            failures.append(f"{command}: {total_ms:.1f} ms > {budget_ms:.1f} ms")
+        if unexpected:
+            status = "HEAVY IMPORTS"
+            failures.append(f"{command}: imports {', '.join(unexpected)}")
+        print(f"{command:<10} {total_ms:8.1f} ms / {budget_ms:8.1f} ms  {status}")
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("commands", nargs="*", default=list(BUDGETS_MS), help="subcommands to check")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per subcommand, the fastest one counts")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget, e.g. for slow CI machines")
+    args = parser.parse_args()
+
+    failures = check(args.commands, args.repeat, args.scale)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Extraction benchmark for the costco.com online offers page.
+
+Times `offer_extractor.extract_offers` on the saved fixture pages in
+fixtures/*offers*.html, next to the original BeautifulSoup/html5lib extraction kept
+below as a reference, and checks that both find the same offers and disclaimer.
+The reference is skipped when bs4 or html5lib is not installed.
+
+Usage:
+    python benchmarks/offer_extraction_benchmark.py [--repeat 5] [page.html ...]
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from costco_price_scraper.price_scraper import offer_extractor  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def legacy_extract_offers(html):
+    """The extraction before the single-pass parser: html5lib tree and regex class scans."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html5lib")
+    all_items = soup.find_all('div', class_='MuiBox-root mui-17tvcl1')
+    coupons = []
+    for item in all_items:
+        location = item.find('div', {"class": re.compile('MuiTypography-root MuiTypography-bodyCopy.*')})
+        if location:
+            if 'Warehouse' in location.get_text():
+                coupons.append(item)
+
+    disclaimer_header_text = None
+    for t in soup.find_all('div', {"class": re.compile('MuiTypography-root MuiTypography-bodyCopy.*')}):
+        if t.get_text().startswith('Pricing shown'):
+            disclaimer_header_text = t.get_text()
+
+    offer_texts = [item.find("div", class_="MuiBox-root mui-1d73mkv").get_text(' ') for item in coupons]
+    return offer_texts, disclaimer_header_text
+
+
+def best_time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the fastest one counts")
+    parser.add_argument("pages", nargs="*", help="saved offers pages (default: the fixtures)")
+    args = parser.parse_args()
+
+    try:
+        import bs4  # noqa: F401
+        import html5lib  # noqa: F401
+        has_reference = True
+    except ImportError:
+        has_reference = False
+        print("bs4/html5lib not installed, timing the single-pass extraction only")
+
+    ok = True
+    for path in args.pages or sorted(glob.glob(os.path.join(FIXTURES, "*offers*.html"))):
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+
+        offers, disclaimer = offer_extractor.extract_offers(html)
+        current = best_time(lambda: offer_extractor.extract_offers(html), args.repeat)
+        line = f"{os.path.basename(path)}: {len(offers)} offers, single pass {current * 1000:.2f} ms"
+
+        if has_reference:
+            if legacy_extract_offers(html) != (offers, disclaimer):
+                ok = False
+                line += " MISMATCH with the reference extraction"
+            legacy = best_time(lambda: legacy_extract_offers(html), args.repeat)
+            line += f", html5lib {legacy * 1000:.2f} ms ({legacy / current:.1f}x)"
+        print(line)
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark and golden-output check for the coupon text parser.
+
+Checks `regex.parse_many` against the golden outputs in
+fixtures/coupon_strings.json, then times it on the corpus repeated to the size of a
+coupon book, next to the original five-pattern parser kept below as a reference.
+
+Regenerate the golden outputs (after an intended change of behaviour) with --update.
+
+Usage:
+    python benchmarks/regex_benchmark.py [--copies 200] [--repeat 5] [--update]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from costco_price_scraper.price_scraper import regex  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "coupon_strings.json")
+
+
+def legacy_parse_product_string(text):
+    """The parser before the patterns were precompiled and combined."""
+    text = re.sub(r'(,?\s?Limit.*)', '', text)
+    price_pattern = r'^\$ (?:(\d+)(?: (\d+))? After \$(\d+) OFF|(\d+)(?: (\d+))? OFF) '
+    price_match = re.match(price_pattern, text)
+    price = None
+    savings = None
+    if price_match:
+        groups = price_match.groups()
+        if groups[2]:
+            price = float(Decimal(f"{groups[0]}.{groups[1] or '00'}"))
+            savings = float(Decimal(groups[2]))
+        elif groups[3]:
+            savings = float(Decimal(groups[3]))
+            if groups[4]:
+                savings = float(Decimal(f"{groups[3]}.{groups[4]}"))
+    item_numbers_match = re.search(r'Item ((?:\d+(?:,\s*)?)+)', text)
+    item_numbers = []
+    if item_numbers_match:
+        item_numbers = [num.strip() for num in item_numbers_match.group(1).split(',')]
+    name_text = re.sub(price_pattern, '', text)
+    name_text = re.sub(r'Item.*', '', name_text)
+    return name_text.strip(), item_numbers, price, savings
+
+
+def load_corpus():
+    with open(FIXTURE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def check_golden(corpus):
+    results = regex.parse_many([case["input"] for case in corpus])
+    failures = 0
+    for case, result in zip(corpus, results):
+        if list(result) != case["expected"]:
+            failures += 1
+            print(f"MISMATCH {case['input']!r}: expected {case['expected']}, got {list(result)}")
+    print(f"golden: {len(corpus) - failures}/{len(corpus)} match")
+    return failures == 0
+
+
+def update_golden(corpus):
+    results = regex.parse_many([case["input"] for case in corpus])
+    with open(FIXTURE, "w", encoding="utf-8") as f:
+        json.dump([{"input": case["input"], "expected": list(result)} for case, result in zip(corpus, results)],
+                  f, indent=2)
+        f.write("\n")
+    print(f"golden outputs of {len(corpus)} strings written to {FIXTURE}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=200, help="copies of the corpus in the timed coupon book")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the fastest one counts")
+    parser.add_argument("--update", action="store_true", help="rewrite the golden outputs from the current parser")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    if args.update:
+        update_golden(corpus)
+        return
+    if not check_golden(corpus):
+        sys.exit(1)
+
+    texts = [case["input"] for case in corpus] * args.copies
+    legacy = min(timeit.repeat(lambda: [legacy_parse_product_string(t) for t in texts], number=1, repeat=args.repeat))
+    current = min(timeit.repeat(lambda: regex.parse_many(texts), number=1, repeat=args.repeat))
+    print(f"{len(texts)} strings: legacy {legacy * 1000:.2f} ms, parse_many {current * 1000:.2f} ms "
+          f"({legacy / current:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Local SMTP stand-in for the email delivery code.
+
+A minimal threaded SMTP server on socketserver: it accepts EHLO/HELO, any AUTH
+PLAIN or LOGIN credentials, MAIL, RCPT, DATA, RSET, NOOP and QUIT, and counts the
+connections, logins and messages it received. It never relays anything. An
+optional per-command delay stands in for the round trip to a real server.
+
+To exercise the error handling it can also drop every connection after a number of
+messages, like a server closing idle or long-lived sessions, and refuse given
+recipients with a 550.
+
+Point the app at it with plain SMTP:
+
+    [SMTP]
+    HOST = 127.0.0.1
+    PORT = 8025
+    SSL = false
+
+Usage:
+    python benchmarks/smtp_standin.py [--port 8025] [--delay 0.0] [--drop-after N] [--reject ADDRESS ...]
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, delay=0.0, drop_after=None, reject=()):
+        super().__init__(address, _SMTPHandler)
+        self.delay = delay
+        self.drop_after = drop_after
+        self.reject = frozenset(reject)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.logins = 0
+        self.messages = []
+
+    def count(self, attribute):
+        with self.lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.count("connections")
+        self.reply("220 localhost stand-in ESMTP")
+        sender, recipients = None, []
+        received = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+
+            if verb == "EHLO":
+                self.wfile.write(b"250-localhost\r\n250-AUTH PLAIN LOGIN\r\n")
+                self.reply("250 8BITMIME")
+            elif verb == "HELO":
+                self.reply("250 localhost")
+            elif verb == "AUTH":
+                if command.split()[1].upper() == "LOGIN" and len(command.split()) < 3:
+                    self.reply("334 VXNlcm5hbWU6")
+                    self.rfile.readline()
+                    self.reply("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                self.server.count("logins")
+                self.reply("235 Authentication successful")
+            elif verb == "MAIL":
+                sender, recipients = command[10:], []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipient = command[8:].strip("<>")
+                if recipient in self.server.reject:
+                    self.reply("550 No such user")
+                    continue
+                recipients.append(recipient)
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                for data_line in self.rfile:
+                    if data_line in (b".\r\n", b".\n"):
+                        break
+                    size += len(data_line)
+                with self.server.lock:
+                    self.server.messages.append((sender, recipients, size))
+                self.reply("250 OK queued")
+                received += 1
+                if self.server.drop_after is not None and received >= self.server.drop_after:
+                    # Hang up without a 221, the client only notices on its next command
+                    return
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+def start(port=0, delay=0.0, drop_after=None, reject=()):
+    """
+    Start the stand-in on a background thread.
+
+    Returns:
+        SMTPStandIn: The running server; its port is `server.server_address[1]`.
+    """
+    server = SMTPStandIn(("127.0.0.1", port), delay, drop_after, reject)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds added to every reply")
+    parser.add_argument("--drop-after", type=int, default=None, help="close each connection after N messages")
+    parser.add_argument("--reject", nargs="*", default=(), metavar="ADDRESS", help="recipients refused with a 550")
+    args = parser.parse_args()
+
+    server = SMTPStandIn(("127.0.0.1", args.port), args.delay, args.drop_after, args.reject)
+    print(f"SMTP stand-in listening on 127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"{server.connections} connections, {server.logins} logins, {len(server.messages)} messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Offline benchmark suite for the hot paths of the pipeline.
+
+Every case runs against the committed fixtures in fixtures/ or synthetic rows in a
+throwaway database, so nothing touches the network or the real scraped_prices.db:
+
+- sales_post: `price_scraper.parse_sales_post` on fixtures/sales_post.html
+- coupon_page: `costco_coupon_scraper.parse_coupon_page` on fixtures/online_offers.html
+- parse_product_string: `regex.parse_many` on fixtures/coupon_strings.json
+- parse_receipt_json_data: `receipt_scraper.parse_receipt_json_data` on fixtures/receipt.json
+- upsert_items: `items_db.upsert_items` of UPSERT_ROWS sale items
+- check_sale_<n>: `items_db.check_sale` for n item IDs against CATALOG_ROWS sale items
+- snapshot_check_sale_<n>: The same lookups through `offer_snapshot.check_sale`
+- receipt_email: `email_builder.construct_receipt_email_body_and_subject` for EMAIL_ROWS items
+
+The best time of each case is compared with benchmarks/baselines.json and the run
+fails when a case is slower than its baseline by more than the threshold. Cases
+whose dependencies are not installed are skipped. Save new baselines (on the same
+machine, after an intended change) with --save.
+
+Usage:
+    python benchmarks/suite.py [--repeat 5] [--threshold 0.25] [--save] [case ...]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import timeit
+from datetime import date, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+FIXTURES = os.path.join(REPO_ROOT, "benchmarks", "fixtures")
+BASELINES = os.path.join(REPO_ROOT, "benchmarks", "baselines.json")
+
+THRESHOLD = 0.25
+CHECK_SALE_SIZES = (10, 100, 1000, 5000)
+CATALOG_ROWS = 20000
+UPSERT_ROWS = 1000
+EMAIL_ROWS = 200
+
+CASES = {}
+
+
+def case(name):
+    """Register a benchmark case: a function doing its setup and returning the timed callable."""
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+def read_fixture(name, mode="r"):
+    with open(os.path.join(FIXTURES, name), mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+        return f.read()
+
+
+def quiet(func):
+    """Drop the per-item prints of the scrapers, which would be timed as well."""
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func()
+    return run
+
+
+@case("sales_post")
+def bench_sales_post():
+    from costco_price_scraper.price_scraper import price_scraper
+
+    html = read_fixture("sales_post.html", "rb")
+    return quiet(lambda: price_scraper.parse_sales_post(html))
+
+
+@case("coupon_page")
+def bench_coupon_page():
+    from costco_price_scraper.price_scraper import costco_coupon_scraper
+
+    html = read_fixture("online_offers.html")
+    return lambda: costco_coupon_scraper.parse_coupon_page(html)
+
+
+@case("parse_product_string")
+def bench_parse_product_string():
+    from costco_price_scraper.price_scraper import regex
+
+    texts = [entry["input"] for entry in json.loads(read_fixture("coupon_strings.json"))] * 20
+    return lambda: regex.parse_many(texts)
+
+
+@case("parse_receipt_json_data")
+def bench_parse_receipt_json_data():
+    from costco_price_scraper.receipt_scraper import receipt_scraper
+
+    receipt = json.loads(read_fixture("receipt.json"))
+    return quiet(lambda: [receipt_scraper.parse_receipt_json_data(receipt, "user@example.com") for _ in range(20)])
+
+
+def require_date_parse():
+    """`db_utils.date_parse` swallows the ImportError of dateutil inside SQLite, check it here."""
+    import dateutil.parser  # noqa: F401
+
+
+def sale_items(count, seed=0):
+    rng = random.Random(seed)
+    expiry = (date.today() + timedelta(days=30)).strftime("%m/%d/%y")
+    return [
+        [1000000 + index, f"Kirkland Signature Item {index}", rng.randint(1, 40), expiry, rng.randint(5, 400) + 0.99]
+        for index in range(count)
+    ]
+
+
+@case("upsert_items")
+def bench_upsert_items():
+    from costco_price_scraper.price_scraper import items_db
+
+    require_date_parse()
+    items_db.create_items_table()
+    items = sale_items(UPSERT_ROWS)
+    return lambda: items_db.upsert_items(items)
+
+
+def make_check_sale_case(size, snapshot=False):
+    def setup():
+        from costco_price_scraper.price_scraper import items_db, offer_snapshot
+
+        require_date_parse()
+        items_db.create_items_table()
+        items_db.upsert_items(sale_items(CATALOG_ROWS))
+        # Half of the IDs are on sale, as for a typical receipt history
+        rng = random.Random(size)
+        ids = rng.sample(range(1000000, 1000000 + CATALOG_ROWS * 2), size)
+        if snapshot:
+            offer_snapshot.publish()
+            return lambda: offer_snapshot.check_sale(ids)
+        return lambda: items_db.check_sale(ids)
+    return setup
+
+
+for _size in CHECK_SALE_SIZES:
+    case(f"check_sale_{_size}")(make_check_sale_case(_size))
+for _size in CHECK_SALE_SIZES:
+    case(f"snapshot_check_sale_{_size}")(make_check_sale_case(_size, snapshot=True))
+
+
+@case("receipt_email")
+def bench_receipt_email():
+    from costco_price_scraper.price_scraper.items_db import SaleOffer
+    from costco_price_scraper.receipt_scraper.receipts_db import ReceiptItem
+    from costco_price_scraper.utils import email_builder
+
+    today = date.today()
+    expiry = (today + timedelta(days=14)).isoformat()
+    rows = []
+    sale_item_hashmap = {}
+    for index in range(EMAIL_ROWS):
+        item_id = 1000000 + index
+        receipt_date = (today - timedelta(days=index % 30)).isoformat()
+        rows.append(ReceiptItem(item_id, f"Kirkland Signature Item {index}", 19.99, 1 + index % 3, 0,
+                                receipt_date, f"21134300501862412{index % 50:04d}", id=index))
+        sale_item_hashmap[item_id] = SaleOffer(item_id, f"Kirkland Signature Item {index}", 5.0, expiry, 14.99)
+    return lambda: email_builder.construct_receipt_email_body_and_subject(rows, sale_item_hashmap)
+
+
+def run_case(name, repeat):
+    """
+    Set up and time one case in a fresh working directory.
+
+    Returns:
+        float: The best time in seconds, or None if a dependency is missing.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # The modules use a relative scraped_prices.db
+        os.chdir(workdir)
+        try:
+            func = CASES[name]()
+            func()  # warm-up: imports, compiled templates, page cache
+            return min(timeit.repeat(func, number=1, repeat=repeat))
+        except ImportError as e:
+            print(f"{name:<26} skipped ({e})")
+            return None
+        finally:
+            os.chdir(cwd)
+
+
+def environment():
+    return {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system()}
+
+
+def load_baselines():
+    if not os.path.exists(BASELINES):
+        return {}
+    with open(BASELINES, encoding="utf-8") as f:
+        baselines = json.load(f)
+    if baselines.get("environment") != environment():
+        print(f"Baselines were recorded on {baselines.get('environment')}, comparisons are indicative only")
+    return baselines.get("results", {})
+
+
+def save_baselines(results):
+    baselines = {"results": {}}
+    if os.path.exists(BASELINES):
+        with open(BASELINES, encoding="utf-8") as f:
+            baselines = json.load(f)
+    baselines["environment"] = environment()
+    baselines["results"].update({name: round(seconds, 6) for name, seconds in results.items()})
+    with open(BASELINES, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"{len(results)} baselines written to {BASELINES}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cases", nargs="*", help=f"cases to run, all by default: {', '.join(CASES)}")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case, the fastest one counts")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="fail when a case is slower than its baseline by more than this fraction")
+    parser.add_argument("--save", action="store_true", help="save the results as the new baselines")
+    args = parser.parse_args()
+
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    baselines = load_baselines()
+    results = {}
+    regressions = []
+    print(f"{'case':<26} {'ms':>10} {'baseline':>10} {'change':>8}")
+    for name in args.cases or CASES:
+        seconds = run_case(name, args.repeat)
+        if seconds is None:
+            continue
+        results[name] = seconds
+        baseline = baselines.get(name)
+        if baseline is None:
+            print(f"{name:<26} {seconds * 1000:>10.2f} {'-':>10} {'new':>8}")
+            continue
+        change = seconds / baseline - 1
+        flag = "  REGRESSION" if change > args.threshold else ""
+        print(f"{name:<26} {seconds * 1000:>10.2f} {baseline * 1000:>10.2f} {change:>+8.0%}{flag}")
+        if flag:
+            regressions.append(name)
+
+    if args.save:
+        save_baselines(results)
+    elif regressions:
+        print(f"{len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}: "
+              f"{', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
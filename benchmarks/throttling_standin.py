@@ -0,0 +1,176 @@
+"""
+Local stand-in for a rate-limited, bot-protected host, and a demo of the per-host
+rate limiter and circuit breaker against it.
+
+The stand-in serves at most --limit requests per second. Requests over the limit
+get a 429 with 'Retry-After: 1'; after --block-after of those within ten seconds
+every request gets a 403 for --block-seconds, like a bot protection block.
+
+The demo starts the stand-in, then sends --requests requests from --workers threads,
+first with bare unpaced requests and then through `http_client` with its
+`rate_limiter`, and prints what the server answered and the limiter state.
+
+Usage:
+    python benchmarks/throttling_standin.py [--workers 8] [--requests 80] [--limit 5]
+    python benchmarks/throttling_standin.py --serve [--port 8090]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ThrottlingStandIn(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, limit=5, block_after=10, block_seconds=5.0):
+        super().__init__(address, _ThrottlingHandler)
+        self.limit = limit
+        self.block_after = block_after
+        self.block_seconds = block_seconds
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.throttled = deque()
+        self.blocked_until = 0.0
+        self.statuses = Counter()
+
+    def decide(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] >= 1.0:
+                self.recent.popleft()
+            while self.throttled and now - self.throttled[0] >= 10.0:
+                self.throttled.popleft()
+
+            if now < self.blocked_until:
+                status = 403
+            elif len(self.recent) >= self.limit:
+                self.throttled.append(now)
+                if len(self.throttled) >= self.block_after:
+                    self.blocked_until = now + self.block_seconds
+                    status = 403
+                else:
+                    status = 429
+            else:
+                self.recent.append(now)
+                status = 200
+            self.statuses[status] += 1
+            return status
+
+    def reset(self):
+        with self.lock:
+            self.recent.clear()
+            self.throttled.clear()
+            self.blocked_until = 0.0
+            self.statuses.clear()
+
+
+class _ThrottlingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _respond(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        status = self.server.decide()
+        body = b"ok" if status == 200 else b"Access Denied" if status == 403 else b"Too Many Requests"
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+def start(port=0, **kwargs):
+    """
+    Start the stand-in on a background thread.
+
+    Returns:
+        ThrottlingStandIn: The running server; its port is `server.server_address[1]`.
+    """
+    server = ThrottlingStandIn(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_burst(send, workers, requests_count):
+    outcomes = Counter()
+
+    def one(_):
+        try:
+            return str(send())
+        except Exception as e:
+            return type(e).__name__
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        outcomes.update(executor.map(one, range(requests_count)))
+    return outcomes, time.perf_counter() - start_time
+
+
+def demo(args):
+    # Faster settings than the defaults so the demo finishes in seconds
+    os.environ.setdefault("COSTCO_RATELIMIT_RATE", str(args.limit / 2))
+    os.environ.setdefault("COSTCO_RATELIMIT_BURST", "2")
+    os.environ.setdefault("COSTCO_RATELIMIT_COOLDOWN", "5")
+    os.environ.setdefault("COSTCO_HTTP_BACKOFF_BASE", "0.1")
+
+    import requests
+
+    from costco_price_scraper.utils import http_client, rate_limiter
+
+    server = start(limit=args.limit, block_after=args.block_after, block_seconds=args.block_seconds)
+    url = f"http://127.0.0.1:{server.server_address[1]}/online-offers.html"
+
+    outcomes, seconds = run_burst(lambda: requests.get(url, timeout=5).status_code, args.workers, args.requests)
+    print(f"bare requests:  {seconds:6.2f}s  client saw {dict(outcomes)}  server answered {dict(server.statuses)}")
+
+    time.sleep(args.block_seconds)
+    server.reset()
+    outcomes, seconds = run_burst(lambda: http_client.get(url).status_code, args.workers, args.requests)
+    print(f"rate limited:   {seconds:6.2f}s  client saw {dict(outcomes)}  server answered {dict(server.statuses)}")
+    rate_limiter.print_states()
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serve", action="store_true", help="only run the stand-in")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--limit", type=int, default=5, help="requests per second served")
+    parser.add_argument("--block-after", type=int, default=10, help="429s within 10s before blocking")
+    parser.add_argument("--block-seconds", type=float, default=5.0, help="length of a 403 block")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=80)
+    args = parser.parse_args()
+
+    if not args.serve:
+        demo(args)
+        return
+
+    server = ThrottlingStandIn(("127.0.0.1", args.port), args.limit, args.block_after, args.block_seconds)
+    print(f"Throttling stand-in listening on http://127.0.0.1:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Answered {dict(server.statuses)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,38 +5,63 @@ This module defines functions for scraping data from sales posts on a website,
 storing the data in a CSV file, and updating the database with the scraped information.
 
 Functions:
-- scrape_website(url): Scrape data from a website given its URL.
-- get_sales_post_urls(): Get relevant links for sales posts.
-- scrape_items_from_posts(post_urls_list): Scrape items from lists of sales posts.
+- fetch_coupon_page(url, book): Download the coupon book page, conditionally if cached.
+- parse_coupon_page(html): Parse the offers and validity window of the page.
+- scrape_coupons(url): Scrape data from a website given its URL.
+- fetch_mode(book, today): Decide whether the cached coupon book needs a refresh.
+- download_coupon_book(url, force): Download the coupon book unless the cached one is valid.
 - store_data_csv(data, filename): Store data in a CSV file.
-- run_price_scraper(): Orchestrates the price scraper workflow.
+- run_price_scraper(force): Orchestrates the price scraper workflow.
 
 Constants:
 - CSV_FILENAME (str): Default CSV file name for storing scraped data.
+- COUPON_BOOK_URL (str): The costco.com online offers page, overridden by COUPON_BOOK_URL
+  in the 'Sources' config section.
+- INSIDE_WINDOW (str): Default action inside the validity window, 'skip' or 'conditional'.
+- ROLLOVER_DAYS (int): Default days before the end of the window to start refreshing.
+- DEFAULT_EXPIRY_DATE (str): Expiry date of the offers of a book without a validity window.
 
-Note: The 'requests' library is used for making HTTP requests,
-and 'BeautifulSoup' is used for HTML parsing.
+The validity window, offers hash and HTTP validators of the last book are kept in
+the 'coupon_book' table, so most runs make no request to costco.com at all.
+
+Note: `http_client` is used for making HTTP requests, and
+`offer_extractor` reads the offers out of the page in a single pass.
 """
 import csv
+import hashlib
 import re
-from bs4 import BeautifulSoup
-import requests
+from datetime import date, datetime, timedelta
 
-from costco_price_scraper.price_scraper import items_db
-from costco_price_scraper.price_scraper.regex import parse_product_string
+from costco_price_scraper.price_scraper import items_db, offer_extractor, offer_snapshot
+from costco_price_scraper.price_scraper.regex import parse_many
+from costco_price_scraper.utils import config, http_client, telemetry
 
 CSV_FILENAME = "scraped_coupon_data.csv"
+COUPON_BOOK_URL = 'https://www.costco.com/online-offers.html'
 
+# What to do inside the validity window of the cached book: 'skip' or 'conditional'
+INSIDE_WINDOW = 'skip'
 
-def scrape_coupons(url):
+# Days before the end of the window from which the page is fetched on every run
+ROLLOVER_DAYS = 1
+
+# Expiry date of the offers when the disclaimer has no validity window
+DEFAULT_EXPIRY_DATE = '12/31/29'
+
+VALID_WINDOW_RE = re.compile(r'.*Valid (\d{1,2}/\d{1,2}/\d{1,2}) - (\d{1,2}/\d{1,2}/\d{1,2})')
+
+
+def fetch_coupon_page(url, book=None):
     """
-    Scrape data from a website.
+    Download the coupon book page.
 
     Args:
         url (str): The URL of the website.
+        book (CouponBook): The cached book; its ETag and Last-Modified make the
+            request conditional.
 
     Returns:
-        list: A list of lists containing scraped data.
+        The response, with status 304 if the page is unchanged.
     """
     cookies = {
         '_abck': '5E2FC32104AC7077E7171FA64E87C602~0~YAAQhHZAF6tGUpaUAQAAemzLrg2QD+a9rJ++leEPjL9uy31koefpeTE5PWYlNGm4g9fbTv1kQ3S2R6ugosuLSLzQYQUqCAj44xfukUyllsVL/3i+wh6tNpx9rnafXLP4otXr2XpTFv9DxYPS1/Mxw+9xd/PJIrpjuDUYFA7jr5N2hxDExNu/TvUj7267d5oHB4bcbYCANk7XmciDj7X9mm/WYtSJxIT2zIwJhH+UOx6OykT4zSSqCZoj6nGxNxMYaDF1o5wFGeGUWvR8Kh5IjHiC1TNb8DfmhI3RUbpDLllVl9p/K/lRpdxyu9TRM0j85AtKPrf/Y+jzLmkTcQgw8Pu8vUzH1HuTa9c1BhQFw/rAVXqY/qTmK8ra7Zvj/p1MIn717frg3GkKPljnazf+zLBL8d/oqogXCQl8Kr21PYA44zq25fCAyYS8HCknKYTusXQ4svuZ8Gjtok+vwiX11IElcE8RaMZY990lOLauvLasEUolFv+Qmdff0vQ/GwECMfn+AFICx5/vksBNYHsXVDCUr5m1VqiJAQiQjw7rfVTF4q9b+x/ydcyYOkDJdpcVD3NnNqR93VMlIbiYkUrg8XTH0BV9d5gWlefv6w6kJ8j89JdC7FJy/V9NJNitsKV4lh0mTweuefvVXK6zYLJTkm9OAMoAzdtXKVGiPM0fSYGMi0lB~-1~-1~-1',
@@ -105,47 +130,113 @@ def scrape_coupons(url):
     }
 
 
-    response = requests.get(url, cookies=cookies, headers=headers, timeout=19)
+    if book is not None:
+        if book.etag:
+            headers['If-None-Match'] = book.etag
+        if book.last_modified:
+            headers['If-Modified-Since'] = book.last_modified
+
+    with telemetry.span("coupons.fetch") as fetch_span:
+        response = http_client.get(url, cookies=cookies, headers=headers)
+        fetch_span.add(bytes=len(response.content))
+    return response
+
+
+def parse_valid_window(valid_match):
+    """
+    Read the 'Valid M/D/YY - M/D/YY' window of the coupon book disclaimer.
+
+    Args:
+        valid_match (re.Match): The `VALID_WINDOW_RE` match of the disclaimer, or None.
+
+    Returns:
+        tuple: (valid_from, valid_to) as ISO dates, or (None, None) if there is no window.
+    """
+    if not valid_match:
+        return None, None
+    return tuple(datetime.strptime(day, '%m/%d/%y').date().isoformat() for day in valid_match.groups())
+
+
+@telemetry.timed("coupons.parse")
+def parse_coupon_page(html):
+    """
+    Parse the warehouse offers of the coupon book page.
+
+    Args:
+        html (str): The page HTML.
+
+    Returns:
+        tuple: (list of lists containing scraped data, valid_from, valid_to, content hash
+        of the offers and disclaimer)
+    """
+    batch_data = []
+    # One pass over the page finds the warehouse offer tiles and the disclaimer
+    item_texts, disclaimer_header_text = offer_extractor.extract_offers(html)
+
+    valid_match = VALID_WINDOW_RE.match(disclaimer_header_text or '')
+    expiry_date = valid_match.group(2) if valid_match else DEFAULT_EXPIRY_DATE
+
+    for item_name, item_numbers, price, savings in parse_many(item_texts):
+        for item_id in item_numbers:
+            if item_id:
+                batch_data.append(
+                    [item_id, item_name, savings, expiry_date, price]
+                )
+
+    # Hash what is parsed rather than the raw page, which changes with every nonce
+    content_hash = hashlib.sha256(
+        '\n'.join([disclaimer_header_text or ''] + item_texts).encode('utf-8')
+    ).hexdigest()
+    valid_from, valid_to = parse_valid_window(valid_match)
+    return batch_data, valid_from, valid_to, content_hash
+
+
+def scrape_coupons(url):
+    """
+    Scrape data from a website.
+
+    Args:
+        url (str): The URL of the website.
+
+    Returns:
+        list: A list of lists containing scraped data.
+    """
+    response = fetch_coupon_page(url)
 
     if response.status_code == 200:
-        batch_data = []
-        soup = BeautifulSoup(response.content, "html5lib")
-        all_items = soup.find_all('div', class_='MuiBox-root mui-17tvcl1')
-        #coupons = soup.find_all("div", class_="MuiBox-root mui-1d73mkv")
-        coupons = []
-        for item in all_items:
-            location = item.find('div', {"class": re.compile('MuiTypography-root MuiTypography-bodyCopy.*')})
-            if location:
-                location_text = location.get_text()
-                if 'Warehouse' in location_text:
-                    coupons.append(item)
-
-        disclaimer_header_elements = soup.find_all('div', {"class": re.compile('MuiTypography-root MuiTypography-bodyCopy.*')})
-        for t in disclaimer_header_elements:
-            if t.get_text().startswith('Pricing shown'):
-                disclaimer_header_text = t.get_text()
-        # disclaimer_header_text = disclaimer_header_elements[0].get_text()
-        if disclaimer_header_text:
-            valid_date_pattern = r'(?:.*Valid \d{1,2}/\d{1,2}/\d{1,2} - )(\d{1,2}/\d{1,2}/\d{1,2})'
-            valid_to_match = re.match(valid_date_pattern, disclaimer_header_text)
-            expiry_date = valid_to_match.groups()[0]
-        else:
-            expiry_date = '12/31/29'
-
-        for item in coupons:
-            item_text = item.find("div", class_="MuiBox-root mui-1d73mkv")
-            item_name, item_numbers, price, savings = parse_product_string(item_text.get_text(' '))
-            for item_id in item_numbers:
-                if item_id:
-                    batch_data.append(
-                        [item_id, item_name, savings, expiry_date, price]
-                    )
-        return batch_data
+        return parse_coupon_page(response.text)[0]
     else:
         print(f"Failed to retrieve data. Status code: {response.status_code}")
         return None
 
 
+def fetch_mode(book, today):
+    """
+    Decide how to refresh the coupon book.
+
+    Inside the validity window of the cached book nothing is downloaded (or only a
+    conditional request is sent, with INSIDE_WINDOW = conditional in the 'Coupons'
+    config section). From ROLLOVER_DAYS before the end of the window, or when the
+    window is unknown, the page is fetched on every run so the next book is picked
+    up as soon as it is published.
+
+    Args:
+        book (CouponBook): The cached book, or None.
+        today (date): The current date.
+
+    Returns:
+        str: 'skip', 'conditional' or 'full'.
+    """
+    if book is None or not book.valid_from or not book.valid_to:
+        return 'full'
+
+    rollover_days = int(config.read_config('Coupons', 'ROLLOVER_DAYS', ROLLOVER_DAYS))
+    refresh_from = date.fromisoformat(book.valid_to) - timedelta(days=rollover_days)
+    if date.fromisoformat(book.valid_from) <= today < refresh_from:
+        return config.read_config('Coupons', 'INSIDE_WINDOW', INSIDE_WINDOW)
+    return 'full'
+
+
 def store_data_csv(data, filename):
     """
     Store data in a CSV file.
@@ -170,7 +261,53 @@ def store_data_csv(data, filename):
     print(f"Batch data written to {filename}")
 
 
-def run_price_scraper():
+def download_coupon_book(url, force=False):
+    """
+    Download and parse the coupon book, unless the cached book is still valid or
+    the page did not change.
+
+    The book is not saved here: the caller saves it with `items_db.save_coupon_book`
+    once its offers are stored, so a run that fails before that downloads the book
+    again instead of skipping it.
+
+    Args:
+        url (str): The coupon book URL.
+        force (bool): Download the page even inside the validity window.
+
+    Returns:
+        tuple: (scraped data, book to save). The data is [] if the book was not
+        downloaded or is unchanged, None if the download failed; the book is None
+        when there is nothing to save.
+    """
+    book = items_db.get_coupon_book(url)
+    mode = 'full' if force else fetch_mode(book, date.today())
+
+    if mode == 'skip':
+        print(f"Coupon book valid from {book.valid_from} to {book.valid_to}, skipping the download.")
+        return [], None
+
+    # A cached book makes the request conditional, also when rolling over to the next book
+    response = fetch_coupon_page(url, None if force else book)
+
+    if response.status_code == 304:
+        print("Coupon book not modified.")
+        return [], book
+    if response.status_code != 200:
+        print(f"Failed to retrieve data. Status code: {response.status_code}")
+        return None, None
+
+    batch_data, valid_from, valid_to, content_hash = parse_coupon_page(response.text)
+    new_book = items_db.CouponBook(
+        url, valid_from, valid_to, content_hash,
+        response.headers.get('ETag'), response.headers.get('Last-Modified'), None,
+    )
+    if book is not None and book.content_hash == content_hash and not force:
+        print(f"Coupon book unchanged (valid from {valid_from} to {valid_to}).")
+        return [], new_book
+    return batch_data, new_book
+
+
+def run_price_scraper(force=False):
     """
     Run the price scraper workflow.
 
@@ -182,54 +319,59 @@ def run_price_scraper():
     2. Print the list of obtained URLs.
     3. Create the items table in the database.
     4. Delete expired items from the database.
-    5. Scrape data from the sales posts using the obtained URLs.
+    5. Scrape data from the sales posts using the obtained URLs, unless the cached
+       coupon book is still valid or unchanged.
     6. If data is successfully scraped:
-        a. Upsert (update or insert) the scraped data into the database.
-        b. Remove duplicate entries based on item ID.
-        c. If unique data is obtained:
-            i. Store the unique scraped data in a CSV file.
-            ii. Print a success message.
+        a. Remove duplicate entries based on item ID.
+        b. Upsert (update or insert) the unique data into the database, publish
+           the offer snapshot and save the coupon book.
+        c. Store the unique scraped data in a CSV file.
     7. If the scraping process failed, print an error message.
+
+    Args:
+        force (bool): Download the coupon book even if the cached one is still valid.
+
+    Returns:
+        list: The unique scraped items, empty if the scraping process failed or the
+        cached coupon book was still valid.
     """
-    url = 'https://www.costco.com/online-offers.html'
+    url = config.read_config('Sources', 'COUPON_BOOK_URL', COUPON_BOOK_URL)
 
     # Step 2: Create the items table in the database
     items_db.create_items_table()
+    items_db.create_coupon_book_table()
 
     # Step 3: Delete expired items from the database
     items_db.delete_expired_items()
 
     # Step 4: Scrape data from the sales posts using the obtained URLs
-    scraped_data = scrape_coupons(url)
+    scraped_data, book = download_coupon_book(url, force)
+    if scraped_data == []:
+        if book is not None:
+            items_db.save_coupon_book(book)
+        return []
+    unique_data = []
 
     # Step 5: If data is successfully scraped
     if scraped_data:
-        # Step 6a: Upsert the scraped data into the database
-        items_db.upsert_items(scraped_data)
+        # Step 6a: Remove duplicate entries based on item ID, the last one wins as in the database
+        unique_data = list({item[0]: item for item in scraped_data}.values())
 
-        # Step 6b: Remove duplicate entries based on item ID
-        unique_dict = {}
-        for inner_list in scraped_data:
-            key = inner_list[0]
+        # Step 6b: Upsert the unique data into the database
+        items_db.upsert_items(unique_data)
+        offer_snapshot.publish()
+        # Only now are the offers of the book stored, so later runs may skip it
+        items_db.save_coupon_book(book)
 
-            # Only add the inner list if the key is not in the dictionary
-            if key not in unique_dict:
-                unique_dict[key] = inner_list
-
-        # Step 6c: Convert the dictionary values back to a list
-        scraped_data = list(unique_dict.values())
-
-        # Step 6d: If unique data is obtained
-        if scraped_data:
-            # Step 6d-i: Store the unique scraped data in a CSV file
-            store_data_csv(scraped_data, CSV_FILENAME)
-
-            # Step 6d-ii: Print a success message
-            print(f"Scraped_data stored in {CSV_FILENAME}")
+        # Step 6c: Store the unique scraped data in a CSV file
+        store_data_csv(unique_data, CSV_FILENAME)
+        print(f"Scraped_data stored in {CSV_FILENAME}")
 
     else:
         # Step 7: If the scraping process failed, print an error message
         print("Scraping failed.")
 
+    return unique_data
+
 if __name__ == '__main__':
     run_price_scraper()
\ No newline at end of file
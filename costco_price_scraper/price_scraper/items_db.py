@@ -2,25 +2,69 @@
 This module provides functions to interact with an SQLite database ('scraped_prices.db') for 
 managing item data.
 
+Classes:
+- `SaleOffer`: A sale item of the 'items' table, as returned by `check_sale`.
+
 Functions:
 - `create_items_table`: Create the 'items' table in the database if it doesn't exist.
-- `delete_expired_items`: Delete expired items from the 'items' table.
+- `create_items_archive_table`: Create the 'items_archive' table if it doesn't exist.
+- `delete_expired_items`: Move expired items from 'items' to 'items_archive'.
 - `upsert_items`: Update and insert items into the database.
+- `check_sale`: Check sale information based on item IDs.
+- `create_coupon_book_table`: Create the 'coupon_book' table if it doesn't exist.
+- `get_coupon_book`: Get the cached validity window and content hash of a coupon book.
+- `save_coupon_book`: Save the validity window and content hash of a coupon book.
 
 Usage:
 1. Use `create_items_table()` to initialize the 'items' table.
-2. Employ `delete_expired_items()` to remove items with expiry dates in the past.
+2. Employ `delete_expired_items()` to archive items with expiry dates in the past.
 3. Apply `upsert_items(items)` to update or insert a list of items into the 'items' table.
 
+Config ('Retention' section):
+- RETENTION_DAYS: Days past its expiry date an item stays in 'items'.
+- ARCHIVE_DAYS: Days past its expiry date an item stays in 'items_archive', 0 to keep
+  archived items forever.
+- BATCH_SIZE: Items archived or deleted per transaction.
+
 Note: Each function establishes a connection to the database, performs the necessary 
 operations, and commits changes. Ensure to close the database connection after usage.
 """
 import sqlite3
-from costco_price_scraper.utils.db_utils import date_parse
+from collections import namedtuple
+from costco_price_scraper.utils.db_utils import Record, date_parse, serialized_write
+from costco_price_scraper.utils import config, matcher, telemetry
 
 DB_FILE = "scraped_prices.db"
 
+RETENTION_DAYS = 0
+ARCHIVE_DAYS = 365
+RETENTION_BATCH_SIZE = 500
+
+# PRAGMA auto_vacuum value of incremental vacuum
+AUTO_VACUUM_INCREMENTAL = 2
+
+CouponBook = namedtuple(
+    "CouponBook",
+    ["url", "valid_from", "valid_to", "content_hash", "etag", "last_modified", "checked_at"],
+)
+
+
+class SaleOffer(Record):
+    """
+    An item on sale, with its per unit savings and the last day of the sale.
+    """
+
+    __slots__ = ("item_id", "item_name", "savings", "expiry_date", "sale_price")
+
+    def __init__(self, item_id, item_name, savings, expiry_date, sale_price):
+        self.item_id = item_id
+        self.item_name = item_name
+        self.savings = savings
+        self.expiry_date = expiry_date
+        self.sale_price = sale_price
+
 
+@serialized_write
 def create_items_table():
     """
     Create the 'items' table in the database if it doesn't exist.
@@ -40,23 +84,138 @@ def create_items_table():
         """
         )
 
+        # Index used by the retention to find the expired items
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_items_expiry_date ON items (expiry_date)")
 
+
+@serialized_write
+def create_items_archive_table():
+    """
+    Create the 'items_archive' table in the database if it doesn't exist.
+
+    An item can be archived once per expiry date, so the past sales of an item
+    are all kept.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS items_archive (
+                item_id INTEGER,
+                item_name TEXT,
+                savings REAL,
+                expiry_date DATE,
+                sale_price REAL,
+                archived_at DATETIME,
+                PRIMARY KEY (item_id, expiry_date)
+            )
+        """
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_items_archive_expiry_date ON items_archive (expiry_date)"
+        )
+
+
+def _read_retention_config(option, fallback):
+    return int(config.read_config("Retention", option, fallback))
+
+
+def _enable_incremental_vacuum(conn):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+        return
+    # The mode of an existing database only changes with a full VACUUM, done once
+    print("Switching the database to incremental vacuum, rebuilding it once")
+    conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+    conn.execute("VACUUM")
+
+
+def _archive_batch(conn, cutoff, batch_size):
+    cursor = conn.cursor()
+    cursor.execute(
+        # Items without a parseable expiry date never match a receipt either
+        "SELECT item_id FROM items WHERE expiry_date < ? OR expiry_date IS NULL LIMIT ?",
+        (cutoff, batch_size),
+    )
+    item_ids = [row[0] for row in cursor.fetchall()]
+    if not item_ids:
+        return 0
+    placeholders = ", ".join("?" for _ in item_ids)
+    cursor.execute(
+        f"""
+        INSERT OR REPLACE INTO items_archive (item_id, item_name, savings, expiry_date, sale_price, archived_at)
+        SELECT item_id, item_name, savings, expiry_date, sale_price, datetime('now', 'localtime')
+        FROM items
+        WHERE item_id IN ({placeholders})
+        """,
+        item_ids,
+    )
+    cursor.execute(f"DELETE FROM items WHERE item_id IN ({placeholders})", item_ids)
+    conn.commit()
+    return len(item_ids)
+
+
+def _purge_archive_batch(conn, cutoff, batch_size):
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        DELETE FROM items_archive
+        WHERE rowid IN (SELECT rowid FROM items_archive WHERE expiry_date < ? LIMIT ?)
+        """,
+        (cutoff, batch_size),
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+@serialized_write
 def delete_expired_items():
     """
-    Delete expired items from the 'items' table.
+    Move the items expired for more than RETENTION_DAYS from 'items' to 'items_archive'
+    and delete the archived items expired for more than ARCHIVE_DAYS.
+
+    Rows are moved in batches of BATCH_SIZE, one transaction each, so other processes
+    are never locked out for long. The pages freed are then returned to the file
+    system with an incremental vacuum, and the statistics of both tables are refreshed.
+
+    Returns:
+        tuple: (items archived, archived items deleted)
     """
-    #with sqlite3.connect(DB_FILE) as conn:
-    #    conn.create_function("date_parse", 1, date_parse)
-    #    cursor = conn.cursor()
-    #    cursor.execute(
-    #        """
-    #        DELETE FROM items
-    #        WHERE expiry_date < CURRENT_DATE;
-    #    """
-    #    )
-    pass
+    create_items_archive_table()
+    retention_days = _read_retention_config("RETENTION_DAYS", RETENTION_DAYS)
+    archive_days = _read_retention_config("ARCHIVE_DAYS", ARCHIVE_DAYS)
+    batch_size = _read_retention_config("BATCH_SIZE", RETENTION_BATCH_SIZE)
+
+    with telemetry.span("db.retention") as retention_span, sqlite3.connect(DB_FILE) as conn:
+        _enable_incremental_vacuum(conn)
+        cutoff = conn.execute("SELECT date('now', 'localtime', ?)", (f"-{retention_days} days",)).fetchone()[0]
+        archived = 0
+        while True:
+            moved = _archive_batch(conn, cutoff, batch_size)
+            archived += moved
+            if moved < batch_size:
+                break
+
+        purged = 0
+        if archive_days > 0:
+            cutoff = conn.execute("SELECT date('now', 'localtime', ?)", (f"-{archive_days} days",)).fetchone()[0]
+            while True:
+                deleted = _purge_archive_batch(conn, cutoff, batch_size)
+                purged += deleted
+                if deleted < batch_size:
+                    break
+
+        if archived or purged:
+            # Run as a script: through execute() the pragma only frees a single page
+            conn.executescript("PRAGMA incremental_vacuum;")
+            print(f"Archived {archived} expired items, deleted {purged} archived items")
+        # Upserts change the tables as well, the statistics are cheap to refresh on every run
+        conn.execute("ANALYZE items")
+        conn.execute("ANALYZE items_archive")
+        retention_span.add(items=archived + purged)
+    return archived, purged
 
 
+@serialized_write
 def upsert_items(items):
     """
     Update and insert items into the database using executemany().
@@ -64,7 +223,7 @@ def upsert_items(items):
     Args:
         items (list): A list of lists containing item data.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with telemetry.span("db.upsert_items", items=len(items)), sqlite3.connect(DB_FILE) as conn:
         conn.create_function("date_parse", 1, date_parse)
         cursor = conn.cursor()
 
@@ -75,6 +234,9 @@ def upsert_items(items):
             """,
             item,)
 
+        # Keep the materialized adjustment opportunities in sync with the new prices
+        matcher.refresh_opportunities_for_items(cursor, [item[0] for item in items])
+
         # Use executemany() for bulk inserts
         #cursor.executemany(
         #    """
@@ -85,12 +247,16 @@ def upsert_items(items):
         #)
 
 
+@telemetry.timed("db.check_sale")
 def check_sale(items):
     """
     Check sale information based on IDs passed in
 
     Args:
         items (list): A list of ids
+
+    Returns:
+        dict: 'total_savings' and 'sale_info', the list of `SaleOffer` records found.
     """
     with sqlite3.connect(DB_FILE) as conn:
         conn.create_function("date_parse", 1, date_parse)
@@ -99,31 +265,90 @@ def check_sale(items):
         # Query the database for sale information
         cursor.execute(
             """
-            SELECT item_id, item_name, savings, expiry_date, sale_price
+            SELECT {}
             FROM items
             WHERE item_id IN ({})
              AND strftime('%Y-%m-%d', expiry_date) >= strftime('%Y-%m-%d', 'now', 'localtime')
             """.format(
-                ",".join(map(str, items))
+                SaleOffer.columns(), ",".join(map(str, items))
             )
         )
 
         # Fetch the results
-        results = cursor.fetchall()
-
-    total_savings = sum(row[2] for row in results)
-
-    # Convert results to a list of dictionaries
-    sale_info = [
-        {
-            "item_id": row[0],
-            "item_name": row[1],
-            "savings": row[2],
-            "expiry_date": row[3],
-            "sale_price": row[4],
-        }
-        for row in results
-    ]
+        sale_info = SaleOffer.from_rows(cursor.fetchall())
+
+    total_savings = sum(offer.savings for offer in sale_info)
     refund_info = {"total_savings": total_savings, "sale_info": sale_info}
 
     return refund_info
+
+
+@serialized_write
+def create_coupon_book_table():
+    """
+    Create the 'coupon_book' table in the database if it doesn't exist.
+
+    The table holds one row per coupon book URL with the validity window of the
+    book last downloaded, the hash of its offers and the HTTP validators of the page.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS coupon_book (
+                url TEXT PRIMARY KEY,
+                valid_from DATE,
+                valid_to DATE,
+                content_hash TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                checked_at DATETIME
+            )
+        """
+        )
+
+
+def get_coupon_book(url):
+    """
+    Get the cached coupon book of a URL.
+
+    Args:
+        url (str): The coupon book URL.
+
+    Returns:
+        CouponBook: The cached book, or None if it was never downloaded.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT url, valid_from, valid_to, content_hash, etag, last_modified, checked_at
+            FROM coupon_book
+            WHERE url = ?
+            """,
+            (url,),
+        )
+        row = cursor.fetchone()
+
+    return CouponBook._make(row) if row else None
+
+
+@serialized_write
+def save_coupon_book(book):
+    """
+    Save the validity window, content hash and HTTP validators of a coupon book.
+
+    Args:
+        book (CouponBook): The book to save; `checked_at` is set to now.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO coupon_book (
+                url, valid_from, valid_to, content_hash, etag, last_modified, checked_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, datetime('now', 'localtime'))
+            """,
+            book[:6],
+        )
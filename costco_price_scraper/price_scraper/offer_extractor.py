@@ -0,0 +1,151 @@
+"""
+Module to extract the warehouse offers and the validity disclaimer from the
+costco.com online offers page in a single pass.
+
+The page is streamed once through the standard library `HTMLParser`. Only the
+offer tiles and the bodyCopy texts are tracked while the page is read, so no
+document tree is built and no part of the page is searched twice.
+
+Functions:
+- extract_offers(html): Get the text of the warehouse offers and the disclaimer.
+
+Constants:
+- TILE_CLASS (str): Class of an offer tile.
+- OFFER_TEXT_CLASS (str): Class of the offer text inside a tile.
+- BODY_COPY_PATTERN (str): Class pattern of the tile location and the page disclaimer.
+
+Note: The texts are built like BeautifulSoup's `get_text` (the offer text joined with
+spaces, the location and disclaimer without a separator) so `regex.parse_product_string`
+sees the same input as before.
+"""
+import re
+from html.parser import HTMLParser
+
+TILE_CLASS = "MuiBox-root mui-17tvcl1"
+OFFER_TEXT_CLASS = "MuiBox-root mui-1d73mkv"
+BODY_COPY_PATTERN = "MuiTypography-root MuiTypography-bodyCopy.*"
+
+_body_copy_re = re.compile(BODY_COPY_PATTERN)
+
+# Text inside these elements is not part of get_text()
+_SKIPPED_TEXT_TAGS = ("script", "style", "template")
+
+
+class _Capture:
+    """Text collected for one open div."""
+
+    __slots__ = ("kind", "parts", "tile")
+
+    def __init__(self, kind, tile):
+        self.kind = kind
+        self.parts = []
+        self.tile = tile
+
+
+class _Tile:
+    __slots__ = ("location", "offer_text")
+
+    def __init__(self):
+        self.location = None
+        self.offer_text = None
+
+
+class _OfferParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tiles = []
+        self.disclaimer = None
+        # One entry per open div: the list of captures it opened
+        self._divs = []
+        self._captures = []
+        self._tile = None
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TEXT_TAGS:
+            self._skip_depth += 1
+            return
+        if tag != "div":
+            return
+
+        opened = []
+        class_attr = None
+        for name, value in attrs:
+            if name == "class":
+                class_attr = " ".join((value or "").split())
+                break
+
+        if class_attr is not None:
+            if class_attr == TILE_CLASS and self._tile is None:
+                self._tile = _Tile()
+                opened.append(_Capture("tile", self._tile))
+            elif _body_copy_re.search(class_attr):
+                # The first bodyCopy of a tile is its location; every one may be the disclaimer
+                is_location = self._tile is not None and self._tile.location is None
+                opened.append(_Capture("body_copy", self._tile if is_location else None))
+            if class_attr == OFFER_TEXT_CLASS and self._tile is not None and self._tile.offer_text is None:
+                self._tile.offer_text = ""
+                opened.append(_Capture("offer_text", self._tile))
+
+        self._divs.append(opened)
+        self._captures.extend(opened)
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TEXT_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        if tag != "div" or not self._divs:
+            return
+
+        for capture in self._divs.pop():
+            self._captures.remove(capture)
+            self._close(capture)
+
+    def _close(self, capture):
+        if capture.kind == "tile":
+            self.tiles.append(capture.tile)
+            self._tile = None
+        elif capture.kind == "offer_text":
+            capture.tile.offer_text = " ".join(capture.parts)
+        else:
+            text = "".join(capture.parts)
+            if capture.tile is not None:
+                capture.tile.location = text
+            if text.startswith("Pricing shown"):
+                self.disclaimer = text
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        for capture in self._captures:
+            if capture.kind != "tile":
+                capture.parts.append(data)
+
+    def close(self):
+        super().close()
+        # Close any div left open at the end of the page
+        while self._divs:
+            self.handle_endtag("div")
+
+
+def extract_offers(html):
+    """
+    Extract the warehouse offers and the disclaimer from the online offers page.
+
+    Args:
+        html (str): The page HTML.
+
+    Returns:
+        tuple: (list of offer texts of the tiles sold in warehouses, disclaimer text
+        starting with 'Pricing shown' or None if the page has none)
+    """
+    parser = _OfferParser()
+    parser.feed(html)
+    parser.close()
+
+    offer_texts = [
+        tile.offer_text
+        for tile in parser.tiles
+        if tile.location and "Warehouse" in tile.location and tile.offer_text is not None
+    ]
+    return offer_texts, parser.disclaimer
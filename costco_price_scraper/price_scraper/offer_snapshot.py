@@ -0,0 +1,245 @@
+"""
+Module publishing the active offers of the 'items' table as an immutable binary
+snapshot, so sale lookups are a binary search in a memory-mapped file instead of a
+SQLite query.
+
+The scrapers publish a new snapshot after every run that changed the 'items' table.
+It is written to a temporary file of its own and renamed over SNAPSHOT_FILE, so
+readers see either the old or the new snapshot, never a partial one. Publishes of the
+same process (the scrapers run in parallel threads) take turns, so a snapshot read
+from an older state of the table never replaces a newer one. Every process maps the same
+file, so the pages are shared through the OS page cache.
+
+Layout (little-endian):
+- Header: magic (8s), offer count (uint32), reserved (uint32), publish time (float64).
+- Item IDs: count int64, sorted.
+- Offers: count records of sale price (float64), savings (float64), expiry date
+  (10 bytes, YYYY-MM-DD) and item name (NAME_WIDTH bytes of UTF-8, zero padded), in
+  item ID order.
+
+Classes:
+- `OfferSnapshot`: A mapped snapshot file.
+
+Functions:
+- `publish`: Write the snapshot of the active offers.
+- `get_snapshot`: Get the current snapshot, remapped after every publish.
+- `check_sale`: `items_db.check_sale` answered from the snapshot.
+
+Constants:
+- SNAPSHOT_FILE (str): Path of the snapshot, next to the database.
+- NAME_WIDTH (int): Bytes kept of each item name.
+
+Note: Offers expire at the end of their expiry date, which lookups check, so a
+snapshot published yesterday never returns an expired offer. Without a valid
+snapshot `check_sale` falls back to the SQLite query.
+"""
+
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from datetime import date
+
+from costco_price_scraper.price_scraper import items_db
+from costco_price_scraper.price_scraper.items_db import SaleOffer
+from costco_price_scraper.utils import telemetry
+
+DB_FILE = "scraped_prices.db"
+SNAPSHOT_FILE = "active_offers.bin"
+
+MAGIC = b"CSTOFR01"
+NAME_WIDTH = 64
+
+HEADER = struct.Struct("<8sIId")
+ITEM_ID = struct.Struct("<q")
+# ISO dates compare like the dates, so expiry checks need no conversion
+OFFER = struct.Struct(f"<dd10s{NAME_WIDTH}s")
+
+_publish_lock = threading.Lock()
+
+
+def _encode_name(name):
+    encoded = (name or "").encode("utf-8")[:NAME_WIDTH]
+    # Drop a character cut in half by the truncation
+    return encoded.decode("utf-8", "ignore").encode("utf-8")
+
+
+def _read_active_offers():
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT {SaleOffer.columns()}
+            FROM items
+            WHERE strftime('%Y-%m-%d', expiry_date) >= strftime('%Y-%m-%d', 'now', 'localtime')
+            ORDER BY item_id
+            """
+        )
+        return cursor.fetchall()
+
+
+def publish(path=None):
+    """
+    Write the snapshot of the offers of the 'items' table that have not expired.
+
+    Args:
+        path (str): Snapshot path, `SNAPSHOT_FILE` by default.
+
+    Returns:
+        int: Number of offers in the snapshot.
+    """
+    path = path or SNAPSHOT_FILE
+    with _publish_lock, telemetry.span("snapshot.publish") as publish_span:
+        rows = _read_active_offers()
+        ids = bytearray(ITEM_ID.size * len(rows))
+        offers = bytearray(OFFER.size * len(rows))
+        for index, (item_id, item_name, savings, expiry_date, sale_price) in enumerate(rows):
+            ITEM_ID.pack_into(ids, index * ITEM_ID.size, item_id)
+            OFFER.pack_into(offers, index * OFFER.size, sale_price, savings, expiry_date.encode("ascii"),
+                            _encode_name(item_name))
+
+        # A unique temporary file, other processes may be publishing as well
+        fd, temp_path = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix=".tmp",
+                                         dir=os.path.dirname(path) or ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, len(rows), 0, time.time()))
+                f.write(ids)
+                f.write(offers)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file readable by its owner only
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        publish_span.add(items=len(rows), bytes=HEADER.size + len(ids) + len(offers))
+    return len(rows)
+
+
+class OfferSnapshot:
+    """
+    A mapped snapshot file. Lookups only read the mapping, so threads share it
+    without a lock.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if stat.st_size < HEADER.size:
+                raise ValueError(f"{path} is not an offer snapshot")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count, _, self.published_at = HEADER.unpack_from(self._map)
+        offers_start = HEADER.size + ITEM_ID.size * self.count
+        if magic != MAGIC or stat.st_size != offers_start + OFFER.size * self.count:
+            raise ValueError(f"{path} is not an offer snapshot")
+        self._ids = memoryview(self._map)[HEADER.size:offers_start].cast("q")
+        self._offers_start = offers_start
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, item_id, today=None):
+        """
+        Look up the offer of an item.
+
+        Args:
+            item_id (int): The item ID.
+            today (date): The day the offer must still be valid on, today by default.
+
+        Returns:
+            SaleOffer: The offer, or None if the item is not on sale.
+        """
+        offers = self.lookup_many([item_id], today)
+        return offers[0] if offers else None
+
+    def lookup_many(self, item_ids, today=None):
+        """
+        Look up the offers of items.
+
+        Args:
+            item_ids (list): Item IDs, sorted.
+            today (date): The day the offers must still be valid on, today by default.
+
+        Returns:
+            list: The `SaleOffer` records found, in item ID order.
+        """
+        today = (today or date.today()).isoformat().encode("ascii")
+        ids, count, unpack_from, data = self._ids, self.count, OFFER.unpack_from, self._map
+        offers_start, offer_size = self._offers_start, OFFER.size
+        offers = []
+        index = 0
+        for item_id in item_ids:
+            # The IDs are sorted, so each search starts where the previous one ended
+            index = bisect_left(ids, item_id, index)
+            if index == count:
+                break
+            if ids[index] != item_id:
+                continue
+            sale_price, savings, expiry, name = unpack_from(data, offers_start + index * offer_size)
+            if expiry >= today:
+                offers.append(SaleOffer(item_id, name.rstrip(b"\0").decode("utf-8"), savings,
+                                        expiry.decode("ascii"), sale_price))
+        return offers
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot(path=None):
+    """
+    Get the current snapshot, mapping the file again after a publish.
+
+    Args:
+        path (str): Snapshot path, `SNAPSHOT_FILE` by default.
+
+    Returns:
+        OfferSnapshot: The snapshot, or None if there is no valid snapshot file.
+    """
+    global _snapshot
+    path = path or SNAPSHOT_FILE
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.key == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+        return snapshot
+    with _snapshot_lock:
+        try:
+            snapshot = OfferSnapshot(path)
+        except (OSError, ValueError) as e:
+            print(f"Could not map the offer snapshot: {e}")
+            return None
+        # The old mapping is unmapped once the lookups using it are done with it
+        _snapshot = snapshot
+    return snapshot
+
+
+@telemetry.timed("snapshot.check_sale")
+def check_sale(items):
+    """
+    Check sale information based on IDs passed in, from the snapshot.
+
+    Args:
+        items (list): A list of ids
+
+    Returns:
+        dict: 'total_savings' and 'sale_info', as `items_db.check_sale`.
+    """
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return items_db.check_sale(items)
+
+    # Unique and in item ID order, as the SQLite query returns them
+    sale_info = snapshot.lookup_many(sorted({int(item_id) for item_id in items}))
+    total_savings = sum(offer.savings for offer in sale_info)
+    return {"total_savings": total_savings, "sale_info": sale_info}
@@ -6,6 +6,7 @@ storing the data in a CSV file, and updating the database with the scraped infor
 
 Functions:
 - scrape_website(url): Scrape data from a website given its URL.
+- parse_sales_post(html): Parse the sale items of a sales post page.
 - get_sales_post_urls(): Get relevant links for sales posts.
 - scrape_items_from_posts(post_urls_list): Scrape items from lists of sales posts.
 - store_data_csv(data, filename): Store data in a CSV file.
@@ -13,19 +14,22 @@ Functions:
 
 Constants:
 - CSV_FILENAME (str): Default CSV file name for storing scraped data.
+- BLOG_URL (str): The frugalhotspot tag listing the sales posts, overridden by BLOG_URL
+  in the 'Sources' config section.
 
-Note: The 'requests' library is used for making HTTP requests,
+Note: `http_client` is used for making HTTP requests,
 and 'BeautifulSoup' is used for HTML parsing.
 """
 import csv
 from datetime import datetime, timedelta, timezone
 import re
 from bs4 import BeautifulSoup
-import requests
 
-from costco_price_scraper.price_scraper import items_db
+from costco_price_scraper.price_scraper import items_db, offer_snapshot
+from costco_price_scraper.utils import config, http_client, telemetry
 
 CSV_FILENAME = "scraped_data.csv"
+BLOG_URL = "https://www.frugalhotspot.com/tag/unadvertised/"
 
 
 def scrape_website(url):
@@ -38,59 +42,81 @@ def scrape_website(url):
     Returns:
         list: A list of lists containing scraped data.
     """
-    response = requests.get(url, timeout=5)
+    with telemetry.span("prices.fetch") as fetch_span:
+        response = http_client.get(url)
+        fetch_span.add(bytes=len(response.content))
 
     if response.status_code == 200:
-        soup = BeautifulSoup(response.content, "html5lib")
-
-        # pattern = re.compile(
-        #    r"(\d+) (.+?) \(\$([\d.]+) INSTANT SAVINGS EXPIRES ON (\d{4}-\d{2}-\d{2})\) \$(\d+\.\d+)"
-        # )
-        # https://regex101.com/r/vXUiI8/1
-        pattern = re.compile(
-            r"(.+?) \$(\d+\.\d+) \(exp (\d{1,2}\/\d{1,2}\/\d{1,2})\.? \$(\d+) saved\. Item \#(\d+)\)"
-        )
-
-        batch_data = []
-        blocks = soup.find_all("ul", class_="wp-block-list")
-        for idx, block in enumerate(blocks):
-            list_items = block.find_all("li", recursive=False)
-            for iidx, item in enumerate(list_items):
-                matches = pattern.findall(item.text)
-
-                current_date = datetime.now().date()
-
-                # Print extracted data
-                for match in matches:
-                    # item_id, item_name, savings, expiry_date, sale_price = match
-                    item_name, sale_price, expiry_date, savings, item_id = match
-                    # check for valid dates
-                    try:
-                        #expiry_date_obj = datetime.strptime(expiry_date, "%Y-%m-%d").date()
-                        expiry_date_obj = datetime.strptime(expiry_date, "%m/%d/%y").date()
-                    except ValueError:
-                        print(f"Invalid date format: {expiry_date}")
-                        continue
-                    # Check if the item is not past its expiry date
-                    if expiry_date_obj >= current_date:
-                        batch_data.append(
-                            [item_id, item_name, savings, expiry_date, sale_price]
-                        )
-                        print(f"Item ID: {item_id}")
-                        print(f"Item Name: {item_name}")
-                        print(f"Savings: ${savings}")
-                        print(f"Expiry Date: {expiry_date}")
-                        print(f"Sale Price: ${sale_price}")
-                        print("\n")
-                    else:
-                        print(f"Item ID: {item_id} has expired and will not be included.")
-
-        return batch_data
+        return parse_sales_post(response.content)
     else:
         print(f"Failed to retrieve data. Status code: {response.status_code}")
         return None
 
 
+def parse_sales_post(html):
+    """
+    Parse the sale items of a sales post page.
+
+    Args:
+        html (str or bytes): The page HTML.
+
+    Returns:
+        list: A list of lists containing scraped data.
+    """
+    with telemetry.span("prices.parse", bytes=len(html)) as parse_span:
+        batch_data = _parse_sales_post(html)
+        parse_span.add(items=len(batch_data))
+    return batch_data
+
+
+def _parse_sales_post(html):
+    soup = BeautifulSoup(html, "html5lib")
+
+    # pattern = re.compile(
+    #    r"(\d+) (.+?) \(\$([\d.]+) INSTANT SAVINGS EXPIRES ON (\d{4}-\d{2}-\d{2})\) \$(\d+\.\d+)"
+    # )
+    # https://regex101.com/r/vXUiI8/1
+    pattern = re.compile(
+        r"(.+?) \$(\d+\.\d+) \(exp (\d{1,2}\/\d{1,2}\/\d{1,2})\.? \$(\d+) saved\. Item \#(\d+)\)"
+    )
+
+    batch_data = []
+    blocks = soup.find_all("ul", class_="wp-block-list")
+    for idx, block in enumerate(blocks):
+        list_items = block.find_all("li", recursive=False)
+        for iidx, item in enumerate(list_items):
+            matches = pattern.findall(item.text)
+
+            current_date = datetime.now().date()
+
+            # Print extracted data
+            for match in matches:
+                # item_id, item_name, savings, expiry_date, sale_price = match
+                item_name, sale_price, expiry_date, savings, item_id = match
+                # check for valid dates
+                try:
+                    #expiry_date_obj = datetime.strptime(expiry_date, "%Y-%m-%d").date()
+                    expiry_date_obj = datetime.strptime(expiry_date, "%m/%d/%y").date()
+                except ValueError:
+                    print(f"Invalid date format: {expiry_date}")
+                    continue
+                # Check if the item is not past its expiry date
+                if expiry_date_obj >= current_date:
+                    batch_data.append(
+                        [item_id, item_name, savings, expiry_date, sale_price]
+                    )
+                    print(f"Item ID: {item_id}")
+                    print(f"Item Name: {item_name}")
+                    print(f"Savings: ${savings}")
+                    print(f"Expiry Date: {expiry_date}")
+                    print(f"Sale Price: ${sale_price}")
+                    print("\n")
+                else:
+                    print(f"Item ID: {item_id} has expired and will not be included.")
+
+    return batch_data
+
+
 def get_sales_post_urls():
     """
     Get relevant links for sales posts.
@@ -98,7 +124,7 @@ def get_sales_post_urls():
     Returns:
         list: A list of URLs for sales posts.
     """
-    base_url = "https://www.frugalhotspot.com/tag/unadvertised/"
+    base_url = config.read_config("Sources", "BLOG_URL", BLOG_URL)
 
     urls_list = []
     for page_number in range(1, 2):
@@ -106,7 +132,9 @@ def get_sales_post_urls():
         page_url = f"{base_url}/page/{page_number}/"
 
         # Send an HTTP request to the URL
-        response = requests.get(page_url, timeout=5)
+        with telemetry.span("prices.listing") as listing_span:
+            response = http_client.get(page_url)
+            listing_span.add(bytes=len(response.content))
 
         if response.status_code == 200:
             # Parse HTML content of the page
@@ -203,12 +231,14 @@ def run_price_scraper():
     4. Delete expired items from the database.
     5. Scrape data from the sales posts using the obtained URLs.
     6. If data is successfully scraped:
-        a. Upsert (update or insert) the scraped data into the database.
-        b. Remove duplicate entries based on item ID.
-        c. If unique data is obtained:
-            i. Store the unique scraped data in a CSV file.
-            ii. Print a success message.
+        a. Remove duplicate entries based on item ID.
+        b. Upsert (update or insert) the unique data into the database and
+           publish the offer snapshot.
+        c. Store the unique scraped data in a CSV file.
     7. If the scraping process failed, print an error message.
+
+    Returns:
+        list: The unique scraped items, empty if the scraping process failed.
     """
     # Step 1: Get the list of URLs for sales posts
     post_urls_list = get_sales_post_urls()
@@ -222,32 +252,23 @@ def run_price_scraper():
 
     # Step 4: Scrape data from the sales posts using the obtained URLs
     scraped_data = scrape_items_from_posts(post_urls_list)
+    unique_data = []
 
     # Step 5: If data is successfully scraped
     if scraped_data:
-        # Step 6a: Upsert the scraped data into the database
-        items_db.upsert_items(scraped_data)
-
-        # Step 6b: Remove duplicate entries based on item ID
-        unique_dict = {}
-        for inner_list in scraped_data:
-            key = inner_list[0]
-
-            # Only add the inner list if the key is not in the dictionary
-            if key not in unique_dict:
-                unique_dict[key] = inner_list
+        # Step 6a: Remove duplicate entries based on item ID, the last one wins as in the database
+        unique_data = list({item[0]: item for item in scraped_data}.values())
 
-        # Step 6c: Convert the dictionary values back to a list
-        scraped_data = list(unique_dict.values())
+        # Step 6b: Upsert the unique data into the database
+        items_db.upsert_items(unique_data)
+        offer_snapshot.publish()
 
-        # Step 6d: If unique data is obtained
-        if scraped_data:
-            # Step 6d-i: Store the unique scraped data in a CSV file
-            store_data_csv(scraped_data, CSV_FILENAME)
-
-            # Step 6d-ii: Print a success message
-            print(f"Scraped_data stored in {CSV_FILENAME}")
+        # Step 6c: Store the unique scraped data in a CSV file
+        store_data_csv(unique_data, CSV_FILENAME)
+        print(f"Scraped_data stored in {CSV_FILENAME}")
 
     else:
         # Step 7: If the scraping process failed, print an error message
         print("No Unadvertised deals available")
+
+    return unique_data
@@ -1,5 +1,70 @@
+"""
+Module to parse the text of a costco.com coupon into its item name, item numbers,
+price and savings.
+
+The patterns are compiled once at import time. After the "Limit XX" suffix is cut
+off, a single combined pattern extracts the price/savings prefix, the item name and
+the item numbers in one pass over the text.
+
+Functions:
+- parse_product_string(text): Parse the text of one coupon.
+- parse_many(texts): Parse the texts of a whole coupon book.
+
+Golden outputs for the parser live in benchmarks/fixtures/coupon_strings.json and
+are checked by benchmarks/regex_benchmark.py.
+"""
 import re
-from decimal import Decimal
+
+# "Limit XX" at the end of the string
+LIMIT_RE = re.compile(r',?\s?Limit.*')
+
+# Price/savings formats at the start of the string
+PRICE_PATTERN = r'\$ (?:(\d+)(?: (\d+))? After \$(\d+) OFF|(\d+)(?: (\d+))? OFF) '
+PRICE_RE = re.compile('^' + PRICE_PATTERN)
+
+# "Item" and everything after it
+ITEM_SUFFIX_RE = re.compile(r'Item.*')
+
+# Item numbers
+ITEM_NUMBERS_RE = re.compile(r'Item ((?:\d+(?:,\s*)?)+)')
+
+# Price/savings prefix, item name up to the first "Item", then the item numbers
+PRODUCT_RE = re.compile(
+    r'(?:' + PRICE_PATTERN + r')?'
+    r'(.*?)'
+    r'(?:Item(?: ((?:\d+(?:,\s*)?)+))?.*)?'
+)
+
+
+def _price_and_savings(groups):
+    dollars, cents, after_savings, savings_dollars, savings_cents = groups
+    if after_savings:  # "After $X OFF" format
+        return float(f"{dollars}.{cents or '00'}"), float(after_savings)
+    if savings_dollars:  # "$X OFF" format
+        if savings_cents:  # If there are cents
+            return None, float(f"{savings_dollars}.{savings_cents}")
+        return None, float(savings_dollars)
+    return None, None
+
+
+def _split_item_numbers(item_numbers):
+    return [num.strip() for num in item_numbers.split(',')]
+
+
+def _parse_multiline(text):
+    """
+    Parse a string with line breaks step by step, as '.' stops at the end of every line.
+    """
+    text = LIMIT_RE.sub('', text)
+    price_match = PRICE_RE.match(text)
+    price, savings = _price_and_savings(price_match.groups()) if price_match else (None, None)
+
+    item_numbers_match = ITEM_NUMBERS_RE.search(text)
+    item_numbers = _split_item_numbers(item_numbers_match.group(1)) if item_numbers_match else []
+
+    name_text = PRICE_RE.sub('', text)
+    name_text = ITEM_SUFFIX_RE.sub('', name_text)
+    return name_text.strip(), item_numbers, price, savings
 
 
 def parse_product_string(text: str):
@@ -10,52 +75,41 @@ def parse_product_string(text: str):
         text: Product string to parse
 
     Returns:
-        List containing extracted information
+        Tuple of (item name, list of item numbers, price or None, savings or None)
     """
+    if '\n' in text:
+        return _parse_multiline(text)
+
     # Remove the "Limit XX" at the end of the string
-    limit_pattern = r'(,?\s?Limit.*)'
-    text = re.sub(limit_pattern, '', text)
-
-    # Pattern to match different price/savings formats at start of string
-    price_pattern = r'^\$ (?:(\d+)(?: (\d+))? After \$(\d+) OFF|(\d+)(?: (\d+))? OFF) '
-
-    # Pattern to match item numbers
-    item_numbers_pattern = r'Item ((?:\d+(?:,\s*)?)+)'
-
-    # Extract price/savings information
-    price_match = re.match(price_pattern, text)
-
-    price = None
-    savings = None
-
-    if price_match:
-        groups = price_match.groups()
-        if groups[2]:  # "After $X OFF" format
-            dollars, cents = groups[0], groups[1]
-            price = Decimal(f"{dollars}.{cents or '00'}")
-            price = float(price)
-            savings = Decimal(groups[2])
-            savings = float(savings)
-        elif groups[3]:  # "$X OFF" format
-            savings = Decimal(groups[3])
-            savings = float(savings)
-            if groups[4]:  # If there are cents
-                savings = Decimal(f"{groups[3]}.{groups[4]}")
-                savings = float(savings)
-
-    # Extract item numbers
-    item_numbers_match = re.search(item_numbers_pattern, text)
-    item_numbers = []
-    if item_numbers_match:
-        item_numbers = [num.strip() for num in item_numbers_match.group(1).split(',')]
-
-    # Extract item name by removing the price/savings prefix and the Item numbers suffix
-    name_text = re.sub(price_pattern, '', text)
-    # name_text = re.sub(r'Item (?:\d+(?:,\s*)?)+(?:,\s*Limit \d+)?\.?$', '', name_text)
-    name_text = re.sub(r'Item.*', '', name_text)
-    item_name = name_text.strip()
-
-    return item_name, item_numbers, price, savings
+    if 'Limit' in text:
+        limit_match = LIMIT_RE.search(text)
+        if limit_match:
+            text = text[:limit_match.start()]
+
+    match = PRODUCT_RE.fullmatch(text)
+    price, savings = _price_and_savings(match.group(1, 2, 3, 4, 5))
+
+    item_numbers = match.group(7)
+    if item_numbers is None and match.end(6) < len(text):
+        # The first "Item" is not followed by numbers, look further
+        item_numbers_match = ITEM_NUMBERS_RE.search(text, match.end(6))
+        item_numbers = item_numbers_match.group(1) if item_numbers_match else None
+
+    item_numbers = _split_item_numbers(item_numbers) if item_numbers is not None else []
+    return match.group(6).strip(), item_numbers, price, savings
+
+
+def parse_many(texts):
+    """
+    Parse the product strings of a whole coupon book.
+
+    Args:
+        texts: Iterable of product strings
+
+    Returns:
+        List of (item name, item numbers, price, savings) tuples, in input order
+    """
+    return [parse_product_string(text) for text in texts]
 
 
 if __name__ == '__main__':
@@ -68,8 +122,7 @@ if __name__ == '__main__':
     ]
 
     # Run tests
-    for test_string in test_strings:
-        item_name, item_numbers, price, savings = parse_product_string(test_string)
+    for test_string, (item_name, item_numbers, price, savings) in zip(test_strings, parse_many(test_strings)):
         print(f"\nInput: {test_string}")
         print(f"Item Name: {item_name}")
         print(f"Item Numbers: {', '.join(item_numbers)}")
@@ -13,10 +13,22 @@ Usage:
 """
 
 import datetime
-import requests
 import json
 
+from costco_price_scraper.utils import config, http_client, telemetry
+
 CLIENT_IDENTIFIER = "481b1aec-aa3b-454b-b81b-48187e28f205"
+ORDERS_API_URL = "https://ecom-api.costco.com/ebusiness/order/v1/orders/graphql"
+
+
+def get_orders_api_url():
+    """
+    Get the orders GraphQL endpoint, overridden by ORDERS_API_URL in the 'Sources' config section.
+
+    Returns:
+    - str: The endpoint URL.
+    """
+    return config.read_config("Sources", "ORDERS_API_URL", ORDERS_API_URL)
 
 
 def get_recent_receipts(id_token, client_id):
@@ -31,7 +43,7 @@ def get_recent_receipts(id_token, client_id):
     - response: The API response.
     """
     start_date_str, end_date_str = calculate_recent_dates()
-    url = "https://ecom-api.costco.com/ebusiness/order/v1/orders/graphql"
+    url = get_orders_api_url()
 
     headers = generate_headers(id_token, client_id)
 
@@ -63,7 +75,7 @@ def receipt_details_request(id_token, client_id, receipt_id):
     Returns:
     - response: The API response.
     """
-    url = "https://ecom-api.costco.com/ebusiness/order/v1/orders/graphql"
+    url = get_orders_api_url()
 
     headers = generate_headers(id_token, client_id)
 
@@ -153,10 +165,11 @@ def make_api_request(url, headers, payload):
     Returns:
     - response: The API response.
     """
-    response = requests.post(url, headers=headers, json=payload, timeout=10)
-    print(response.request)
-    print(response.status_code)
-    print(response.json())
+    with telemetry.span("api.graphql") as api_span:
+        # The GraphQL queries only read, so they are safe to retry
+        response = http_client.post(url, headers=headers, json=payload, idempotent=True)
+        api_span.add(bytes=len(response.content))
+    print(f"{response.request.method} {url}: {response.status_code}, {len(response.content)} bytes")
     return response
 
 
@@ -171,7 +184,9 @@ def parse_transaction_data(json_data):
     - list: Parsed transaction data.
     """
     try:
-        receipts = json_data.get("data", {}).get("receipts", [])
+        data = json_data.get("data", {})
+        # The receiptsWithCounts query nests the receipts under its own field
+        receipts = data.get("receiptsWithCounts", data).get("receipts", [])
         parsed_transactions = []
 
         for receipt in receipts:
@@ -11,8 +11,8 @@ from datetime import datetime
 import os
 import re
 import time
-import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from bs4 import BeautifulSoup
 from selenium.webdriver.common.by import By
@@ -21,12 +21,15 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
 import undetected_chromedriver as uc
 
-from costco_price_scraper.utils import config
+from costco_price_scraper.utils import config, telemetry
 from costco_price_scraper.receipt_scraper import receipts_db
 from costco_price_scraper.receipt_scraper import receipt_api
 
 LOGON_URL = "https://www.costco.com/LogonForm" # Done: Change to USA
 
+# Receipt items upserted at once while streaming the receipts
+RECEIPT_BATCH_SIZE = 500
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -46,21 +49,33 @@ def get_chrome_path():
         raise ValueError(f"The Chrome path {chrome_path} is invalid or not accessible.")
     return chrome_path
 
-def initialize_webdriver(retries=3):
-    """Initializes the Chrome webdriver with specified options."""
+def initialize_webdriver(retries=3, profile_dir=None):
+    """
+    Initializes the Chrome webdriver with specified options.
+
+    Parameters:
+    - retries: Number of attempts to start Chrome
+    - profile_dir: Optional browser profile directory. When given, the browser runs
+      isolated in that profile and other Chrome processes are left running.
+    """
 
     chrome_path = get_chrome_path()
     attempt = 0
     while attempt < retries:
         try:
-            kill_existing_chrome()
+            if profile_dir is None:
+                kill_existing_chrome()
             options = uc.ChromeOptions()
             # options.binary_location = chrome_path
             # driver = uc.Chrome(options=options, version_main=122)
             prefs = {"credentials_enable_service": False,
                      "profile.password_manager_enabled": False}
             options.add_experimental_option("prefs", prefs)
-            driver = uc.Chrome(options=options)
+            if profile_dir is not None:
+                os.makedirs(profile_dir, exist_ok=True)
+                driver = uc.Chrome(options=options, user_data_dir=profile_dir)
+            else:
+                driver = uc.Chrome(options=options)
             return driver
         except Exception as e:
             attempt += 1
@@ -190,6 +205,7 @@ def get_id_token(driver):
     return id_token
 
 
+@telemetry.timed("receipts.capture_screenshot")
 def capture_screenshot(driver, folder, filename):
     """
     Captures a screenshot using the WebDriver.
@@ -277,10 +293,16 @@ def check_for_discount_prefix(name):
         return None
 
 
-def initialize_scraper():
+@telemetry.timed("receipts.login")
+def initialize_scraper(username=None, password=None, profile_dir=None):
     """
     Initializes the scraper by creating necessary tables and performing login.
 
+    Parameters:
+    - username: Costco account username, read from the config when not given
+    - password: Costco account password, read from the config when not given
+    - profile_dir: Optional browser profile directory for this account
+
     Returns:
     - driver: Initialized WebDriver instance
     - client_id: The client ID
@@ -288,8 +310,9 @@ def initialize_scraper():
     receipts_db.create_receipts_table()
     receipts_db.create_receipt_items_table()
 
-    username, password = config.read_login_config()
-    driver = initialize_webdriver()
+    if username is None or password is None:
+        username, password = config.read_login_config()
+    driver = initialize_webdriver(profile_dir=profile_dir)
     load_login_page(driver)
     client_id = get_client_id(driver)
     login(driver, username, password)
@@ -321,7 +344,7 @@ def parse_receipt_json_data(json_data, username):
     - json_data: JSON data representing a receipt
 
     Returns:
-    - receipt_items: List of tuples representing receipt items
+    - receipt_items: List of `receipts_db.ReceiptItem` records
     """
     receipt_items = []
     discount_id_set = set()
@@ -352,24 +375,18 @@ def parse_receipt_json_data(json_data, username):
             amount = item.get("amount", "")
             on_sale = item_id in discount_id_set
 
-            item_dict = {
-                "item_id": item_id,
-                "item_name": item_name,
-                "amount": amount,
-                "unit": unit,
-                "on_sale": on_sale,
-                "receipt_date": receipt_date,
-                "receipt_id": receipt_id,
-                "receipt_type": receipt_type,
-                "username": username
-            }
-            receipt_items.append(item_dict)
+            receipt_items.append(
+                receipts_db.ReceiptItem(
+                    item_id, item_name, amount, unit, on_sale, receipt_date, receipt_id, receipt_type, username
+                )
+            )
     except (AttributeError, KeyError) as e:
         print(f'Error parsing receipt information: {e}')
 
     return receipt_items
 
 
+@telemetry.timed("receipts.screenshots")
 def get_screenshots(driver, all_receipt_ids_set, all_receipts=False):
     """
     Processes the 'View Receipt' buttons to capture screenshots.
@@ -421,8 +438,7 @@ def get_screenshots(driver, all_receipt_ids_set, all_receipts=False):
                     break
                 else:
                     # receipts to add to db
-                    receipt_tuple = (receipt_id, date_time_str, receipt_path)
-                    new_receipts.append(receipt_tuple)
+                    new_receipts.append(receipts_db.Receipt(receipt_id, date_time_str, receipt_path))
 
                 close_popup = driver.find_element(
                     By.CSS_SELECTOR, 'button.MuiButtonBase-root[aria-label="Close"]'
@@ -441,36 +457,29 @@ def get_screenshots(driver, all_receipt_ids_set, all_receipts=False):
     receipts_db.upsert_receipt_data(new_receipts)
 
 
-def run_receipt_scraper_with_api(all_receipts=False):
+def iter_receipt_data(id_token, client_id, all_receipt_ids_set, all_receipts=False):
     """
-    The main function to execute the Costco Price Scraper.
+    Fetches the recent receipts and yields the details of the new ones from the API,
+    one receipt at a time as they arrive.
 
-    Returns:
-        all_items_list: List of items retrieved from the database
+    Parameters:
+    - id_token: The user's ID token
+    - client_id: The client ID
+    - all_receipt_ids_set: Set of all processed receipt IDs
+    - all_receipts: Whether to also refetch every processed receipt
+
+    Yields:
+    - receipt_json: The decoded JSON of one receipt
     """
-    driver, client_id = initialize_scraper()
-    id_token = get_id_token(driver)
     recent_receipts_response = receipt_api.get_recent_receipts(id_token, client_id)
-    all_receipt_ids_set = set(receipts_db.get_all_receipt_ids())
-
-    # # Use threading to run get_screenshots without blocking
-    # screenshot_thread = threading.Thread(
-    #     target=get_screenshots, args=(driver, all_receipt_ids_set)
-    # )
-    # screenshot_thread.start()
-
-    get_screenshots(driver, all_receipt_ids_set, all_receipts)
-    username = config.read_username_config()
-
     if recent_receipts_response.status_code == 200:
         parsed_data = receipt_api.parse_transaction_data(
             recent_receipts_response.json()
         )
     else:
         parsed_data = None
-
-    unprocessed_receipt_data = []
-    all_receipt_items_list = []
+    # Only the barcodes are needed while the receipts are fetched
+    del recent_receipts_response
 
     if parsed_data:
         for transaction in parsed_data:
@@ -484,9 +493,7 @@ def run_receipt_scraper_with_api(all_receipts=False):
                 receipt_response = receipt_api.receipt_details_request(
                     id_token, client_id, transaction["transactionBarcode"]
                 )
-                print(receipt_response.status_code)
-                print(receipt_response.json())
-                unprocessed_receipt_data.append(receipt_response.json())
+                yield receipt_response.json()
             else:
                 print(
                     f"Transaction {transaction['transactionBarcode']} is NOT within 30 days."
@@ -497,16 +504,102 @@ def run_receipt_scraper_with_api(all_receipts=False):
             receipt_response = receipt_api.receipt_details_request(
                 id_token, client_id, receipt_id
             )
-            print(receipt_response.status_code)
-            # print(receipt_response.json())
-            unprocessed_receipt_data.append(receipt_response.json())
+            yield receipt_response.json()
+
 
-    for receipt_json in unprocessed_receipt_data:
-        all_receipt_items_list.extend(parse_receipt_json_data(receipt_json, username))
-    receipts_db.upsert_receipt_items_data(all_receipt_items_list)
+def iter_receipt_items(id_token, client_id, all_receipt_ids_set, username, all_receipts=False):
+    """
+    Yields the parsed items of each receipt returned by `iter_receipt_data`, one list
+    per receipt.
 
-    all_items_list = receipts_db.get_all_user_items_not_on_sale(username)
-    return all_items_list
+    Parameters:
+    - id_token: The user's ID token
+    - client_id: The client ID
+    - all_receipt_ids_set: Set of all processed receipt IDs
+    - username: Username stored with the receipt items
+    - all_receipts: Whether to also refetch every processed receipt
+
+    Yields:
+    - receipt_items: List of `receipts_db.ReceiptItem` records of one receipt
+    """
+    for receipt_json in iter_receipt_data(id_token, client_id, all_receipt_ids_set, all_receipts):
+        with telemetry.span("receipts.parse") as parse_span:
+            receipt_items = parse_receipt_json_data(receipt_json, username)
+            parse_span.add(items=len(receipt_items))
+        yield receipt_items
+
+
+def store_receipt_items(id_token, client_id, all_receipt_ids_set, username, all_receipts=False,
+                        batch_size=RECEIPT_BATCH_SIZE):
+    """
+    Fetches, parses and upserts the receipt items as the receipts arrive, in batches
+    of whole receipts, so memory does not grow with the number of receipts.
+
+    Parameters:
+    - id_token: The user's ID token
+    - client_id: The client ID
+    - all_receipt_ids_set: Set of all processed receipt IDs
+    - username: Username stored with the receipt items
+    - all_receipts: Whether to also refetch every processed receipt
+    - batch_size: Receipt items collected before an upsert
+
+    Returns:
+    - stored: Number of receipt items upserted
+    """
+    stored = 0
+    batch = []
+    for receipt_items in iter_receipt_items(id_token, client_id, all_receipt_ids_set, username, all_receipts):
+        batch.extend(receipt_items)
+        if len(batch) >= batch_size:
+            receipts_db.upsert_receipt_items_data(batch)
+            stored += len(batch)
+            batch = []
+    if batch:
+        receipts_db.upsert_receipt_items_data(batch)
+        stored += len(batch)
+    return stored
+
+
+def run_receipt_scraper_with_api(all_receipts=False, username=None, password=None, profile_dir=None,
+                                 session=None):
+    """
+    The main function to execute the Costco Price Scraper.
+
+    Parameters:
+    - all_receipts: Whether to process every receipt instead of only recent ones
+    - username: Costco account username, read from the config when not given
+    - password: Costco account password, read from the config when not given
+    - profile_dir: Optional browser profile directory for this account
+    - session: Optional (driver, client_id) returned by initialize_scraper, to reuse a
+      browser that is already logged in
+
+    Returns:
+        stored: Number of receipt items upserted
+    """
+    if username is None or password is None:
+        username, password = config.read_login_config()
+    if session is not None:
+        driver, client_id = session
+    else:
+        driver, client_id = initialize_scraper(username, password, profile_dir)
+    id_token = get_id_token(driver)
+    all_receipt_ids_set = set(receipts_db.get_all_receipt_ids())
+
+    # Fetch, parse and store the receipts in the background while the browser
+    # captures the screenshots, the API latency is hidden behind the Selenium work
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        receipt_items_future = executor.submit(
+            store_receipt_items,
+            id_token,
+            client_id,
+            all_receipt_ids_set,
+            username,
+            all_receipts,
+        )
+        get_screenshots(driver, all_receipt_ids_set, all_receipts)
+        stored = receipt_items_future.result()
+    print(f"Stored {stored} receipt items")
+    return stored
 
 
 # def run_receipt_scraper():
@@ -5,6 +5,10 @@ This module provides functions to create and query a 'receipts' table in an SQLi
 The 'receipts' table stores information about items from receipts, including item details,
 receipt ID, and sale status.
 
+Classes:
+- `ReceiptItem`: A row of the 'receipt_items' table.
+- `Receipt`: A row of the 'receipts' table.
+
 Functions:
 - `create_receipts_table`: Create the 'receipts' table in the SQLite database.
 - `get_all_receipt_ids`: Retrieve all distinct receipt IDs from the 'receipts' table.
@@ -21,11 +25,53 @@ operations, and commits changes. Context manager closes the database connection
 """
 
 import sqlite3
-from costco_price_scraper.utils.db_utils import date_parse
+from costco_price_scraper.utils.db_utils import Record, date_parse, serialized_write
+from costco_price_scraper.utils import matcher, telemetry
 
 DB_FILE = "scraped_prices.db"
 
 
+class ReceiptItem(Record):
+    """
+    A line item of a receipt, as parsed from the API or read from 'receipt_items'.
+
+    `id` is the row id, None until the item is stored.
+    """
+
+    __slots__ = ("item_id", "item_name", "amount", "unit", "on_sale", "receipt_date", "receipt_id",
+                 "receipt_type", "username", "id")
+
+    def __init__(self, item_id, item_name, amount, unit, on_sale, receipt_date, receipt_id,
+                 receipt_type=None, username=None, id=None):
+        self.item_id = item_id
+        self.item_name = item_name
+        self.amount = amount
+        self.unit = unit
+        self.on_sale = on_sale
+        self.receipt_date = receipt_date
+        self.receipt_id = receipt_id
+        self.receipt_type = receipt_type
+        self.username = username
+        self.id = id
+
+
+class Receipt(Record):
+    """
+    A receipt screenshot, as captured by the browser or read from 'receipts'.
+
+    `id` is the row id, None until the receipt is stored.
+    """
+
+    __slots__ = ("receipt_id", "receipt_date", "receipt_path", "id")
+
+    def __init__(self, receipt_id, receipt_date, receipt_path, id=None):
+        self.receipt_id = receipt_id
+        self.receipt_date = receipt_date
+        self.receipt_path = receipt_path
+        self.id = id
+
+
+@serialized_write
 def create_receipt_items_table():
     """
     Create the 'receipt_items' table in the SQLite database.
@@ -65,7 +111,16 @@ def create_receipt_items_table():
         """
         )
 
+        # Index used by the adjustment matcher to find a user's items not on sale
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_receipt_items_username_on_sale
+            ON receipt_items (username, on_sale)
+        """
+        )
+
 
+@serialized_write
 def create_receipts_table():
     """
     Create the 'receipts' table in the SQLite database.
@@ -93,30 +148,40 @@ def create_receipts_table():
         """
         )
 
+        # Index used by the adjustment matcher to look up receipt screenshots
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_receipts_receipt_id
+            ON receipts (receipt_id)
+        """
+        )
+
 
+@serialized_write
 def upsert_receipt_items_data(all_receipt_items_list):
     """
     Upsert receipt items data into the 'receipt_items' table using executemany().
 
     Args:
-        all_receipt_items_list (list): A list of dictionaries representing receipt items.
+        all_receipt_items_list (list): A list of `ReceiptItem` records.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with telemetry.span("db.upsert_receipt_items", items=len(all_receipt_items_list)), \
+            sqlite3.connect(DB_FILE) as conn:
         conn.create_function("date_parse", 1, date_parse)
         cursor = conn.cursor()
 
         # Extract data into a list of tuples
         data_to_insert = [
             (
-                receipt_item.get("item_id"),
-                receipt_item.get("item_name"),
-                receipt_item.get("amount"),
-                receipt_item.get("unit"),
-                receipt_item.get("on_sale"),
-                receipt_item.get("receipt_date"),
-                receipt_item.get("receipt_id"),
-                receipt_item.get("receipt_type"),
-                receipt_item.get("username")
+                receipt_item.item_id,
+                receipt_item.item_name,
+                receipt_item.amount,
+                receipt_item.unit,
+                receipt_item.on_sale,
+                receipt_item.receipt_date,
+                receipt_item.receipt_id,
+                receipt_item.receipt_type,
+                receipt_item.username,
             )
             for receipt_item in all_receipt_items_list
         ]
@@ -129,26 +194,28 @@ def upsert_receipt_items_data(all_receipt_items_list):
             data_to_insert,
         )
 
+        # Keep the materialized adjustment opportunities in sync with the new receipt items
+        matcher.refresh_opportunities_for_receipts(
+            cursor, [receipt_item.receipt_id for receipt_item in all_receipt_items_list]
+        )
+
+@serialized_write
 def upsert_receipt_data(all_receipts_list):
     """
     Upsert receipt data into the 'receipts' table using executemany().
 
     Args:
-        all_receipts_list (list): A list of dictionaries representing receipts.
+        all_receipts_list (list): A list of `Receipt` records.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with telemetry.span("db.upsert_receipts", items=len(all_receipts_list)), sqlite3.connect(DB_FILE) as conn:
         conn.create_function("date_parse", 1, date_parse)
         cursor = conn.cursor()
 
         # Extract data into a list of tuples
-        # data_to_insert = [
-        #     (
-        #         receipt.get("receipt_id"),
-        #         receipt.get("receipt_date"),
-        #         receipt.get("receipt_path"),
-        #     )
-        #     for receipt in all_receipts_list
-        # ]
+        data_to_insert = [
+            (receipt.receipt_id, receipt.receipt_date, receipt.receipt_path)
+            for receipt in all_receipts_list
+        ]
 
         # Use executemany() for bulk inserts
         cursor.executemany(
@@ -156,9 +223,12 @@ def upsert_receipt_data(all_receipts_list):
             INSERT OR REPLACE INTO receipts (receipt_id, receipt_date, receipt_path)
             VALUES (?, date_parse(?), ?)
         """,
-            all_receipts_list,
+            data_to_insert,
         )
 
+        # Attach the new receipt screenshots to the matching adjustment opportunities
+        matcher.refresh_receipt_paths(cursor, [receipt.receipt_id for receipt in all_receipts_list])
+
 
 def get_all_receipt_ids():
     """
@@ -186,7 +256,7 @@ def get_receipts_by_ids(receipt_ids):
     - receipt_ids (list): List of receipt IDs to retrieve.
 
     Returns:
-    - list: List of dictionaries representing the matching receipts.
+    - list: List of `Receipt` records.
     """
     with sqlite3.connect(DB_FILE) as conn:
         conn.create_function("date_parse", 1, date_parse)
@@ -194,25 +264,15 @@ def get_receipts_by_ids(receipt_ids):
 
         cursor.execute(
             """
-            SELECT * FROM receipts
+            SELECT {} FROM receipts
             WHERE receipt_id IN ({}) 
             """.format(
-                ", ".join("?" for _ in receipt_ids)
+                Receipt.columns(), ", ".join("?" for _ in receipt_ids)
             ),
             receipt_ids,
         )
 
-        rows = cursor.fetchall()
-
-        receipts = []
-        for row in rows:
-            receipt = {
-                "id": row[0],
-                "receipt_id": row[1],
-                "receipt_date": row[2],
-                "receipt_path": row[3],
-            }
-            receipts.append(receipt)
+        receipts = Receipt.from_rows(cursor.fetchall())
 
     return receipts
 
@@ -240,16 +300,16 @@ def get_all_items_not_on_sale():
     Get all rows from the 'receipt_items' table where items are not on sale.
 
     Returns:
-        list: A list of rows where items are not on sale.
+        list: A list of `ReceiptItem` records not on sale.
     """
     with sqlite3.connect(DB_FILE) as conn:
         conn.create_function("date_parse", 1, date_parse)
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM receipt_items WHERE on_sale = 0")
+        cursor.execute(f"SELECT {ReceiptItem.columns()} FROM receipt_items WHERE on_sale = 0")
         result = cursor.fetchall()
 
     # Close connection outside the 'with' block
-    return result
+    return ReceiptItem.from_rows(result)
 
 
 def get_all_user_items_not_on_sale(username):
@@ -260,13 +320,15 @@ def get_all_user_items_not_on_sale(username):
         username (str): The username to filter the items by.
 
     Returns:
-        list: A list of rows where items are not on sale for the specified username.
+        list: A list of `ReceiptItem` records not on sale for the specified username.
     """
     with sqlite3.connect(DB_FILE) as conn:
         conn.create_function("date_parse", 1, date_parse)
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM receipt_items WHERE on_sale = 0 AND username = ?", (username,))
+        cursor.execute(
+            f"SELECT {ReceiptItem.columns()} FROM receipt_items WHERE on_sale = 0 AND username = ?", (username,)
+        )
         result = cursor.fetchall()
 
     # Close connection outside the 'with' block
-    return result
\ No newline at end of file
+    return ReceiptItem.from_rows(result)
\ No newline at end of file
@@ -1,11 +1,91 @@
 import configparser
+import os
+import re
+import threading
+import time
 
-config_path = '/Users/scott/PycharmProjects/costco_price_scraper/config.ini' # Done: Change
+config_path = os.getenv('COSTCO_CONFIG_PATH', '/Users/scott/PycharmProjects/costco_price_scraper/config.ini') # Done: Change
 
-def read_config(section, option):
-    config = configparser.ConfigParser()
-    config.read(config_path)
-    return config.get(section, option)
+# Environment variables named COSTCO_<SECTION>_<OPTION> override the file,
+# e.g. COSTCO_CREDENTIALS_PASSWORD
+ENV_PREFIX = 'COSTCO_'
+
+# Seconds between two checks of the file's mtime
+MTIME_CHECK_INTERVAL = 1.0
+
+_MISSING = object()
+
+
+class Config:
+    """
+    config.ini parsed once and cached, reparsed only when the file's mtime changes.
+
+    Attributes:
+        path (str): Path of the config file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._parser = configparser.ConfigParser()
+        self._mtime = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _current_parser(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < MTIME_CHECK_INTERVAL:
+            return self._parser
+
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime != self._mtime or self._checked_at is None:
+                parser = configparser.ConfigParser()
+                parser.read(self.path)
+                self._parser = parser
+                self._mtime = mtime
+            self._checked_at = now
+        return self._parser
+
+    @staticmethod
+    def env_name(section, option):
+        return ENV_PREFIX + re.sub(r'[^A-Z0-9]', '_', f'{section}_{option}'.upper())
+
+    def get(self, section, option, fallback=_MISSING):
+        value = os.environ.get(self.env_name(section, option))
+        if value is not None:
+            return value
+        if fallback is _MISSING:
+            return self._current_parser().get(section, option)
+        return self._current_parser().get(section, option, fallback=fallback)
+
+    def sections(self):
+        return self._current_parser().sections()
+
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_config():
+    """Return the process-wide Config for config_path."""
+    global _config
+    with _config_lock:
+        if _config is None or _config.path != config_path:
+            _config = Config(config_path)
+        return _config
+
+
+def set_config_path(path):
+    """Point every reader, including spawned worker processes, at another config file."""
+    global config_path
+    config_path = path
+    os.environ['COSTCO_CONFIG_PATH'] = path
+
+def read_config(section, option, fallback=_MISSING):
+    return get_config().get(section, option, fallback)
 
 def read_sender_email_config():
     return read_config("Credentials", "GMAIL_USERNAME"), read_config("Credentials", "GMAIL_PASSWORD")
@@ -14,4 +94,24 @@ def read_login_config():
     return read_config("Credentials", "USERNAME"), read_config("Credentials", "PASSWORD")
 
 def read_username_config():
-    return read_config("Credentials", "USERNAME")
\ No newline at end of file
+    return read_config("Credentials", "USERNAME")
+
+def read_accounts_config():
+    """
+    Read the login credentials of every configured account.
+
+    Accounts are sections named 'Account <name>' with USERNAME and PASSWORD options.
+    Falls back to the single account in the 'Credentials' section.
+    """
+    accounts = [
+        (read_config(section, "USERNAME"), read_config(section, "PASSWORD"))
+        for section in get_config().sections()
+        if section.startswith("Account ")
+    ]
+    return accounts or [read_login_config()]
+
+def read_runner_config(option, fallback=None):
+    return read_config("Runner", option, fallback)
+
+def read_scheduler_config(option, fallback=None):
+    return read_config("Scheduler", option, fallback)
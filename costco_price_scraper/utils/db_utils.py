@@ -1,10 +1,66 @@
-from dateutil import parser
+import functools
+import sqlite3
+import threading
+from itertools import starmap
 
 
 def date_parse(s):
     ''' sql udf to convert string to date'''
+    # dateutil is imported on first use so importing the db modules stays cheap
+    from dateutil import parser
+
     try:
         t = parser.parse(s, parser.parserinfo(dayfirst=True))
         return t.strftime('%Y-%m-%d')
     except:
-        return None
\ No newline at end of file
+        return None
+
+def enable_wal(db_file):
+    ''' switch the database to WAL so several processes can read while one writes'''
+    with sqlite3.connect(db_file) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+
+
+# Serializes writes from stages running concurrently in the same process, so they
+# never fail with 'database is locked'
+DB_WRITE_LOCK = threading.RLock()
+
+
+def serialized_write(func):
+    ''' decorator running a database write function under DB_WRITE_LOCK'''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with DB_WRITE_LOCK:
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class Record:
+    ''' base of the slotted row records, the slots are the columns in SELECT order'''
+    __slots__ = ()
+
+    @classmethod
+    def columns(cls):
+        ''' the column list to SELECT for from_rows'''
+        return ", ".join(cls.__slots__)
+
+    @classmethod
+    def from_rows(cls, rows):
+        ''' records of the rows of a query selecting columns()'''
+        # Faster than a sqlite3 row_factory, which is called back once per row
+        return list(starmap(cls, rows))
+
+    def _asdict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
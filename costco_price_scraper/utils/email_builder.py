@@ -1,61 +1,186 @@
+"""
+Module to render the price adjustment emails.
 
+The HTML templates are assembled once at import time, with the fixed-width labels
+already padded. Every row is rendered with a single `str.format` call and the body
+is built with one join, so rendering stays linear in the number of items. The
+refund deadline of a row is computed once, against a single `now` per render.
 
-from datetime import datetime, timedelta
+Functions:
+- `iter_adjustment_email_body`: Yield the HTML body of an adjustment email chunk by chunk.
+- `construct_adjustment_email_body_and_subject`: Build the email from matcher results.
+- `render_digests`: Build the emails of many users in one batch.
+- `construct_receipt_email_body_and_subject`: Build the email from receipt items and a sale hashmap.
+"""
+from datetime import date, datetime, time, timedelta
 
+NO_ADJUSTMENTS_SUBJECT = "No Costco Price Adjustments Found"
+ADJUSTMENTS_SUBJECT = "Costco Price Adjustment Opportunity Detected"
+LABEL_WIDTH = 20
+VALUE_WIDTH = 30
 
-def construct_receipt_email_body_and_subject(receipt_items_list, sale_item_hashmap):
-    if not receipt_items_list:
-        subject = "No Costco Price Adjustments Found"
-        body = (
-            "<div style='font-family: Arial, sans-serif;'>"
-            "<pre style='font-size: 16px;'>No price adjustments detected.</pre></div>"
-        )
-        return subject, body
-    
-    subject = "Costco Price Adjustment Opportunity Detected"
-    body = "<div style='font-family: Arial, sans-serif;'><pre style='font-size: 16px;'>Its on sale now!\n"
-    body += "Get your money back!\n"
-    body += "<strong style='font-size: 18px; color: #3366cc;'>List of Price Adjustment Items</strong>\n"
-    body += "<hr style='border: 1px solid #ddd;'>\n"  # Horizontal line for separation
-    total = 0
-    label_width = 20
-    value_width = 30
+NO_ADJUSTMENTS_BODY = (
+    "<div style='font-family: Arial, sans-serif;'>"
+    "<pre style='font-size: 16px;'>No price adjustments detected.</pre></div>"
+)
 
-    for index, item in enumerate(receipt_items_list, start=1):
-        purchase_date = datetime.strptime(item[6], "%Y-%m-%d")
-        sale_expiry_date = datetime.strptime(
-            sale_item_hashmap[item[1]]["expiry_date"], "%Y-%m-%d"
-        )
+HEADER = (
+    "<div style='font-family: Arial, sans-serif;'><pre style='font-size: 16px;'>Its on sale now!\n"
+    "Get your money back!\n"
+    "<strong style='font-size: 18px; color: #3366cc;'>List of Price Adjustment Items</strong>\n"
+    "<hr style='border: 1px solid #ddd;'>\n"  # Horizontal line for separation
+)
 
-        thirty_days_later = purchase_date + timedelta(days=30)
-        earliest_date = min(thirty_days_later, sale_expiry_date)
-        days_left = (earliest_date - datetime.now()).days
+FOOTER_TEMPLATE = (
+    "<p style='font-size: 16px;'><strong>Total Savings = ${total:.2f}</strong></p>\n"
+    "<p style='font-size: 16px;'>...which is equivalent to {hotdog_amount} hotdogs!!! {hotdogs}</p></pre></div>"
+)
+
+ITEM_FIELDS = [
+    ("Item ID:", "item_id"),
+    ("Item Name:", "item_name"),
+    ("Amount:", "amount"),
+    ("Unit:", "unit"),
+    ("Purchase Date:", "receipt_date"),
+    ("Sale Expiry Date:", "expiry_date"),
+    ("Receipt ID:", "receipt_id"),
+    ("Sale Price:", "sale_price"),
+    ("Per Unit Savings:", "savings"),
+    ("Total Item Savings:", "total_savings"),
+    ("Days Left for Refund:", "days_left"),
+    ("Last Day for Refund:", "deadline"),
+]
 
-        total += sale_item_hashmap[item[1]]["savings"] * item[4]
-        days_left_str = (
-            f"{days_left} days" if days_left >= 0 else f"{-days_left} days ago"
-        )
 
-        text = (
-            f"<p style='font-size: 14px;'><strong>Item Number {index}</strong></p>\n"
-            f"<p style='font-size: 14px;'>{'Item ID:': <{label_width}} <span style='color: #555; font-size: 14px;'>{str(item[1]): >{value_width}}</span></p>\n"
-            f"<p style='font-size: 14px;'>{'Item Name:': <{label_width}} <span style='color: #555; font-size: 14px;'>{str(item[2]): >{value_width}}</span></p>\n"
-            f"<p style='font-size: 14px;'>{'Amount:': <{label_width}} <span style='color: #555; font-size: 14px;'>{str(item[3]): >{value_width}}</span></p>\n"
-            f"<p style='font-size: 14px;'>{'Unit:': <{label_width}} <span style='color: #555; font-size: 14px;'>{str(item[4]): >{value_width}}</span></p>\n"
-            f"<p style='font-size: 14px;'>{'Purchase Date:': <{label_width}} <span style='color: #555; font-size: 14px;'>{str(item[6]): >{value_width}}</span></p>\n"
-            f"<p style='font-size: 14px;'>{'Sale Expiry Date:': <{label_width}} <span style='color: #555; font-size: 14px;'>{str(sale_item_hashmap[item[1]]['expiry_date']): >{value_width}}</span></p>\n"
-            f"<p style='font-size: 14px;'>{'Receipt ID:': <{label_width}} <span style='color: #555; font-size: 14px;'>{str(item[7]): >{value_width}}</span></p>\n"
-            f"<p style='font-size: 14px;'>{'Sale Price:': <{label_width}} <span style='color: #555; font-size: 14px;'>{'$'+str(sale_item_hashmap[item[1]]['sale_price']): >{value_width}}</span></p>\n"
-            f"<p style='font-size: 14px;'>{'Per Unit Savings:': <{label_width}} <span style='color: #555; font-size: 14px;'>{'$'+str(sale_item_hashmap[item[1]]['savings']): >{value_width}}</span></p>\n"
-            f"<p style='font-size: 14px;'>{'Total Item Savings:': <{label_width}} <span style='color: #555; font-size: 14px;'>{'$'+str(sale_item_hashmap[item[1]]['savings']*item[4]): >{value_width}}</span></p>\n"
-            f"<p style='font-size: 14px;'>{'Days Left for Refund:': <{label_width}} <span style='color: #555; font-size: 14px;'>{days_left_str: >{value_width}}</span></p>\n"
-            f"<p style='font-size: 14px;'>{'Last Day for Refund:': <{label_width}} <span style='color: #555; font-size: 14px;'>{str(earliest_date.strftime('%Y-%m-%d')): >{value_width}}</span></p>\n"
-            "<hr style='border: 1px solid #ddd;'>\n"
+def _compile_item_template():
+    lines = ["<p style='font-size: 14px;'><strong>Item Number {index}</strong></p>\n"]
+    for label, field in ITEM_FIELDS:
+        # Labels never change, pad them now instead of on every row
+        padded_label = f"{label: <{LABEL_WIDTH}}".replace("{", "{{").replace("}", "}}")
+        lines.append(
+            f"<p style='font-size: 14px;'>{padded_label} <span style='color: #555; font-size: 14px;'>"
+            f"{{{field}: >{VALUE_WIDTH}}}</span></p>\n"
         )
-        body += text
+    lines.append("<hr style='border: 1px solid #ddd;'>\n")
+    return "".join(lines)
+
+
+ITEM_TEMPLATE = _compile_item_template()
 
+
+def _render_item(index, match, now):
+    deadline = date.fromisoformat(match.deadline)
+    days_left = (datetime.combine(deadline, time()) - now).days
+    days_left_str = f"{days_left} days" if days_left >= 0 else f"{-days_left} days ago"
+
+    return ITEM_TEMPLATE.format(
+        index=index,
+        item_id=str(match.item_id),
+        item_name=str(match.item_name),
+        amount=str(match.amount),
+        unit=str(match.unit),
+        receipt_date=str(match.receipt_date),
+        expiry_date=str(match.expiry_date),
+        receipt_id=str(match.receipt_id),
+        sale_price="$" + str(match.sale_price),
+        savings="$" + str(match.savings),
+        total_savings="$" + str(match.total_savings),
+        days_left=days_left_str,
+        deadline=deadline.isoformat(),
+    )
+
+
+def _render_footer(total):
     hotdog_amount = round(total / 1.5, 2)
-    body += f"<p style='font-size: 16px;'><strong>Total Savings = ${total:.2f}</strong></p>\n"
-    body += f"<p style='font-size: 16px;'>...which is equivalent to {hotdog_amount} hotdogs!!! {'🌭' * int(hotdog_amount)}</p></pre></div>"
+    return FOOTER_TEMPLATE.format(total=total, hotdog_amount=hotdog_amount, hotdogs="🌭" * int(hotdog_amount))
 
-    return subject, body
\ No newline at end of file
+
+def iter_adjustment_email_body(matches, now=None):
+    """
+    Yield the HTML body of a price adjustment email chunk by chunk.
+
+    Args:
+        matches (list): A non-empty list of `AdjustmentMatch` records.
+        now (datetime): Time the days left are counted from, defaults to now.
+
+    Yields:
+        str: Consecutive chunks of the HTML body.
+    """
+    if now is None:
+        now = datetime.now()
+    total = 0
+
+    yield HEADER
+    for index, match in enumerate(matches, start=1):
+        total += match.total_savings
+        yield _render_item(index, match, now)
+    yield _render_footer(total)
+
+
+def construct_adjustment_email_body_and_subject(matches, now=None):
+    """
+    Build the email subject and HTML body from matcher results.
+
+    Args:
+        matches (list): A list of `AdjustmentMatch` records from `matcher.find_new_adjustments`.
+        now (datetime): Time the days left are counted from, defaults to now.
+
+    Returns:
+        tuple: (subject, body)
+    """
+    if not matches:
+        return NO_ADJUSTMENTS_SUBJECT, NO_ADJUSTMENTS_BODY
+    return ADJUSTMENTS_SUBJECT, "".join(iter_adjustment_email_body(matches, now))
+
+
+def render_digests(matches_by_user, now=None):
+    """
+    Build the price adjustment emails of many users in one batch.
+
+    Args:
+        matches_by_user (dict): Username to list of `AdjustmentMatch` records.
+        now (datetime): Time the days left are counted from, defaults to now.
+
+    Returns:
+        dict: Username to (subject, body).
+    """
+    if now is None:
+        now = datetime.now()
+    return {
+        username: construct_adjustment_email_body_and_subject(matches, now)
+        for username, matches in matches_by_user.items()
+    }
+
+
+def construct_receipt_email_body_and_subject(receipt_items_list, sale_item_hashmap):
+    """
+    Build the email subject and HTML body from `receipts_db.ReceiptItem` records and a
+    sale item hashmap of item ID to `items_db.SaleOffer`.
+
+    Returns:
+        tuple: (subject, body)
+    """
+    from costco_price_scraper.utils.matcher import AdjustmentMatch
+
+    matches = []
+    for item in receipt_items_list:
+        sale_item = sale_item_hashmap[item.item_id]
+        thirty_days_later = date.fromisoformat(item.receipt_date) + timedelta(days=30)
+        deadline = min(thirty_days_later, date.fromisoformat(sale_item.expiry_date))
+        matches.append(
+            AdjustmentMatch(
+                item_id=item.item_id,
+                item_name=item.item_name,
+                amount=item.amount,
+                unit=item.unit,
+                receipt_date=item.receipt_date,
+                receipt_id=item.receipt_id,
+                sale_price=sale_item.sale_price,
+                savings=sale_item.savings,
+                expiry_date=sale_item.expiry_date,
+                deadline=deadline.isoformat(),
+                total_savings=sale_item.savings * item.unit,
+                receipt_path=None,
+            )
+        )
+    return construct_adjustment_email_body_and_subject(matches)
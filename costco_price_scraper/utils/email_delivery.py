@@ -0,0 +1,228 @@
+"""
+Module to deliver batches of emails over pooled, authenticated SMTP connections.
+
+Opening an SMTP_SSL connection and logging in costs a TLS handshake and an AUTH
+round trip per email. This module keeps a small pool of authenticated connections
+open for a whole batch, sends the messages concurrently through a bounded thread
+pool and caches the MIME parts of receipt screenshots by file path and mtime, so
+each PNG is read and encoded once.
+
+Classes:
+- `OutgoingEmail`: One email to send.
+- `SMTPConnectionPool`: A bounded pool of authenticated SMTP connections.
+
+Functions:
+- `build_message`: Build the MIME message of an email.
+- `send_batch`: Send many emails over a shared connection pool.
+
+Config ('SMTP' section):
+- HOST, PORT: The SMTP server, smtp.gmail.com:465 by default.
+- SSL: Whether to connect with SMTP_SSL (default) or plain SMTP.
+- MAX_CONNECTIONS: Number of connections, and concurrent sends, in a batch.
+"""
+
+import os
+import queue
+import smtplib
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from costco_price_scraper.utils import config, telemetry
+
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORT = 465
+MAX_CONNECTIONS = 4
+ATTACHMENT_CACHE_SIZE = 256
+
+OutgoingEmail = namedtuple("OutgoingEmail", ["to_email", "subject", "body", "attachment_paths"])
+
+_attachment_cache = OrderedDict()
+_attachment_cache_lock = threading.Lock()
+
+
+def get_attachment_part(attachment_path):
+    """
+    Get the MIME part of an image attachment, reading and encoding the file only
+    when it is not cached or has changed on disk.
+
+    Args:
+        attachment_path (str): Path of the image.
+
+    Returns:
+        MIMEImage: The encoded attachment part.
+    """
+    mtime = os.stat(attachment_path).st_mtime_ns
+    with _attachment_cache_lock:
+        cached = _attachment_cache.get(attachment_path)
+        if cached is not None and cached[0] == mtime:
+            _attachment_cache.move_to_end(attachment_path)
+            return cached[1]
+
+    filename = os.path.basename(attachment_path)
+    with open(attachment_path, "rb") as attachment:
+        image = MIMEImage(attachment.read())
+    image.add_header("Content-Disposition", f'attachment; filename="{filename}"')
+
+    with _attachment_cache_lock:
+        _attachment_cache[attachment_path] = (mtime, image)
+        _attachment_cache.move_to_end(attachment_path)
+        while len(_attachment_cache) > ATTACHMENT_CACHE_SIZE:
+            _attachment_cache.popitem(last=False)
+    return image
+
+
+def build_message(sender_email, email):
+    """
+    Build the MIME message of an email.
+
+    Args:
+        sender_email (str): The From address.
+        email (OutgoingEmail): The email to build.
+
+    Returns:
+        MIMEMultipart: The message, with the HTML body and image attachments.
+    """
+    msg = MIMEMultipart()
+    msg["From"] = sender_email
+    msg["To"] = email.to_email
+    msg["Subject"] = email.subject
+
+    # Attach body text
+    msg.attach(MIMEText(email.body, "html"))
+
+    # Attach images, shared with every other message of the batch
+    for attachment_path in email.attachment_paths or []:
+        msg.attach(get_attachment_part(attachment_path))
+    return msg
+
+
+class SMTPConnectionPool:
+    """
+    A bounded pool of authenticated SMTP connections, opened lazily.
+
+    Use as a context manager so every connection is closed at the end of the batch.
+    """
+
+    def __init__(self, host, port, username, password, use_ssl=True, size=MAX_CONNECTIONS, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.size = size
+        self.timeout = timeout
+        self.connections_opened = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._all = []
+
+    def _connect(self):
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        server = smtp_class(self.host, self.port, timeout=self.timeout)
+        server.login(self.username, self.password)
+        with self._lock:
+            self.connections_opened += 1
+            self._all.append(server)
+        return server
+
+    def _discard(self, server):
+        with self._lock:
+            if server in self._all:
+                self._all.remove(server)
+        try:
+            server.close()
+        except Exception:
+            pass
+
+    def send(self, from_addr, to_addrs, message):
+        """
+        Send a message on an idle connection, reconnecting once if the server
+        dropped it.
+        """
+        with self._slots:
+            try:
+                server = self._idle.get_nowait()
+            except queue.Empty:
+                server = self._connect()
+            try:
+                server.sendmail(from_addr, to_addrs, message)
+            except smtplib.SMTPServerDisconnected:
+                self._discard(server)
+                server = self._connect()
+                server.sendmail(from_addr, to_addrs, message)
+            except Exception:
+                self._discard(server)
+                raise
+            self._idle.put(server)
+
+    def close(self):
+        with self._lock:
+            servers, self._all = self._all, []
+        for server in servers:
+            try:
+                server.quit()
+            except Exception:
+                server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def create_pool(size=None):
+    """
+    Create a connection pool for the SMTP server and sender in the config.
+    """
+    sender_email, sender_password = config.read_sender_email_config()
+    if size is None:
+        size = int(config.read_config("SMTP", "MAX_CONNECTIONS", MAX_CONNECTIONS))
+    return SMTPConnectionPool(
+        config.read_config("SMTP", "HOST", SMTP_HOST),
+        int(config.read_config("SMTP", "PORT", SMTP_PORT)),
+        sender_email,
+        sender_password,
+        use_ssl=config.read_config("SMTP", "SSL", "true").lower() in ("1", "true", "yes"),
+        size=size,
+    )
+
+
+def send_batch(emails, pool=None):
+    """
+    Send many emails concurrently over a shared pool of SMTP connections.
+
+    Args:
+        emails (list): `OutgoingEmail` records.
+        pool (SMTPConnectionPool): Pool to send with; one is created from the config
+            and closed after the batch when not given.
+
+    Returns:
+        list: One (to_email, error) tuple per email in order, error being None on success.
+    """
+    owns_pool = pool is None
+    if owns_pool:
+        pool = create_pool()
+    sender_email = pool.username
+
+    def deliver(email):
+        try:
+            with telemetry.span("email.send", items=1) as send_span:
+                message = build_message(sender_email, email).as_string()
+                send_span.add(bytes=len(message))
+                pool.send(sender_email, email.to_email, message)
+        except Exception as e:
+            return email.to_email, e
+        return email.to_email, None
+
+    try:
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            return list(executor.map(deliver, emails))
+    finally:
+        if owns_pool:
+            pool.close()
@@ -0,0 +1,281 @@
+"""
+Module providing the HTTP client shared by the blog scraper, the coupon scraper and
+the receipt API.
+
+Every host gets one pooled session that is reused across requests, so connections
+stay open between the pages of a run. The sessions never store cookies: they are
+shared by every account and thread of the process, so callers pass the cookies of
+each request. All requests go through the same timeout and
+retry-with-backoff policy, are paced by the host's `rate_limiter.HostLimiter`, and
+their timing, size and status are counted per host.
+
+Functions:
+- `request`: Send a request with the shared timeout and retry policy.
+- `get`: Send a GET request.
+- `post`: Send a POST request.
+- `get_metrics`: Return a snapshot of the per-host request counters.
+- `reset_metrics`: Clear the request counters.
+- `print_metrics`: Print the per-host request counters.
+- `close`: Close every pooled session.
+
+Config ('HTTP' section):
+- CONNECT_TIMEOUT, READ_TIMEOUT: Seconds to wait for the connection and for the response.
+- RETRIES: Number of retries after a connection error, a timeout or a retryable status.
+- BACKOFF_BASE, MAX_BACKOFF: Seconds before the first retry, doubled on each retry.
+- POOL_SIZE: Connections kept open per host.
+- HTTP2: Use HTTP/2 through httpx (with the 'h2' extra) instead of requests.
+
+Note: POST requests are only retried when the caller marks them as idempotent.
+"""
+
+import random
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from costco_price_scraper.utils import config, rate_limiter
+
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 20.0
+RETRIES = 2
+BACKOFF_BASE = 1.0
+MAX_BACKOFF = 30.0
+POOL_SIZE = 4
+
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+_metrics = defaultdict(lambda: {
+    "requests": 0,
+    "retries": 0,
+    "errors": 0,
+    "bytes": 0,
+    "seconds": 0.0,
+    "max_seconds": 0.0,
+    "statuses": defaultdict(int),
+})
+_metrics_lock = threading.Lock()
+
+
+def _read_float(option, fallback):
+    return float(config.read_config("HTTP", option, fallback))
+
+
+def _use_http2():
+    return config.read_config("HTTP", "HTTP2", "false").lower() in ("1", "true", "yes")
+
+
+def _create_session(http2):
+    # Imported here like requests and httpx: it pulls in urllib.request and http.client
+    from http.cookiejar import DefaultCookiePolicy
+
+    pool_size = int(_read_float("POOL_SIZE", POOL_SIZE))
+    # Sessions are shared by every account, so they must not keep one account's
+    # Set-Cookie for the requests of another: only the connections are pooled
+    reject_cookies = DefaultCookiePolicy(allowed_domains=())
+    if http2:
+        import httpx
+
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        client = httpx.Client(http2=True, limits=limits, follow_redirects=True)
+        client.cookies.jar.set_policy(reject_cookies)
+        return client
+
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.cookies.set_policy(reject_cookies)
+    # Retries are done here, so they are counted and share the backoff policy
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(url):
+    """
+    Get the pooled session of the host of a URL, creating it on first use.
+
+    Args:
+        url (str): Any URL on the host.
+
+    Returns:
+        The `requests.Session` (or `httpx.Client` with HTTP/2) of the host.
+    """
+    parts = urlsplit(url)
+    http2 = _use_http2()
+    key = (parts.scheme, parts.netloc, http2)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = _create_session(http2)
+    return session
+
+
+def _transport_errors(session):
+    if type(session).__module__.startswith("httpx"):
+        import httpx
+
+        return (httpx.TransportError,)
+    import requests
+
+    return (requests.ConnectionError, requests.Timeout)
+
+
+def _retry_after(response):
+    retry_after = response.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), _read_float("MAX_BACKOFF", MAX_BACKOFF))
+    return None
+
+
+def _backoff(attempt, response=None):
+    retry_after = _retry_after(response) if response is not None else None
+    if retry_after is not None:
+        return retry_after
+    delay = _read_float("BACKOFF_BASE", BACKOFF_BASE) * 2 ** attempt
+    return min(delay, _read_float("MAX_BACKOFF", MAX_BACKOFF)) * random.uniform(0.5, 1.0)
+
+
+def _record(host, seconds, response=None, retried=False, error=False):
+    with _metrics_lock:
+        counters = _metrics[host]
+        counters["requests"] += 1
+        counters["seconds"] += seconds
+        counters["max_seconds"] = max(counters["max_seconds"], seconds)
+        if retried:
+            counters["retries"] += 1
+        if error:
+            counters["errors"] += 1
+        if response is not None:
+            counters["statuses"][response.status_code] += 1
+            counters["bytes"] += len(response.content)
+
+
+def request(method, url, timeout=None, retries=None, idempotent=None, **kwargs):
+    """
+    Send a request through the pooled session of its host.
+
+    Connection errors, timeouts and the statuses in `RETRY_STATUSES` are retried with
+    exponential backoff (honouring a numeric Retry-After) when the request is
+    idempotent. The last response is returned even if its status is retryable.
+    Every attempt first waits for the host's rate limiter.
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The URL.
+        timeout: Seconds or a (connect, read) tuple, the 'HTTP' config by default.
+        retries (int): Number of retries, the 'HTTP' config by default.
+        idempotent (bool): Whether the request may be retried, by default only for
+            GET, HEAD and OPTIONS.
+        **kwargs: Passed on to the session (headers, cookies, json, data, params...).
+
+    Returns:
+        The response of the last attempt.
+
+    Raises:
+        rate_limiter.CircuitOpenError: If the host is blocking requests.
+        The connection error or timeout of the last attempt.
+    """
+    method = method.upper()
+    if timeout is None:
+        timeout = (_read_float("CONNECT_TIMEOUT", CONNECT_TIMEOUT), _read_float("READ_TIMEOUT", READ_TIMEOUT))
+    if retries is None:
+        retries = int(_read_float("RETRIES", RETRIES))
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    if not idempotent:
+        retries = 0
+
+    session = get_session(url)
+    if type(session).__module__.startswith("httpx") and isinstance(timeout, tuple):
+        import httpx
+
+        timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+    transport_errors = _transport_errors(session)
+    host = urlsplit(url).netloc
+    limiter = rate_limiter.for_host(host)
+
+    for attempt in range(retries + 1):
+        limiter.before_request()
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except transport_errors:
+            _record(host, time.perf_counter() - start, retried=attempt > 0, error=True)
+            limiter.after_error()
+            if attempt == retries:
+                raise
+            time.sleep(_backoff(attempt))
+            continue
+
+        _record(host, time.perf_counter() - start, response, retried=attempt > 0)
+        limiter.after_response(response.status_code, _retry_after(response))
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            return response
+        if response.status_code not in rate_limiter.BLOCK_STATUSES:
+            # Throttling responses already slowed down and paused the limiter
+            time.sleep(_backoff(attempt, response))
+
+
+def get(url, **kwargs):
+    """Send a GET request, see `request`."""
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    """Send a POST request, see `request`."""
+    return request("POST", url, **kwargs)
+
+
+def get_metrics():
+    """
+    Return a snapshot of the request counters.
+
+    Returns:
+        dict: Host to counters (requests, retries, errors, bytes, seconds,
+        max_seconds and statuses as a dict of status code to count).
+    """
+    with _metrics_lock:
+        return {
+            host: dict(counters, statuses=dict(counters["statuses"]))
+            for host, counters in _metrics.items()
+        }
+
+
+def reset_metrics():
+    """Clear the request counters."""
+    with _metrics_lock:
+        _metrics.clear()
+
+
+def print_metrics():
+    """
+    Print the per-host request counters.
+    """
+    metrics = get_metrics()
+    if not metrics:
+        return
+    print("HTTP requests:")
+    for host, counters in sorted(metrics.items()):
+        statuses = ", ".join(f"{status}: {count}" for status, count in sorted(counters["statuses"].items()))
+        average = counters["seconds"] / counters["requests"]
+        print(
+            f"  {host:<28} {counters['requests']:>4} requests  {counters['retries']:>3} retries  "
+            f"{counters['errors']:>3} errors  {counters['bytes'] / 1024:>9.1f} KiB  "
+            f"avg {average:6.2f}s  max {counters['max_seconds']:6.2f}s  [{statuses}]"
+        )
+
+
+def close():
+    """Close every pooled session."""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
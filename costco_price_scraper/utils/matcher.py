@@ -0,0 +1,412 @@
+"""
+Module to match purchased receipt items against active sale offers inside SQLite.
+
+This module joins the 'receipt_items', 'items' and 'receipts' tables inside SQLite
+and materializes the result in the 'adjustment_opportunities' table. The table is
+kept up to date incrementally by the upsert functions in `items_db` and
+`receipts_db`, so readers only need a cheap indexed scan.
+
+The 'notifications_sent' table is the ledger of opportunities already emailed,
+keyed by (username, receipt_id, item_id, expiry_date). `find_new_adjustments` skips
+the opportunities in the ledger unless their sale price or savings changed, so a
+user is only emailed once per receipt item and sale offer.
+
+Functions:
+- `create_adjustment_opportunities_table`: Create (and initially fill) the 'adjustment_opportunities' table.
+- `rebuild_opportunities`: Recompute every opportunity from scratch.
+- `refresh_opportunities_for_items`: Recompute the opportunities for changed sale items.
+- `refresh_opportunities_for_receipts`: Recompute the opportunities for changed receipts.
+- `refresh_receipt_paths`: Update the receipt screenshot paths of existing opportunities.
+- `prune_closed_opportunities`: Delete opportunities whose refund window has closed.
+- `find_adjustments`: Return the price adjustment matches for a user.
+- `find_new_adjustments`: Return the matches for a user that were not emailed yet.
+- `record_notifications`: Record matches as emailed in the ledger.
+- `get_receipt_paths`: Return the distinct receipt screenshot paths for a list of matches.
+
+Usage:
+1. Use `create_adjustment_opportunities_table()` to initialize the table.
+2. Run the scrapers so that 'items' and 'receipt_items' are populated.
+3. Call `find_adjustments(username)` to get the list of `AdjustmentMatch` records.
+4. Email the result of `find_new_adjustments(username)`, then call
+   `record_notifications(username, matches)` once the email is sent.
+
+Note: The `refresh_*` and `prune_*` functions take a cursor so they run inside the
+caller's transaction. An opportunity is only kept while its refund window is open,
+i.e. the earlier of the purchase date plus 30 days and the sale expiry date has not
+passed yet.
+"""
+
+import sqlite3
+from collections import namedtuple
+
+from costco_price_scraper.utils import telemetry
+from costco_price_scraper.utils.db_utils import serialized_write
+
+DB_FILE = "scraped_prices.db"
+
+# Number of days after the purchase date in which Costco honours a price adjustment
+ADJUSTMENT_WINDOW_DAYS = 30
+
+# Keep IN (...) lists well below SQLite's host parameter limit
+CHUNK_SIZE = 500
+
+AdjustmentMatch = namedtuple(
+    "AdjustmentMatch",
+    [
+        "item_id",
+        "item_name",
+        "amount",
+        "unit",
+        "receipt_date",
+        "receipt_id",
+        "sale_price",
+        "savings",
+        "expiry_date",
+        "deadline",
+        "total_savings",
+        "receipt_path",
+    ],
+)
+
+OPPORTUNITY_COLUMNS = (
+    "receipt_item_id, username, item_id, item_name, amount, unit, receipt_date, receipt_id, "
+    "sale_price, savings, expiry_date, deadline, total_savings, receipt_path"
+)
+
+MATCH_SELECT = f"""
+    SELECT
+        ri.id,
+        ri.username,
+        ri.item_id,
+        ri.item_name,
+        ri.amount,
+        ri.unit,
+        ri.receipt_date,
+        ri.receipt_id,
+        i.sale_price,
+        i.savings,
+        i.expiry_date,
+        min(date(ri.receipt_date, '+{ADJUSTMENT_WINDOW_DAYS} days'), i.expiry_date) AS deadline,
+        i.savings * coalesce(ri.unit, 1) AS total_savings,
+        (
+            SELECT r.receipt_path
+            FROM receipts r
+            WHERE r.receipt_id = ri.receipt_id
+            ORDER BY r.id DESC
+            LIMIT 1
+        ) AS receipt_path
+    FROM receipt_items ri
+    JOIN items i ON i.item_id = ri.item_id
+    WHERE ri.on_sale = 0
+      AND coalesce(ri.unit, 1) > 0
+      AND i.expiry_date >= date('now', 'localtime')
+      AND date(ri.receipt_date, '+{ADJUSTMENT_WINDOW_DAYS} days') >= date('now', 'localtime')
+"""
+
+SOURCE_TABLES = ("items", "receipt_items", "receipts")
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), CHUNK_SIZE):
+        yield values[start:start + CHUNK_SIZE]
+
+
+def _placeholders(values):
+    return ", ".join("?" for _ in values)
+
+
+def _source_tables_exist(cursor):
+    cursor.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN ({})".format(
+            _placeholders(SOURCE_TABLES + ("adjustment_opportunities",))
+        ),
+        SOURCE_TABLES + ("adjustment_opportunities",),
+    )
+    return cursor.fetchone()[0] == len(SOURCE_TABLES) + 1
+
+
+@serialized_write
+def create_adjustment_opportunities_table():
+    """
+    Create the 'adjustment_opportunities' table, and the 'notifications_sent'
+    ledger, in the SQLite database.
+
+    The table holds one row per receipt item with an open price adjustment window,
+    keyed by the 'receipt_items' row id. It is filled from the existing data the
+    first time it is created.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'adjustment_opportunities'"
+        )
+        already_exists = cursor.fetchone() is not None
+
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS adjustment_opportunities (
+                receipt_item_id INTEGER PRIMARY KEY,
+                username TEXT,
+                item_id INT,
+                item_name TEXT,
+                amount REAL,
+                unit INT,
+                receipt_date DATE,
+                receipt_id TEXT,
+                sale_price REAL,
+                savings REAL,
+                expiry_date DATE,
+                deadline DATE,
+                total_savings REAL,
+                receipt_path TEXT
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_adjustment_opportunities_username_deadline
+            ON adjustment_opportunities (username, deadline)
+        """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_adjustment_opportunities_item_id
+            ON adjustment_opportunities (item_id)
+        """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_adjustment_opportunities_receipt_id
+            ON adjustment_opportunities (receipt_id)
+        """
+        )
+
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS notifications_sent (
+                username TEXT,
+                receipt_id TEXT,
+                item_id INT,
+                expiry_date DATE,
+                sale_price REAL,
+                savings REAL,
+                sent_at DATETIME,
+                PRIMARY KEY (username, receipt_id, item_id, expiry_date)
+            )
+        """
+        )
+
+        if not already_exists:
+            rebuild_opportunities(cursor)
+
+
+def rebuild_opportunities(cursor):
+    """
+    Recompute every price adjustment opportunity from scratch.
+
+    Args:
+        cursor: A cursor on an open connection to the database.
+    """
+    if not _source_tables_exist(cursor):
+        return
+    cursor.execute("DELETE FROM adjustment_opportunities")
+    cursor.execute(f"INSERT INTO adjustment_opportunities ({OPPORTUNITY_COLUMNS}) {MATCH_SELECT}")
+
+
+def refresh_opportunities_for_items(cursor, item_ids):
+    """
+    Recompute the opportunities for sale items that were inserted or replaced.
+
+    Args:
+        cursor: A cursor on an open connection to the database.
+        item_ids (iterable): The IDs of the changed sale items.
+    """
+    if not _source_tables_exist(cursor):
+        return
+    for chunk in _chunks(set(item_ids)):
+        cursor.execute(
+            f"DELETE FROM adjustment_opportunities WHERE item_id IN ({_placeholders(chunk)})",
+            chunk,
+        )
+        cursor.execute(
+            f"INSERT INTO adjustment_opportunities ({OPPORTUNITY_COLUMNS}) {MATCH_SELECT} "
+            f"AND ri.item_id IN ({_placeholders(chunk)})",
+            chunk,
+        )
+    prune_closed_opportunities(cursor)
+
+
+def refresh_opportunities_for_receipts(cursor, receipt_ids):
+    """
+    Recompute the opportunities for receipts whose items were inserted or replaced.
+
+    Args:
+        cursor: A cursor on an open connection to the database.
+        receipt_ids (iterable): The IDs of the changed receipts.
+    """
+    if not _source_tables_exist(cursor):
+        return
+    for chunk in _chunks(set(receipt_ids)):
+        cursor.execute(
+            f"DELETE FROM adjustment_opportunities WHERE receipt_id IN ({_placeholders(chunk)})",
+            chunk,
+        )
+        cursor.execute(
+            f"INSERT INTO adjustment_opportunities ({OPPORTUNITY_COLUMNS}) {MATCH_SELECT} "
+            f"AND ri.receipt_id IN ({_placeholders(chunk)})",
+            chunk,
+        )
+    prune_closed_opportunities(cursor)
+
+
+def refresh_receipt_paths(cursor, receipt_ids):
+    """
+    Update the receipt screenshot paths of existing opportunities.
+
+    Args:
+        cursor: A cursor on an open connection to the database.
+        receipt_ids (iterable): The IDs of the receipts whose screenshots changed.
+    """
+    if not _source_tables_exist(cursor):
+        return
+    for chunk in _chunks(set(receipt_ids)):
+        cursor.execute(
+            f"""
+            UPDATE adjustment_opportunities
+            SET receipt_path = (
+                SELECT r.receipt_path
+                FROM receipts r
+                WHERE r.receipt_id = adjustment_opportunities.receipt_id
+                ORDER BY r.id DESC
+                LIMIT 1
+            )
+            WHERE receipt_id IN ({_placeholders(chunk)})
+            """,
+            chunk,
+        )
+
+
+def prune_closed_opportunities(cursor):
+    """
+    Delete opportunities whose refund window has closed.
+
+    Args:
+        cursor: A cursor on an open connection to the database.
+    """
+    cursor.execute(
+        "DELETE FROM adjustment_opportunities WHERE deadline < date('now', 'localtime')"
+    )
+
+
+@telemetry.timed("db.find_adjustments")
+def find_adjustments(username):
+    """
+    Find the price adjustment opportunities for a user.
+
+    Args:
+        username (str): The username whose receipt items are matched.
+
+    Returns:
+        list: A list of `AdjustmentMatch` records ordered by refund deadline.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT item_id, item_name, amount, unit, receipt_date, receipt_id, sale_price,
+                   savings, expiry_date, deadline, total_savings, receipt_path
+            FROM adjustment_opportunities
+            WHERE username = ?
+              AND deadline >= date('now', 'localtime')
+            ORDER BY deadline, receipt_id, item_id
+            """,
+            (username,),
+        )
+        result = cursor.fetchall()
+
+    return [AdjustmentMatch._make(row) for row in result]
+
+
+@telemetry.timed("db.find_new_adjustments")
+def find_new_adjustments(username):
+    """
+    Find the price adjustment opportunities for a user that were not emailed yet,
+    or whose sale price or savings changed since they were emailed.
+
+    Args:
+        username (str): The username whose receipt items are matched.
+
+    Returns:
+        list: A list of `AdjustmentMatch` records ordered by refund deadline.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT ao.item_id, ao.item_name, ao.amount, ao.unit, ao.receipt_date, ao.receipt_id,
+                   ao.sale_price, ao.savings, ao.expiry_date, ao.deadline, ao.total_savings,
+                   ao.receipt_path
+            FROM adjustment_opportunities ao
+            LEFT JOIN notifications_sent ns
+              ON ns.username = ao.username
+             AND ns.receipt_id = ao.receipt_id
+             AND ns.item_id = ao.item_id
+             AND ns.expiry_date = ao.expiry_date
+            WHERE ao.username = ?
+              AND ao.deadline >= date('now', 'localtime')
+              AND (
+                  ns.username IS NULL
+                  OR ns.sale_price IS NOT ao.sale_price
+                  OR ns.savings IS NOT ao.savings
+              )
+            ORDER BY ao.deadline, ao.receipt_id, ao.item_id
+            """,
+            (username,),
+        )
+        result = cursor.fetchall()
+
+    return [AdjustmentMatch._make(row) for row in result]
+
+
+@serialized_write
+@telemetry.timed("db.record_notifications")
+def record_notifications(username, matches):
+    """
+    Record matches as emailed to a user, so they are not sent again.
+
+    Entries whose sale has expired are deleted at the same time, as an offer
+    cannot come back with the same expiry date.
+
+    Args:
+        username (str): The username the matches were emailed to.
+        matches (list): The `AdjustmentMatch` records that were sent.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            """
+            INSERT OR REPLACE INTO notifications_sent (
+                username, receipt_id, item_id, expiry_date, sale_price, savings, sent_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, datetime('now', 'localtime'))
+            """,
+            [
+                (username, match.receipt_id, match.item_id, match.expiry_date, match.sale_price, match.savings)
+                for match in matches
+            ],
+        )
+        cursor.execute("DELETE FROM notifications_sent WHERE expiry_date < date('now', 'localtime')")
+
+
+def get_receipt_paths(matches):
+    """
+    Get the distinct receipt screenshot paths referenced by a list of matches.
+
+    Args:
+        matches (list): A list of `AdjustmentMatch` records.
+
+    Returns:
+        list: A list of receipt paths in match order, without duplicates or missing paths.
+    """
+    return list(dict.fromkeys(match.receipt_path for match in matches if match.receipt_path))
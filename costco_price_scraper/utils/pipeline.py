@@ -0,0 +1,459 @@
+"""
+Module expressing the main pipeline as a graph of checkpointed stages.
+
+Every run gets a run id. The status and JSON output of each stage are recorded in
+the 'pipeline_runs' and 'pipeline_stages' tables, so a rerun after a failure
+resumes from the first incomplete stage instead of scraping everything again.
+
+Stages:
+- prices: Scrape the frugalhotspot sale posts.
+- coupons: Scrape the costco.com online offers.
+- login: Log into costco.com in the browser (not checkpointed, the session cannot be saved).
+- receipts: Scrape the receipts of the account.
+- match: Match the receipt items against the sale catalog, keeping those not emailed yet.
+- notify: Email the matches found and record them in the notification ledger.
+
+Functions:
+- `create_pipeline_tables`: Create the 'pipeline_runs' and 'pipeline_stages' tables.
+- `run_pipeline`: Run (or resume) every stage in dependency order.
+- `run_stage`: Run a single stage on its own.
+- `print_timing_report`: Print the stage timings and the critical path of a run.
+
+Every invocation is also recorded in the 'runs' table by `telemetry.run_report`, with
+the spans of the stages and of the code they call. With `main.py --profile` every
+stage is profiled by `profiler.profile`.
+
+Independent stages (prices, coupons and login) can run concurrently; writes to the
+database are serialized by `db_utils.serialized_write`.
+
+Constants:
+- RESUME_WINDOW_HOURS (int): Incomplete runs older than this are not resumed.
+"""
+
+import json
+import sqlite3
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from costco_price_scraper.utils import http_client, profiler, rate_limiter, telemetry
+from costco_price_scraper.utils.db_utils import serialized_write
+
+DB_FILE = "scraped_prices.db"
+
+RESUME_WINDOW_HOURS = 12
+
+# Stages with checkpoint=False keep their output in memory only and are rerun whenever
+# a stage depending on them has to run
+Stage = namedtuple("Stage", ["name", "func", "deps", "checkpoint"], defaults=[True])
+
+
+def _prices_stage(context, inputs):
+    from costco_price_scraper.price_scraper import price_scraper as ps
+
+    return {"items": len(ps.run_price_scraper())}
+
+
+def _coupons_stage(context, inputs):
+    from costco_price_scraper.price_scraper import costco_coupon_scraper as cs
+
+    return {"items": len(cs.run_price_scraper())}
+
+
+def _login_stage(context, inputs):
+    from costco_price_scraper.receipt_scraper import receipt_scraper as rs
+
+    return rs.initialize_scraper(context["username"], context["password"])
+
+
+def _release_login(session):
+    """
+    Quit the browser of a login no receipts stage took over; the receipt scraper
+    quits it otherwise.
+    """
+    driver, _ = session
+    try:
+        driver.quit()
+    except Exception as e:
+        print(f"Could not quit the browser: {e}")
+
+
+def _receipts_stage(context, inputs):
+    from costco_price_scraper.utils import runner
+
+    # Without a login from this invocation the receipt scraper logs in by itself
+    runner.scrape_account_receipts(context["username"], context["password"], session=inputs.get("login"))
+    return {"username": context["username"]}
+
+
+def _match_stage(context, inputs):
+    from costco_price_scraper.utils import matcher
+
+    matches = matcher.find_new_adjustments(context["username"])
+    return [match._asdict() for match in matches]
+
+
+def _notify_stage(context, inputs):
+    from costco_price_scraper.utils import email_builder, matcher
+
+    if inputs.get("match") is not None:
+        matches = [matcher.AdjustmentMatch(**match) for match in inputs["match"]]
+    else:
+        matches = matcher.find_new_adjustments(context["username"])
+
+    subject, body = email_builder.construct_adjustment_email_body_and_subject(matches)
+    paths = matcher.get_receipt_paths(matches)
+
+    if matches:  # Only send emails if there are price adjustments found
+        from costco_price_scraper.utils import email_sender
+
+        email_sender.send_email(subject, body, context["username"], paths)
+        matcher.record_notifications(context["username"], matches)
+    return {"sent": bool(matches), "matches": len(matches)}
+
+
+STAGES = {
+    stage.name: stage
+    for stage in [
+        Stage("prices", _prices_stage, ()),
+        Stage("coupons", _coupons_stage, ()),
+        Stage("login", _login_stage, (), checkpoint=False),
+        Stage("receipts", _receipts_stage, ("login",)),
+        Stage("match", _match_stage, ("prices", "coupons", "receipts")),
+        Stage("notify", _notify_stage, ("match",)),
+    ]
+}
+
+
+@serialized_write
+def create_pipeline_tables():
+    """
+    Create the 'pipeline_runs' and 'pipeline_stages' tables in the SQLite database.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pipeline_runs (
+                run_id TEXT PRIMARY KEY,
+                username TEXT,
+                status TEXT,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pipeline_stages (
+                run_id TEXT,
+                stage TEXT,
+                status TEXT,
+                output TEXT,
+                error TEXT,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                PRIMARY KEY (run_id, stage)
+            )
+        """
+        )
+
+
+def _create_tables():
+    from costco_price_scraper.utils import matcher
+
+    create_pipeline_tables()
+    matcher.create_adjustment_opportunities_table()
+    telemetry.create_runs_table()
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _find_resumable_run(username):
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT run_id FROM pipeline_runs
+            WHERE username = ?
+              AND status != 'done'
+              AND started_at >= datetime('now', 'localtime', '-{RESUME_WINDOW_HOURS} hours')
+            ORDER BY started_at DESC
+            LIMIT 1
+            """,
+            (username,),
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+@serialized_write
+def _start_run(run_id, username):
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.execute(
+            """
+            INSERT INTO pipeline_runs (run_id, username, status, started_at)
+            VALUES (?, ?, 'running', ?)
+            ON CONFLICT (run_id) DO UPDATE SET status = 'running', finished_at = NULL
+            """,
+            (run_id, username, _now()),
+        )
+
+
+@serialized_write
+def _finish_run(run_id, status):
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.execute(
+            "UPDATE pipeline_runs SET status = ?, finished_at = ? WHERE run_id = ?",
+            (status, _now(), run_id),
+        )
+
+
+def _load_completed_outputs(run_id):
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT stage, output FROM pipeline_stages WHERE run_id = ? AND status = 'done'",
+            (run_id,),
+        )
+        rows = cursor.fetchall()
+    return {stage: json.loads(output) for stage, output in rows}
+
+
+@serialized_write
+def _record_stage(run_id, stage, status, output=None, error=None, started_at=None):
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.execute(
+            """
+            INSERT INTO pipeline_stages (run_id, stage, status, output, error, started_at, finished_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (run_id, stage) DO UPDATE SET
+                status = excluded.status,
+                output = excluded.output,
+                error = excluded.error,
+                started_at = coalesce(excluded.started_at, pipeline_stages.started_at),
+                finished_at = excluded.finished_at
+            """,
+            (
+                run_id,
+                stage,
+                status,
+                None if output is None else json.dumps(output),
+                error,
+                started_at,
+                None if status == "running" else _now(),
+            ),
+        )
+
+
+def _execute_stage(run_id, stage, context, outputs):
+    """
+    Run one stage, checkpointing its status and output.
+
+    Returns:
+        The stage output.
+    """
+    inputs = {dep: outputs.get(dep) for dep in stage.deps}
+    print(f"[{run_id}] Running stage {stage.name}")
+    if not stage.checkpoint:
+        with profiler.profile(f"stage.{stage.name}"), telemetry.span(f"stage.{stage.name}"):
+            return stage.func(context, inputs)
+
+    _record_stage(run_id, stage.name, "running", started_at=_now())
+    try:
+        with profiler.profile(f"stage.{stage.name}"), telemetry.span(f"stage.{stage.name}"):
+            output = stage.func(context, inputs)
+    except Exception as e:
+        _record_stage(run_id, stage.name, "failed", error=repr(e))
+        raise
+    _record_stage(run_id, stage.name, "done", output=output)
+    return output
+
+
+def _stages_to_run(outputs):
+    """
+    Get the stages a run still has to execute.
+
+    Returns:
+        set: Incomplete checkpointed stages plus the transient stages they depend on.
+    """
+    to_run = {name for name, stage in STAGES.items() if stage.checkpoint and name not in outputs}
+    pending = list(to_run)
+    while pending:
+        for dep in STAGES[pending.pop()].deps:
+            if dep not in outputs and dep not in to_run:
+                to_run.add(dep)
+                pending.append(dep)
+    return to_run
+
+
+def _execute_stages(run_id, to_run, context, outputs, max_workers):
+    """
+    Run stages as soon as their dependencies are complete.
+
+    Returns:
+        dict: Stage name to (start, end) seconds relative to the start of the call.
+    """
+    timings = {}
+    origin = time.perf_counter()
+
+    def timed(stage):
+        start = time.perf_counter() - origin
+        try:
+            return _execute_stage(run_id, stage, context, outputs)
+        finally:
+            timings[stage.name] = (start, time.perf_counter() - origin)
+
+    pending = set(to_run)
+    errors = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+            while (pending and not errors) or running:
+                if not errors:
+                    ready = [name for name in pending if all(dep in outputs for dep in STAGES[name].deps)]
+                    # Submit in declaration order so the sequential mode keeps the original order
+                    for name in sorted(ready, key=list(STAGES).index):
+                        pending.discard(name)
+                        running[executor.submit(timed, STAGES[name])] = name
+                if not running:
+                    raise RuntimeError(f"Stages {sorted(pending)} have unsatisfiable dependencies")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        outputs[name] = future.result()
+                    except Exception as e:
+                        errors.append(e)
+    finally:
+        # A stage failing after the login stops the run before the receipts stage,
+        # which would have quit the browser
+        if outputs.get("login") is not None and "receipts" in pending:
+            _release_login(outputs["login"])
+
+    if errors:
+        raise errors[0]
+    return timings
+
+
+def print_timing_report(run_id, timings):
+    """
+    Print the stage timings of a run and its critical path.
+
+    The critical path is found by walking back from the stage that finished last,
+    each time through the dependency that finished last.
+
+    Args:
+        run_id (str): The run id.
+        timings (dict): Stage name to (start, end) seconds.
+    """
+    if not timings:
+        return
+    print(f"[{run_id}] Stage timings:")
+    for name, (start, end) in sorted(timings.items(), key=lambda item: item[1][0]):
+        print(f"  {name:<10} start {start:8.2f}s  end {end:8.2f}s  duration {end - start:8.2f}s")
+
+    current = max(timings, key=lambda name: timings[name][1])
+    critical_path = [current]
+    while True:
+        deps = [dep for dep in STAGES[current].deps if dep in timings]
+        if not deps:
+            break
+        current = max(deps, key=lambda name: timings[name][1])
+        critical_path.insert(0, current)
+
+    wall_time = max(end for _, end in timings.values())
+    total_time = sum(end - start for start, end in timings.values())
+    print(f"  Critical path: {' -> '.join(critical_path)}")
+    print(f"  Wall time {wall_time:.2f}s, sum of stage durations {total_time:.2f}s")
+
+
+def run_pipeline(username, password=None, run_id=None, resume=True, concurrent=False):
+    """
+    Run every stage in dependency order, skipping stages already completed in the run.
+
+    Args:
+        username (str): Costco account username.
+        password (str): Costco account password, read from the config when not given.
+        run_id (str): Run to continue. When not given, the latest incomplete run of the
+            user is resumed if `resume` is set, otherwise a new run is started.
+        resume (bool): Whether to resume the latest incomplete run.
+        concurrent (bool): Whether to overlap independent stages (prices, coupons and
+            login) instead of running one stage at a time. Ignored while profiling.
+
+    Returns:
+        str: The run id.
+    """
+    _create_tables()
+    if run_id is None and resume:
+        run_id = _find_resumable_run(username)
+    if run_id is None:
+        run_id = uuid.uuid4().hex
+
+    context = {"username": username, "password": password}
+    outputs = _load_completed_outputs(run_id)
+    if outputs:
+        print(f"[{run_id}] Resuming, completed stages: {', '.join(outputs)}")
+
+    to_run = _stages_to_run(outputs)
+    max_workers = max(len(to_run), 1) if concurrent else 1
+    if profiler.is_enabled():
+        # Overlapping stages would mix their memory snapshots
+        max_workers = 1
+
+    _start_run(run_id, username)
+    with telemetry.run_report("pipeline", run_id, username):
+        try:
+            timings = _execute_stages(run_id, to_run, context, outputs, max_workers)
+        except Exception:
+            _finish_run(run_id, "failed")
+            raise
+        _finish_run(run_id, "done")
+        print_timing_report(run_id, timings)
+        http_client.print_metrics()
+        rate_limiter.print_states()
+    return run_id
+
+
+def run_stage(name, username, password=None, run_id=None):
+    """
+    Run a single stage on its own.
+
+    The outputs of dependencies completed in the run are passed to the stage; stages
+    handle missing inputs by reading the database directly.
+
+    Args:
+        name (str): The stage name.
+        username (str): Costco account username.
+        password (str): Costco account password, read from the config when not given.
+        run_id (str): Run to record the stage in. A new run is started when not given.
+
+    Returns:
+        str: The run id.
+    """
+    _create_tables()
+    if run_id is None:
+        run_id = uuid.uuid4().hex
+
+    context = {"username": username, "password": password}
+    outputs = _load_completed_outputs(run_id)
+
+    _start_run(run_id, username)
+    try:
+        with telemetry.run_report(f"stage.{name}", run_id, username):
+            output = _execute_stage(run_id, STAGES[name], context, outputs)
+        if name == "login":
+            # Nothing uses the browser of a login run on its own
+            _release_login(output)
+    except Exception:
+        _finish_run(run_id, "failed")
+        raise
+    completed = set(_load_completed_outputs(run_id))
+    checkpointed = {name for name, stage in STAGES.items() if stage.checkpoint}
+    _finish_run(run_id, "done" if completed >= checkpointed else "partial")
+    return run_id
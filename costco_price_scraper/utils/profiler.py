@@ -0,0 +1,121 @@
+"""
+Module profiling the stages of a run, for `main.py --profile`.
+
+While enabled, every `profile` block runs under cProfile and between two tracemalloc
+snapshots. For a block named <name> the run directory gets:
+
+- <name>.prof: The CPU profile, for `python -m pstats` or snakeviz.
+- <name>.alloc.txt: The peak traced memory and the TOP_N lines that allocated the
+  most memory still held at the end of the block.
+
+When profiling is not enabled `profile` only yields, so the pipeline pays nothing
+for it.
+
+Functions:
+- `enable`: Turn profiling on, writing the reports to a new run directory.
+- `is_enabled`: Whether profiling is on.
+- `profile`: Context manager profiling a block.
+
+Constants:
+- PROFILE_ROOT (str): Default folder holding the run directories.
+- TOP_N (int): Allocation sites listed in each report.
+- TRACE_FRAMES (int): Frames stored per traced allocation.
+
+Note: cProfile only sees the thread that opened the block and the tracemalloc
+snapshots cover the whole process, so blocks must not overlap: the pipeline runs its
+stages one at a time while profiling.
+"""
+
+import cProfile
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILE_ROOT = "profiles"
+TOP_N = 25
+TRACE_FRAMES = 1
+
+_run_dir = None
+
+
+def enable(profile_root=None):
+    """
+    Turn profiling on for the rest of the process.
+
+    Args:
+        profile_root (str): Folder of the run directories, `PROFILE_ROOT` by default.
+
+    Returns:
+        str: The run directory the reports are written to.
+    """
+    global _run_dir
+    run_dir = os.path.join(profile_root or PROFILE_ROOT, datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(run_dir, exist_ok=True)
+    _run_dir = run_dir
+    print(f"Profiling, reports are written to {run_dir}")
+    return run_dir
+
+
+def is_enabled():
+    """
+    Whether profiling is on.
+    """
+    return _run_dir is not None
+
+
+def _snapshot():
+    # Leave out the memory of the snapshots and of the profiler itself
+    return tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, cProfile.__file__)]
+    )
+
+
+def _write_allocations(path, name, seconds, before, after, peak):
+    stats = after.compare_to(before, "lineno")
+    grown = [stat for stat in stats if stat.size_diff > 0]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"{name}: {seconds:.2f}s, peak traced memory {peak / 2 ** 20:.1f} MiB\n")
+        f.write(f"Top {TOP_N} allocation sites by memory still held at the end:\n")
+        for stat in grown[:TOP_N]:
+            f.write(f"{stat}\n")
+        f.write(f"Allocated in total {sum(stat.size_diff for stat in grown) / 2 ** 20:.1f} MiB "
+                f"at {len(grown)} sites\n")
+
+
+@contextmanager
+def profile(name):
+    """
+    Profile a block (CPU and memory) when profiling is enabled.
+
+    Args:
+        name (str): The block name, used for the report file names.
+    """
+    if _run_dir is None:
+        yield
+        return
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(TRACE_FRAMES)
+    tracemalloc.reset_peak()
+    before = _snapshot()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        after = _snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+
+        prof_path = os.path.join(_run_dir, f"{name}.prof")
+        alloc_path = os.path.join(_run_dir, f"{name}.alloc.txt")
+        profiler.dump_stats(prof_path)
+        _write_allocations(alloc_path, name, seconds, before, after, peak)
+        print(f"Profiled {name}: {seconds:.2f}s, peak {peak / 2 ** 20:.1f} MiB -> {prof_path}, {alloc_path}")
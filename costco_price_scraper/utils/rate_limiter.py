@@ -0,0 +1,342 @@
+"""
+Module to pace the requests sent to each host and to stop sending once the host
+starts blocking us.
+
+costco.com and the orders API sit behind bot protection: a burst of requests gets
+answered with 429 or 403, and a block costs far more than going slower. Every host
+gets a `HostLimiter`, used by `http_client` around each request:
+
+- A token bucket paces the requests. Its rate is halved on every 429/403 and grows
+  back slowly after successes (additive increase, multiplicative decrease). A
+  Retry-After pauses the host for every thread.
+- A circuit breaker opens after FAILURE_THRESHOLD consecutive 429/403 responses.
+  While open, every request to the host fails fast with `CircuitOpenError`. After
+  the cooldown one trial request is let through; its success closes the breaker,
+  its failure reopens it with twice the cooldown.
+
+An open breaker is also written to the 'host_circuits' table, so worker processes
+of a multi-account run stop hitting the host as well.
+
+Classes:
+- `CircuitOpenError`: Raised for a request to a host whose breaker is open.
+- `TokenBucket`: Adaptive token bucket.
+- `CircuitBreaker`: Circuit breaker with the closed, open and half-open states.
+- `HostLimiter`: Token bucket and circuit breaker of one host.
+
+Functions:
+- `for_host`: Get the limiter of a host.
+- `get_states`: Return the limiter state of every host used.
+- `print_states`: Print the limiter state of every host used.
+
+Config ('RateLimit' section, or 'RateLimit <host>' for one host):
+- RATE, BURST: Requests per second and bucket size to start from.
+- MIN_RATE, MAX_RATE: Bounds of the adaptive rate.
+- FAILURE_THRESHOLD: Consecutive 429/403 responses that open the breaker.
+- COOLDOWN: Seconds the breaker stays open the first time.
+"""
+
+import sqlite3
+import threading
+import time
+
+from costco_price_scraper.utils import config
+
+DB_FILE = "scraped_prices.db"
+
+RATE = 2.0
+BURST = 4
+MIN_RATE = 0.1
+MAX_RATE = 10.0
+FAILURE_THRESHOLD = 3
+COOLDOWN = 300.0
+MAX_COOLDOWN = 3600.0
+
+# Rate added back after every successful request
+RATE_INCREASE = 0.05
+
+BLOCK_STATUSES = frozenset((403, 429))
+
+# Seconds between two reads of the breakers opened by other processes
+SHARED_STATE_INTERVAL = 5.0
+
+
+class CircuitOpenError(Exception):
+    """Raised for a request to a host whose circuit breaker is open."""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"{host} is blocking requests, circuit open for another {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class TokenBucket:
+    """
+    A token bucket whose rate adapts to the throttling responses of the host.
+    """
+
+    def __init__(self, rate=RATE, burst=BURST, min_rate=MIN_RATE, max_rate=MAX_RATE):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = float(burst)
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        """Halve the rate, empty the bucket and pause for Retry-After seconds."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def succeeded(self):
+        """Grow the rate back a little."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker counting consecutive block responses of a host.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self.times_opened = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check whether a request may be sent.
+
+        Returns:
+            float: 0 if allowed, otherwise the seconds until the next trial request.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            now = time.time()
+            if self.state == self.OPEN and now >= self.open_until:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return 0.0
+            return max(self.open_until - now, 1.0)
+
+    def release_trial(self):
+        """Let another trial request through after one that got no response."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_running = False
+            if self.state != self.CLOSED:
+                self.state = self.CLOSED
+                self.cooldown = self.base_cooldown
+
+    def record_block(self):
+        """
+        Count a block response.
+
+        Returns:
+            bool: Whether the breaker has just opened.
+        """
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self._trial_running = False
+                self.cooldown = min(self.cooldown * 2, MAX_COOLDOWN)
+            elif self.state == self.OPEN or self.failures < self.failure_threshold:
+                return False
+            self._open(time.time() + self.cooldown)
+            return True
+
+    def open_until_time(self, open_until):
+        """Open the breaker until a time set by another process."""
+        with self._lock:
+            if self.state == self.CLOSED and open_until > time.time():
+                self._open(open_until)
+
+    def _open(self, open_until):
+        self.state = self.OPEN
+        self.open_until = open_until
+        self.times_opened += 1
+
+
+class HostLimiter:
+    """
+    Token bucket and circuit breaker of one host.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        section = f"RateLimit {host}"
+
+        def read(option, fallback):
+            return float(config.read_config(section, option, config.read_config("RateLimit", option, fallback)))
+
+        self.bucket = TokenBucket(
+            read("RATE", RATE), read("BURST", BURST), read("MIN_RATE", MIN_RATE), read("MAX_RATE", MAX_RATE)
+        )
+        self.breaker = CircuitBreaker(int(read("FAILURE_THRESHOLD", FAILURE_THRESHOLD)), read("COOLDOWN", COOLDOWN))
+        self.throttled = 0
+        self.blocked = 0
+        self._shared_checked = 0.0
+
+    def before_request(self):
+        """
+        Wait for the bucket to allow a request.
+
+        Raises:
+            CircuitOpenError: If the breaker of the host is open.
+        """
+        self._check_shared_state()
+        retry_in = self.breaker.allow()
+        if retry_in:
+            raise CircuitOpenError(self.host, retry_in)
+        self.bucket.acquire()
+
+    def after_response(self, status_code, retry_after=None):
+        """Adapt the rate and the breaker to the status of a response."""
+        if status_code not in BLOCK_STATUSES:
+            self.bucket.succeeded()
+            self.breaker.record_success()
+            return
+
+        if status_code == 429:
+            self.throttled += 1
+        else:
+            self.blocked += 1
+        self.bucket.throttled(retry_after)
+        if self.breaker.record_block():
+            print(f"Circuit breaker opened for {self.host} for {self.breaker.cooldown:.0f}s")
+            _save_open_circuit(self.host, self.breaker.open_until)
+
+    def after_error(self):
+        """A request got no response, which says nothing about blocking."""
+        self.breaker.release_trial()
+
+    def _check_shared_state(self):
+        now = time.monotonic()
+        if now - self._shared_checked < SHARED_STATE_INTERVAL:
+            return
+        self._shared_checked = now
+        open_until = _load_open_circuit(self.host)
+        if open_until:
+            self.breaker.open_until_time(open_until)
+
+    def state(self):
+        return {
+            "state": self.breaker.state,
+            "rate": round(self.bucket.rate, 3),
+            "throttled": self.throttled,
+            "blocked": self.blocked,
+            "times_opened": self.breaker.times_opened,
+            "open_until": self.breaker.open_until if self.breaker.state != CircuitBreaker.CLOSED else None,
+        }
+
+
+def _save_open_circuit(host, open_until):
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS host_circuits (host TEXT PRIMARY KEY, open_until REAL)")
+            conn.execute("INSERT OR REPLACE INTO host_circuits (host, open_until) VALUES (?, ?)", (host, open_until))
+    except sqlite3.Error as e:
+        print(f"Could not share the circuit state of {host}: {e}")
+
+
+def _load_open_circuit(host):
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            row = conn.execute(
+                "SELECT open_until FROM host_circuits WHERE host = ? AND open_until > ?", (host, time.time())
+            ).fetchone()
+    except sqlite3.OperationalError:
+        # No breaker was ever opened
+        return None
+    return row[0] if row else None
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def for_host(host):
+    """
+    Get the limiter of a host, creating it on first use.
+
+    Args:
+        host (str): The host, with the port if not the default one.
+
+    Returns:
+        HostLimiter: The limiter shared by every thread of the process.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = HostLimiter(host)
+    return limiter
+
+
+def get_states():
+    """
+    Return the limiter state of every host used.
+
+    Returns:
+        dict: Host to state (breaker state, current rate, throttled and blocked counts).
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.host: limiter.state() for limiter in limiters}
+
+
+def print_states():
+    """
+    Print the limiter state of every host used.
+    """
+    states = get_states()
+    if not states:
+        return
+    print("Rate limits:")
+    for host, state in sorted(states.items()):
+        line = (
+            f"  {host:<28} circuit {state['state']:<9} rate {state['rate']:6.2f}/s  "
+            f"{state['throttled']:>3} throttled  {state['blocked']:>3} blocked"
+        )
+        if state["open_until"]:
+            line += f"  open until {time.strftime('%H:%M:%S', time.localtime(state['open_until']))}"
+        print(line)
@@ -0,0 +1,275 @@
+"""
+Module to run the price adjustment pipeline for one or many Costco accounts.
+
+The sale catalog (frugalhotspot posts and costco.com online offers) is shared by all
+accounts, so it is scraped once per cycle. The receipt and matching stages are
+specific to an account and run in a process pool, each process with its own
+browser profile.
+
+Functions:
+- `scrape_sale_catalog`: Scrape the shared sale sources into the 'items' table.
+- `scrape_account_receipts`: Scrape the receipts of one account into the database.
+- `notify_account`: Match the receipts of one account and send the email.
+- `notify_accounts`: Send the emails of many accounts over pooled SMTP connections.
+- `process_account`: Scrape the receipts of one account, match them and send the email.
+- `run_all_accounts`: Scrape the sale catalog once and process every configured account.
+- `print_account_reports`: Print the per-account results of a run.
+
+Constants:
+- PROFILE_ROOT (str): Default folder holding the per-account browser profiles.
+- MAX_WORKERS (int): Default number of accounts processed at the same time.
+"""
+
+import os
+import re
+
+from costco_price_scraper.utils import config, db_utils, email_builder, matcher, telemetry
+
+PROFILE_ROOT = "browser_profiles"
+MAX_WORKERS = 2
+
+
+def scrape_sale_catalog():
+    """
+    Scrape the sale sources shared by every account.
+    """
+    # Scraper imports (bs4, html5lib, requests) are only paid for by the stages using them
+    from costco_price_scraper.price_scraper import price_scraper as ps
+    from costco_price_scraper.price_scraper import costco_coupon_scraper as cs
+
+    matcher.create_adjustment_opportunities_table()
+    ps.run_price_scraper()
+    cs.run_price_scraper()
+
+
+def scrape_account_receipts(username, password=None, profile_dir=None, all_receipts=False, session=None):
+    """
+    Scrape the receipts of an account into the database.
+
+    Args:
+        username (str): Costco account username.
+        password (str): Costco account password, read from the config when not given.
+        profile_dir (str): Optional browser profile directory for this account.
+        all_receipts (bool): Whether to process every receipt instead of only recent ones.
+        session (tuple): Optional (driver, client_id) of a browser that is already logged in.
+    """
+    from costco_price_scraper.receipt_scraper import receipt_scraper as rs
+
+    rs.run_receipt_scraper_with_api(
+        all_receipts=all_receipts, username=username, password=password, profile_dir=profile_dir,
+        session=session,
+    )
+
+
+def notify_account(username, dry_run=False, resend=False):
+    """
+    Match the receipts of an account against the sale catalog and email the price
+    adjustments that were not emailed yet.
+
+    Args:
+        username (str): Costco account username, also used as the recipient address.
+        dry_run (bool): Print the email instead of sending it.
+        resend (bool): Email every open adjustment, including those already sent.
+
+    Returns:
+        list: The `AdjustmentMatch` records emailed (or printed) for the account.
+    """
+    if resend:
+        matches = matcher.find_adjustments(username)
+    else:
+        matches = matcher.find_new_adjustments(username)
+
+    subject, body = email_builder.construct_adjustment_email_body_and_subject(matches)
+    paths = matcher.get_receipt_paths(matches)
+
+    if dry_run:
+        print(f"Subject: {subject}")
+        print(f"Attachments: {paths}")
+        print(body)
+    elif matches:  # Only send emails if there are price adjustments found
+        from costco_price_scraper.utils import email_sender
+
+        email_sender.send_email(subject, body, username, paths)
+        matcher.record_notifications(username, matches)
+    return matches
+
+
+def notify_accounts(matches_by_user, dry_run=False):
+    """
+    Email the price adjustments of many accounts in one batch, reusing the
+    authenticated SMTP connections for every message.
+
+    Args:
+        matches_by_user (dict): Username to list of `AdjustmentMatch` records, usually
+            from `matcher.find_new_adjustments`; the username is also the recipient
+            address. Sent matches are recorded in the notification ledger.
+        dry_run (bool): Print the emails instead of sending them.
+
+    Returns:
+        dict: Username to send error, for the accounts whose email failed.
+    """
+    # Only send emails if there are price adjustments found
+    matches_by_user = {username: matches for username, matches in matches_by_user.items() if matches}
+    digests = email_builder.render_digests(matches_by_user)
+
+    from costco_price_scraper.utils import email_delivery
+
+    emails = [
+        email_delivery.OutgoingEmail(username, subject, body, matcher.get_receipt_paths(matches_by_user[username]))
+        for username, (subject, body) in digests.items()
+    ]
+    if dry_run:
+        for email in emails:
+            print(f"To: {email.to_email}")
+            print(f"Subject: {email.subject}")
+            print(f"Attachments: {email.attachment_paths}")
+            print(email.body)
+        return {}
+    if not emails:
+        return {}
+    results = email_delivery.send_batch(emails)
+    for username, error in results:
+        if error is None:
+            matcher.record_notifications(username, matches_by_user[username])
+    return {username: error for username, error in results if error is not None}
+
+
+def process_account(username, password=None, profile_dir=None, all_receipts=False):
+    """
+    Scrape the receipts of an account, match them against the sale catalog and
+    email the price adjustments found.
+
+    Args:
+        username (str): Costco account username, also used as the recipient address.
+        password (str): Costco account password, read from the config when not given.
+        profile_dir (str): Optional browser profile directory for this account.
+        all_receipts (bool): Whether to process every receipt instead of only recent ones.
+
+    Returns:
+        list: The `AdjustmentMatch` records found for the account.
+    """
+    scrape_account_receipts(username, password, profile_dir, all_receipts)
+    return notify_account(username)
+
+
+def get_profile_dir(profile_root, username):
+    """
+    Get the browser profile directory of an account.
+
+    Args:
+        profile_root (str): Folder holding the per-account browser profiles.
+        username (str): Costco account username.
+
+    Returns:
+        str: The absolute path of the account's profile directory.
+    """
+    safe_username = re.sub(r"[^a-zA-Z0-9]", "_", username)
+    return os.path.abspath(os.path.join(profile_root, safe_username))
+
+
+def _process_account_worker(username, password, profile_dir, all_receipts):
+    """
+    Scrape and match one account inside a worker process and report the outcome.
+    The email is sent by the parent, batched with the other accounts.
+
+    Returns:
+        dict: The account report with its status, matches, error (if any) and the
+        spans recorded in the worker.
+    """
+    # Workers are reused across accounts, only the spans of this account are reported
+    with telemetry.collect() as spans:
+        try:
+            scrape_account_receipts(username, password, profile_dir, all_receipts)
+            matches = matcher.find_new_adjustments(username)
+        except Exception as e:
+            report = {"username": username, "status": "failed", "matches": [], "error": repr(e)}
+        else:
+            report = {"username": username, "status": "ok", "matches": matches, "error": None}
+    report["spans"] = spans
+    return report
+
+
+def run_all_accounts(max_workers=None, profile_root=None, all_receipts=False):
+    """
+    Scrape the sale catalog once and process every configured account.
+
+    Args:
+        max_workers (int): Number of accounts processed at the same time across the
+            whole pool. Read from the 'Runner' config section when not given.
+        profile_root (str): Folder holding the per-account browser profiles.
+        all_receipts (bool): Whether to process every receipt instead of only recent ones.
+
+    Returns:
+        list: One report dictionary per account, in config order.
+    """
+    if max_workers is None:
+        max_workers = int(config.read_runner_config("MAX_WORKERS", MAX_WORKERS))
+    if profile_root is None:
+        profile_root = config.read_runner_config("PROFILE_ROOT", PROFILE_ROOT)
+
+    accounts = config.read_accounts_config()
+
+    # Several processes write to the same database
+    db_utils.enable_wal(matcher.DB_FILE)
+    telemetry.create_runs_table()
+    with telemetry.run_report("accounts"):
+        reports = _run_accounts(accounts, max_workers, profile_root, all_receipts)
+    print_account_reports(reports)
+    return reports
+
+
+def _run_accounts(accounts, max_workers, profile_root, all_receipts):
+    """
+    Scrape the sale catalog, then the accounts in a process pool, and send the emails.
+
+    Returns:
+        list: One report dictionary per account, in config order.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    scrape_sale_catalog()
+
+    # Spawn fresh interpreters so no Chrome or SQLite handles leak into the workers
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = [
+            executor.submit(
+                _process_account_worker,
+                username,
+                password,
+                get_profile_dir(profile_root, username),
+                all_receipts,
+            )
+            for username, password in accounts
+        ]
+        reports = [future.result() for future in futures]
+    for report in reports:
+        telemetry.merge_spans(report.pop("spans"))
+
+    # One pool of SMTP connections for every account's email
+    send_errors = notify_accounts({report["username"]: report["matches"] for report in reports})
+    for report in reports:
+        if report["username"] in send_errors:
+            report["status"] = "failed"
+            report["error"] = repr(send_errors[report["username"]])
+    return reports
+
+
+def print_account_reports(reports):
+    """
+    Print the per-account results of a run.
+
+    Args:
+        reports (list): Report dictionaries returned by `run_all_accounts`.
+    """
+    print("Account Results:")
+    for report in reports:
+        total_savings = sum(match.total_savings for match in report["matches"])
+        print(f"Account: {report['username']}")
+        print(f"Status: {report['status']}")
+        print(f"Price Adjustments: {len(report['matches'])}")
+        print(f"Total Savings: ${total_savings:.2f}")
+        if report["error"]:
+            print(f"Error: {report['error']}")
+        print("---")
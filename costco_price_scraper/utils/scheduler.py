@@ -0,0 +1,259 @@
+"""
+Module providing a resident scheduler that replaces cron invocations of main.py.
+
+The scheduler keeps one interpreter alive, so selenium, undetected_chromedriver,
+bs4 and html5lib are imported once and the config is read once. It triggers the
+price, coupon, receipt and notify stages on their own intervals with jitter,
+skips a stage while its previous run is still active and backs off after failures.
+
+Classes:
+- `Job`: A stage triggered on a fixed interval.
+- `Scheduler`: Runs jobs in background threads until stopped.
+
+Functions:
+- `run_lock`: Context manager holding an exclusive lock so runs never overlap.
+- `build_jobs`: Build the default price, coupon, receipt and notify jobs from the config.
+- `run_daemon`: Run the scheduler until interrupted.
+
+Config ('Scheduler' section, all values in seconds):
+- PRICE_INTERVAL, COUPON_INTERVAL, RECEIPT_INTERVAL, NOTIFY_INTERVAL
+- JITTER: Maximum random delay added to every run.
+- BACKOFF_BASE: Delay before the first retry after a failure; doubled on every further failure.
+- MAX_BACKOFF: Upper bound of the retry delay.
+"""
+
+import fcntl
+import logging
+import os
+import random
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+from costco_price_scraper.utils import config, telemetry
+
+LOCK_FILE = "costco_price_scraper.lock"
+
+PRICE_INTERVAL = 6 * 60 * 60
+COUPON_INTERVAL = 6 * 60 * 60
+RECEIPT_INTERVAL = 24 * 60 * 60
+NOTIFY_INTERVAL = 24 * 60 * 60
+JITTER = 5 * 60
+BACKOFF_BASE = 5 * 60
+MAX_BACKOFF = 6 * 60 * 60
+POSTPONE_DELAY = 60
+
+logger = logging.getLogger(__name__)
+
+
+class RunLockedError(RuntimeError):
+    """Raised when another run already holds the run lock."""
+
+
+@contextmanager
+def run_lock(lock_path=LOCK_FILE):
+    """
+    Hold an exclusive, non-blocking lock on a file for the duration of a run.
+
+    Args:
+        lock_path (str): Path of the lock file shared by every run.
+
+    Raises:
+        RunLockedError: If another process already holds the lock.
+    """
+    with open(lock_path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as e:
+            raise RunLockedError(f"Another run holds {lock_path}") from e
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class Job:
+    """
+    A stage triggered on a fixed interval.
+
+    Attributes:
+        name (str): Name used in the logs.
+        func (callable): The stage to run, called without arguments.
+        interval (float): Seconds between the starts of two runs.
+        jitter (float): Maximum random delay added to every run.
+        backoff_base (float): Delay before the first retry after a failure.
+        max_backoff (float): Upper bound of the retry delay.
+        blocked_by (list): Jobs that must not be running when this job starts.
+    """
+
+    def __init__(self, name, func, interval, jitter=JITTER, backoff_base=BACKOFF_BASE,
+                 max_backoff=MAX_BACKOFF, blocked_by=None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.blocked_by = blocked_by or []
+        self.failures = 0
+        self.next_run = time.monotonic() + random.uniform(0, jitter)
+        self._running = threading.Lock()
+
+    @property
+    def is_running(self):
+        return self._running.locked()
+
+    def try_start(self):
+        """
+        Start the job in a background thread unless its previous run is still active.
+
+        Returns:
+            threading.Thread: The started thread, or None if the run was skipped.
+        """
+        blocking_jobs = [job.name for job in self.blocked_by if job.is_running]
+        if blocking_jobs:
+            logger.info("Postponing %s: waiting for %s", self.name, ", ".join(blocking_jobs))
+            self.schedule_next(POSTPONE_DELAY)
+            return None
+        if not self._running.acquire(blocking=False):
+            logger.warning("Skipping %s: previous run is still active", self.name)
+            self.schedule_next(self.interval)
+            return None
+        self.schedule_next(self.interval)
+        thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        thread.start()
+        return thread
+
+    def schedule_next(self, delay):
+        self.next_run = time.monotonic() + delay + random.uniform(0, self.jitter)
+
+    def _run(self):
+        start = time.monotonic()
+        try:
+            logger.info("Starting %s", self.name)
+            with telemetry.run_report(f"daemon.{self.name}"):
+                self.func()
+        except Exception:
+            self.failures += 1
+            delay = min(self.backoff_base * 2 ** (self.failures - 1), self.max_backoff)
+            logger.exception("%s failed (%d in a row), retrying in %.0fs", self.name, self.failures, delay)
+            self.schedule_next(delay)
+        else:
+            self.failures = 0
+            logger.info("Finished %s in %.1fs", self.name, time.monotonic() - start)
+        finally:
+            self._running.release()
+
+
+class Scheduler:
+    """
+    Runs jobs in background threads until stopped.
+
+    Attributes:
+        jobs (list): The `Job` instances to trigger.
+        poll_interval (float): Maximum seconds between checks for due jobs.
+    """
+
+    def __init__(self, jobs, poll_interval=1.0):
+        self.jobs = jobs
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def stop(self, *_):
+        self._stop.set()
+
+    def run_pending(self):
+        """
+        Start every job that is due.
+        """
+        now = time.monotonic()
+        for job in self.jobs:
+            if job.next_run <= now:
+                thread = job.try_start()
+                if thread is not None:
+                    self._threads.append(thread)
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+
+    def run_forever(self):
+        """
+        Trigger due jobs until `stop` is called, then wait for running jobs to finish.
+        """
+        while not self._stop.is_set():
+            self.run_pending()
+            next_run = min(job.next_run for job in self.jobs)
+            self._stop.wait(max(0.0, min(self.poll_interval, next_run - time.monotonic())))
+
+        for thread in self._threads:
+            thread.join()
+
+
+def _read_seconds(option, fallback):
+    return float(config.read_scheduler_config(option, fallback))
+
+
+def build_jobs():
+    """
+    Build the default price, coupon, receipt and notify jobs from the config.
+
+    The accounts are read once when the jobs are built, so each run reuses them.
+
+    Returns:
+        list: The `Job` instances for the daemon.
+    """
+    # Imported here so the scheduler module itself stays cheap to import
+    from costco_price_scraper.price_scraper import price_scraper as ps
+    from costco_price_scraper.price_scraper import costco_coupon_scraper as cs
+    from costco_price_scraper.utils import matcher, runner
+
+    jitter = _read_seconds("JITTER", JITTER)
+    backoff_base = _read_seconds("BACKOFF_BASE", BACKOFF_BASE)
+    max_backoff = _read_seconds("MAX_BACKOFF", MAX_BACKOFF)
+    accounts = config.read_accounts_config()
+    single_account = len(accounts) == 1
+
+    matcher.create_adjustment_opportunities_table()
+    telemetry.create_runs_table()
+
+    def scrape_receipts():
+        for username, password in accounts:
+            # A single account keeps the original behaviour of reusing the default profile
+            profile_dir = None if single_account else runner.get_profile_dir(runner.PROFILE_ROOT, username)
+            runner.scrape_account_receipts(username, password, profile_dir)
+
+    def notify():
+        matches_by_user = {username: matcher.find_new_adjustments(username) for username, _ in accounts}
+        errors = runner.notify_accounts(matches_by_user)
+        if errors:
+            raise RuntimeError(f"Failed to email {', '.join(errors)}")
+
+    stages = [
+        ("price", ps.run_price_scraper, "PRICE_INTERVAL", PRICE_INTERVAL),
+        ("coupon", cs.run_price_scraper, "COUPON_INTERVAL", COUPON_INTERVAL),
+        ("receipt", scrape_receipts, "RECEIPT_INTERVAL", RECEIPT_INTERVAL),
+        ("notify", notify, "NOTIFY_INTERVAL", NOTIFY_INTERVAL),
+    ]
+    jobs = {
+        name: Job(name, func, _read_seconds(option, default), jitter, backoff_base, max_backoff)
+        for name, func, option, default in stages
+    }
+    # Matching while receipts or sales are half written would miss adjustments
+    jobs["notify"].blocked_by = [jobs["price"], jobs["coupon"], jobs["receipt"]]
+    return list(jobs.values())
+
+
+def run_daemon(lock_path=LOCK_FILE):
+    """
+    Run the scheduler until SIGINT or SIGTERM is received.
+
+    Args:
+        lock_path (str): Path of the lock file shared with one-off runs of main.py.
+    """
+    with run_lock(lock_path):
+        scheduler = Scheduler(build_jobs())
+        signal.signal(signal.SIGINT, scheduler.stop)
+        signal.signal(signal.SIGTERM, scheduler.stop)
+        logger.info("Scheduler started (pid %d)", os.getpid())
+        scheduler.run_forever()
+        logger.info("Scheduler stopped")
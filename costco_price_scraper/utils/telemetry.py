@@ -0,0 +1,409 @@
+"""
+Module recording how long each part of a run takes and how much it processed.
+
+Code paths worth watching are wrapped in a `span`, which adds its duration, the
+number of items and bytes it handled and whether it failed to the counters of the
+process. `run_report` collects the spans recorded during a run (with the HTTP
+metrics of `http_client` and the rate limiter and circuit breaker state of every
+host), prints them and saves them to the 'runs' table, where `prometheus_text`
+reads it back for the /metrics endpoint of app.py.
+
+Functions:
+- `span`: Context manager timing a block under a name.
+- `timed`: Decorator timing every call of a function as a span.
+- `get_spans`: Return a snapshot of the span counters.
+- `collect`: Context manager collecting the spans recorded inside a block.
+- `merge_spans`: Add span counters collected in another process.
+- `print_spans`: Print span counters.
+- `run_report`: Context manager recording the report of a run.
+- `create_runs_table`: Create the 'runs' table.
+- `save_run`: Save the report of a run.
+- `get_latest_runs`: Return the latest run of every kind.
+- `prometheus_text`: Render the recorded runs in the Prometheus text format.
+
+Span names are '<area>.<step>', e.g. 'receipts.login' or 'db.upsert_items'.
+
+Note: Counters are per process and shared by its threads, so the report of a run
+also counts the spans of any run overlapping it in the same process (the daemon).
+"""
+
+import functools
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from costco_price_scraper.utils import http_client, rate_limiter
+from costco_price_scraper.utils.db_utils import serialized_write
+
+DB_FILE = "scraped_prices.db"
+
+_spans = {}
+# Dicts of the runs being collected, each also gets every span recorded
+_collectors = []
+_spans_lock = threading.Lock()
+
+_COUNTERS = ("count", "errors", "seconds", "items", "bytes")
+
+
+class Span:
+    """
+    An open span; `add` counts the items and bytes it handled.
+    """
+
+    __slots__ = ("name", "items", "bytes")
+
+    def __init__(self, name, items=0, bytes=0):
+        self.name = name
+        self.items = items
+        self.bytes = bytes
+
+    def add(self, items=0, bytes=0):
+        self.items += items
+        self.bytes += bytes
+
+
+def _counters(spans, name):
+    counters = spans.get(name)
+    if counters is None:
+        counters = spans[name] = dict.fromkeys(_COUNTERS, 0)
+        counters["max_seconds"] = 0.0
+    return counters
+
+
+def _add(name, other):
+    for spans in [_spans] + _collectors:
+        counters = _counters(spans, name)
+        for key in _COUNTERS:
+            counters[key] += other[key]
+        counters["max_seconds"] = max(counters["max_seconds"], other["max_seconds"])
+
+
+def _record(name, seconds, items, size, error):
+    with _spans_lock:
+        _add(name, {"count": 1, "errors": int(error), "seconds": seconds, "max_seconds": seconds,
+                    "items": items, "bytes": size})
+
+
+@contextmanager
+def span(name, items=0, bytes=0):
+    """
+    Time a block under a name.
+
+    Args:
+        name (str): The span name.
+        items (int): Items handled, more can be added with `Span.add`.
+        bytes (int): Bytes handled, more can be added with `Span.add`.
+
+    Yields:
+        Span: The open span.
+    """
+    current = Span(name, items, bytes)
+    start = time.perf_counter()
+    error = False
+    try:
+        yield current
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _record(name, time.perf_counter() - start, current.items, current.bytes, error)
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as the span `name`.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_spans():
+    """
+    Return a snapshot of the span counters.
+
+    Returns:
+        dict: Span name to counters (count, errors, seconds, max_seconds, items, bytes).
+    """
+    with _spans_lock:
+        return {name: dict(counters) for name, counters in _spans.items()}
+
+
+def merge_spans(spans):
+    """
+    Add span counters collected in another process, e.g. a worker of a multi-account run.
+
+    Args:
+        spans (dict): Counters as returned by `get_spans`.
+    """
+    with _spans_lock:
+        for name, other in spans.items():
+            _add(name, other)
+
+
+@contextmanager
+def collect():
+    """
+    Collect the spans recorded inside the block, by any thread of the process.
+
+    Yields:
+        dict: Span name to counters, filled while the block runs.
+    """
+    collected = {}
+    with _spans_lock:
+        _collectors.append(collected)
+    try:
+        yield collected
+    finally:
+        with _spans_lock:
+            _collectors.remove(collected)
+
+
+def _http_since(before):
+    metrics = {}
+    for host, counters in http_client.get_metrics().items():
+        previous = before.get(host)
+        if previous is not None:
+            if counters["requests"] == previous["requests"]:
+                continue
+            statuses = {
+                status: count - previous["statuses"].get(status, 0)
+                for status, count in counters["statuses"].items()
+                if count > previous["statuses"].get(status, 0)
+            }
+            counters = dict(
+                counters,
+                statuses=statuses,
+                **{key: counters[key] - previous[key] for key in ("requests", "retries", "errors", "bytes", "seconds")},
+            )
+        metrics[host] = counters
+    return metrics
+
+
+def print_spans(spans):
+    """
+    Print span counters.
+
+    Args:
+        spans (dict): Span name to counters, as returned by `get_spans`.
+    """
+    if not spans:
+        return
+    print("Spans:")
+    for name, counters in sorted(spans.items()):
+        line = (
+            f"  {name:<28} {counters['count']:>5} calls  {counters['seconds']:8.2f}s  "
+            f"max {counters['max_seconds']:6.2f}s"
+        )
+        if counters["items"]:
+            line += f"  {counters['items']:>7} items"
+        if counters["bytes"]:
+            line += f"  {counters['bytes'] / 1024:>9.1f} KiB"
+        if counters["errors"]:
+            line += f"  {counters['errors']} errors"
+        print(line)
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+@contextmanager
+def run_report(kind, run_id=None, username=None):
+    """
+    Record the report of a run: the spans and HTTP requests made inside the block.
+
+    The report is printed and saved to the 'runs' table when the block exits, with
+    the status 'failed' if it raised. The table is created by the setup of the
+    caller, see `create_runs_table`.
+
+    Args:
+        kind (str): What ran, e.g. 'pipeline', 'prices' or 'daemon.notify'.
+        run_id (str): The run id, a new one when not given.
+        username (str): The account of the run, if any.
+
+    Yields:
+        str: The run id.
+    """
+    run_id = run_id or uuid.uuid4().hex
+    http_before = http_client.get_metrics()
+    started_at = _now()
+    start = time.perf_counter()
+    status = "failed"
+    try:
+        with collect() as spans:
+            yield run_id
+        status = "done"
+    finally:
+        # The limiters live as long as the process, their state at the end of the run is kept
+        report = {"spans": spans, "http": _http_since(http_before), "limits": rate_limiter.get_states()}
+        duration = time.perf_counter() - start
+        print_spans(report["spans"])
+        try:
+            save_run(run_id, kind, username, status, started_at, _now(), duration, report)
+        except sqlite3.Error as e:
+            print(f"Could not save the report of run {run_id}: {e}")
+
+
+@serialized_write
+def create_runs_table():
+    """
+    Create the 'runs' table in the SQLite database.
+
+    Every invocation is a row, so a resumed pipeline run has one row per attempt.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id TEXT,
+                kind TEXT,
+                username TEXT,
+                status TEXT,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                duration REAL,
+                report TEXT
+            )
+        """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_kind ON runs (kind, id)")
+
+
+@serialized_write
+def save_run(run_id, kind, username, status, started_at, finished_at, duration, report):
+    """
+    Save the report of a run.
+
+    Args:
+        run_id (str): The run id.
+        kind (str): What ran.
+        username (str): The account of the run, if any.
+        status (str): 'done' or 'failed'.
+        started_at (str): Start time, 'YYYY-MM-DD HH:MM:SS'.
+        finished_at (str): End time, 'YYYY-MM-DD HH:MM:SS'.
+        duration (float): Seconds the run took.
+        report (dict): The spans, HTTP metrics and per-host limiter state of the run.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.execute(
+            """
+            INSERT INTO runs (run_id, kind, username, status, started_at, finished_at, duration, report)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (run_id, kind, username, status, started_at, finished_at, duration, json.dumps(report)),
+        )
+
+
+def get_latest_runs():
+    """
+    Return the latest run of every kind.
+
+    Returns:
+        list: One dict per kind with the columns of the 'runs' table, the report decoded.
+    """
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT * FROM runs WHERE id IN (SELECT max(id) FROM runs GROUP BY kind) ORDER BY kind"
+            ).fetchall()
+    except sqlite3.OperationalError:
+        # No run was recorded yet
+        return []
+    return [dict(row, report=json.loads(row["report"] or "{}")) for row in rows]
+
+
+def _count_runs():
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            return conn.execute("SELECT kind, status, count(*) FROM runs GROUP BY kind, status").fetchall()
+    except sqlite3.OperationalError:
+        return []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _timestamp(value):
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp() if value else 0
+
+
+def prometheus_text():
+    """
+    Render the recorded runs in the Prometheus text exposition format.
+
+    The run counts cover every run; durations, spans, HTTP requests and the rate
+    limiter and circuit breaker state of each host are those of the latest run of
+    each kind.
+
+    Returns:
+        str: The metrics page.
+    """
+    metrics = {}
+
+    def add(name, kind, help_text, labels, value):
+        metric = metrics.setdefault(name, (kind, help_text, []))
+        metric[2].append(f"{name}{_labels(**labels)} {value}")
+
+    for kind, status, count in _count_runs():
+        add("costco_runs_total", "counter", "Runs recorded, by kind and status.", {"kind": kind, "status": status}, count)
+
+    for run in get_latest_runs():
+        kind = {"kind": run["kind"]}
+        add("costco_last_run_duration_seconds", "gauge", "Duration of the latest run.", kind, run["duration"])
+        add("costco_last_run_timestamp_seconds", "gauge", "End time of the latest run.", kind,
+            _timestamp(run["finished_at"]))
+        add("costco_last_run_success", "gauge", "Whether the latest run succeeded.", kind,
+            int(run["status"] == "done"))
+        for name, counters in run["report"].get("spans", {}).items():
+            labels = dict(kind, span=name)
+            add("costco_span_calls", "gauge", "Calls of a span in the latest run.", labels, counters["count"])
+            add("costco_span_errors", "gauge", "Failed calls of a span in the latest run.", labels, counters["errors"])
+            add("costco_span_seconds", "gauge", "Seconds spent in a span in the latest run.", labels,
+                round(counters["seconds"], 6))
+            add("costco_span_max_seconds", "gauge", "Longest call of a span in the latest run.", labels,
+                round(counters["max_seconds"], 6))
+            add("costco_span_items", "gauge", "Items handled by a span in the latest run.", labels, counters["items"])
+            add("costco_span_bytes", "gauge", "Bytes handled by a span in the latest run.", labels, counters["bytes"])
+        for host, counters in run["report"].get("http", {}).items():
+            for status, count in counters["statuses"].items():
+                add("costco_http_responses", "gauge", "HTTP responses in the latest run.",
+                    dict(kind, host=host, status=status), count)
+            add("costco_http_retries", "gauge", "HTTP retries in the latest run.", dict(kind, host=host),
+                counters["retries"])
+            add("costco_http_bytes", "gauge", "HTTP bytes received in the latest run.", dict(kind, host=host),
+                counters["bytes"])
+        for host, state in run["report"].get("limits", {}).items():
+            labels = dict(kind, host=host)
+            add("costco_circuit_open", "gauge", "Whether the circuit breaker of a host was open (or half-open) "
+                "at the end of the latest run.", labels, int(state["state"] != "closed"))
+            add("costco_circuit_times_opened", "gauge", "Times the circuit breaker of a host opened, as of the "
+                "latest run.", labels, state["times_opened"])
+            add("costco_rate_limit_rate", "gauge", "Requests per second allowed to a host at the end of the "
+                "latest run.", labels, state["rate"])
+            add("costco_rate_limit_throttled", "gauge", "429 responses of a host, as of the latest run.", labels,
+                state["throttled"])
+            add("costco_rate_limit_blocked", "gauge", "403 responses of a host, as of the latest run.", labels,
+                state["blocked"])
+
+    lines = []
+    for name, (kind, help_text, samples) in metrics.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
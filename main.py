@@ -1,34 +1,232 @@
-from costco_price_scraper.price_scraper import price_scraper as ps
-from costco_price_scraper.receipt_scraper import receipt_scraper as rs
-from costco_price_scraper.receipt_scraper import receipts_db
-from costco_price_scraper.utils import email_sender, email_builder, config
-from costco_price_scraper.utils.api_utils import call_api
-from costco_price_scraper.price_scraper import costco_coupon_scraper as cs
-
-def main():
+"""
+Command line entry point of the Costco price adjustment checker.
+
+Subcommands:
+- run (default): Scrape the sale catalog and the receipts, then email the price adjustments.
+  Checkpointed per stage; a rerun resumes the latest incomplete run.
+- stage: Run a single pipeline stage on its own.
+- prices: Scrape the frugalhotspot sale posts.
+- coupons: Scrape the costco.com online offers.
+- receipts: Scrape the receipts of the configured account.
+- email: Rebuild and send the price adjustment email from the database. Adjustments
+  already emailed are left out unless --resend is given.
+- daemon: Stay resident and run each stage on the configured intervals.
+
+Every run is recorded in the 'runs' table with its timing spans (see
+`telemetry.run_report`); app.py serves them on /metrics.
+
+--profile runs each pipeline stage (or the whole subcommand) under cProfile and
+tracemalloc, writing a .prof file and an allocation report per stage to a new run
+directory in --profile-dir (see `profiler`). Both options are accepted before and
+after the subcommand. Worker processes of --all-accounts are not profiled.
+
+Heavy dependencies (selenium, undetected_chromedriver, bs4, html5lib, requests,
+dateutil, smtplib) are only imported by the stage that needs them. `STAGE_MODULES`
+lists what each subcommand loads; benchmarks/importtime_budget.py checks that the
+cold start of every subcommand stays within its budget.
+"""
+import argparse
+import importlib
+
+STAGE_MODULES = {
+    "run": ("costco_price_scraper.utils.pipeline",),
+    "accounts": ("costco_price_scraper.utils.runner",),
+    "stage": ("costco_price_scraper.utils.pipeline",),
+    "prices": ("costco_price_scraper.price_scraper.price_scraper",),
+    "coupons": ("costco_price_scraper.price_scraper.costco_coupon_scraper",),
+    "receipts": ("costco_price_scraper.utils.runner",),
+    "email": ("costco_price_scraper.utils.runner",),
+    "daemon": ("costco_price_scraper.utils.scheduler",),
+}
+
+
+def load_stage(command):
+    """
+    Import the modules a subcommand needs.
+
+    Args:
+        command (str): The subcommand name.
+
+    Returns:
+        list: The imported modules, in `STAGE_MODULES` order.
+    """
+    return [importlib.import_module(name) for name in STAGE_MODULES[command]]
+
+
+def main(run_id=None, resume=True, concurrent=False):
+    (pipeline,) = load_stage("run")
+    from costco_price_scraper.utils import config
+
+    username, password = config.read_login_config()
+    return pipeline.run_pipeline(username, password, run_id=run_id, resume=resume, concurrent=concurrent)
+
+
+def run_command(args):
+    if args.all_accounts:
+        (runner,) = load_stage("accounts")
+        runner.run_all_accounts(max_workers=args.max_workers)
+    else:
+        main(run_id=args.run_id, resume=not args.fresh, concurrent=args.concurrent)
+
+
+def stage_command(args):
+    (pipeline,) = load_stage("stage")
+    from costco_price_scraper.utils import config
+
+    username, password = config.read_login_config()
+    pipeline.run_stage(args.stage, username, password, run_id=args.run_id)
+
+
+def prices_command(args):
+    (ps,) = load_stage("prices")
     ps.run_price_scraper()
-    cs.run_price_scraper()
-    all_items_list = rs.run_receipt_scraper_with_api(all_receipts=False)
-    sale_item_hashmap = call_api(all_items_list)
-    
-    receipt_items_list = []
-    receipt_id_set = set()
-    
-    for item in all_items_list:
-        if item[1] in sale_item_hashmap:
-            receipt_items_list.append(item)
-            receipt_id_set.add(item[7])
-    
-    receipt_id_list = list(receipt_id_set)
-    receipts = receipts_db.get_receipts_by_ids(receipt_id_list)
-    
-    subject, body = email_builder.construct_receipt_email_body_and_subject(receipt_items_list, sale_item_hashmap)
-    to_email = config.read_username_config()
-    paths = [receipt.get("receipt_path") for receipt in receipts]
-
-    if receipt_items_list: # Only send emails if there are price adjustments found
-        email_sender.send_email(subject, body, to_email, paths)
+
+
+def coupons_command(args):
+    (cs,) = load_stage("coupons")
+    cs.run_price_scraper(force=args.force)
+
+
+def receipts_command(args):
+    (runner,) = load_stage("receipts")
+    from costco_price_scraper.utils import config
+
+    username, password = config.read_login_config()
+    runner.scrape_account_receipts(username, password, all_receipts=args.all_receipts)
+
+
+def email_command(args):
+    (runner,) = load_stage("email")
+    from costco_price_scraper.utils import config, matcher
+
+    matcher.create_adjustment_opportunities_table()
+    runner.notify_account(config.read_username_config(), dry_run=args.dry_run, resend=args.resend)
+
+
+def daemon_command(args):
+    import logging
+
+    (scheduler,) = load_stage("daemon")
+    logging.basicConfig(level=logging.INFO)
+    scheduler.run_daemon()
+
+
+def parse_args(argv=None):
+    # Accepted before and after the subcommand; SUPPRESS keeps a subcommand from
+    # resetting a value given before it
+    profile_options = argparse.ArgumentParser(add_help=False)
+    profile_options.add_argument(
+        "--profile",
+        action="store_true",
+        default=argparse.SUPPRESS,
+        help="profile CPU and memory per stage, writing the reports to a new run directory",
+    )
+    profile_options.add_argument(
+        "--profile-dir",
+        default=argparse.SUPPRESS,
+        metavar="DIR",
+        help="folder of the profiling run directories (default: profiles), implies --profile",
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Check recent Costco purchases for price adjustments.", parents=[profile_options]
+    )
+    # report: kind of the run report recorded around the handler, pipeline runs record their own
+    parser.set_defaults(handler=run_command, all_accounts=False, max_workers=None, run_id=None, fresh=False,
+                        concurrent=False, report=None)
+    parser.add_argument("--config", default=None, help="path of config.ini (default: $COSTCO_CONFIG_PATH)")
+    subparsers = parser.add_subparsers(title="subcommands")
+
+    run_parser = subparsers.add_parser("run", help="run the whole pipeline (default)", parents=[profile_options])
+    run_parser.add_argument(
+        "--all-accounts",
+        action="store_true",
+        help="process every account in the config, scraping the sale catalog only once",
+    )
+    run_parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=None,
+        help="number of accounts processed at the same time (with --all-accounts)",
+    )
+    run_parser.add_argument("--run-id", default=None, help="continue this run instead of the latest incomplete one")
+    run_parser.add_argument("--fresh", action="store_true", help="start a new run even if an incomplete one exists")
+    run_parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="overlap the blog scraper, the coupon scraper and the browser login",
+    )
+    run_parser.set_defaults(handler=run_command)
+
+    stage_parser = subparsers.add_parser("stage", help="run a single pipeline stage", parents=[profile_options])
+    stage_parser.add_argument("stage", choices=["prices", "coupons", "receipts", "match", "notify"])
+    stage_parser.add_argument("--run-id", default=None, help="record the stage in this run")
+    stage_parser.set_defaults(handler=stage_command)
+
+    prices_parser = subparsers.add_parser("prices", help="scrape the frugalhotspot sale posts", parents=[profile_options])
+    prices_parser.set_defaults(handler=prices_command, report="prices")
+
+    coupons_parser = subparsers.add_parser("coupons", help="scrape the costco.com online offers", parents=[profile_options])
+    coupons_parser.add_argument(
+        "--force", action="store_true", help="download the offers even if the cached coupon book is still valid"
+    )
+    coupons_parser.set_defaults(handler=coupons_command, report="coupons")
+
+    receipts_parser = subparsers.add_parser("receipts", help="scrape the receipts of the configured account", parents=[profile_options])
+    receipts_parser.add_argument("--all-receipts", action="store_true", help="process every receipt")
+    receipts_parser.set_defaults(handler=receipts_command, report="receipts")
+
+    email_parser = subparsers.add_parser("email", help="rebuild and send the price adjustment email", parents=[profile_options])
+    email_parser.add_argument("--dry-run", action="store_true", help="print the email instead of sending it")
+    email_parser.add_argument(
+        "--resend", action="store_true", help="include the adjustments that were already emailed"
+    )
+    email_parser.set_defaults(handler=email_command, report="email")
+
+    daemon_parser = subparsers.add_parser(
+        "daemon",
+        help="stay resident and run each stage on the intervals in the 'Scheduler' config section",
+        parents=[profile_options],
+    )
+    daemon_parser.set_defaults(handler=daemon_command)
+
+    args = parser.parse_args(argv)
+    args.profile_dir = getattr(args, "profile_dir", None)
+    args.profile = getattr(args, "profile", False) or args.profile_dir is not None
+    return args
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.config:
+        from costco_price_scraper.utils import config
+
+        config.set_config_path(args.config)
+    if args.handler is daemon_command:
+        if args.profile:
+            raise SystemExit("--profile is not supported by the daemon, profile a single stage instead")
+        args.handler(args)
+    else:
+        from contextlib import nullcontext
+
+        from costco_price_scraper.utils.scheduler import run_lock
+
+        profile = nullcontext()
+        if args.profile:
+            from costco_price_scraper.utils import profiler
+
+            profiler.enable(args.profile_dir)
+            # Pipeline runs profile each stage themselves
+            if args.report or args.all_accounts:
+                profile = profiler.profile(args.report or "accounts")
+
+        # Never overlap with another run or with the daemon
+        with run_lock(), profile:
+            if args.report:
+                from costco_price_scraper.utils import telemetry
+
+                telemetry.create_runs_table()
+                with telemetry.run_report(args.report):
+                    args.handler(args)
+            else:
+                args.handler(args)
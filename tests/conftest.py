@@ -0,0 +1,60 @@
+"""
+Shared fixtures: a throwaway working directory for the relative scraped_prices.db,
+a config that only reads the COSTCO_<SECTION>_<OPTION> environment variables, and
+the stand-in servers of benchmarks/.
+"""
+import pytest
+
+import smtp_standin
+import throttling_standin
+from costco_price_scraper.utils import config, http_client, rate_limiter
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # The modules open a relative scraped_prices.db, keep it out of the checkout
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "config_path", str(tmp_path / "missing-config.ini"))
+    return tmp_path
+
+
+@pytest.fixture
+def smtp_server():
+    servers = []
+
+    def start(**kwargs):
+        server = smtp_standin.start(**kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def throttling_server():
+    servers = []
+
+    def start(**kwargs):
+        server = throttling_standin.start(**kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def fresh_http_state():
+    # Limiters, sessions and counters are per process; every test starts from none
+    rate_limiter._limiters.clear()
+    http_client.close()
+    http_client.reset_metrics()
+    yield
+    rate_limiter._limiters.clear()
+    http_client.close()
+    http_client.reset_metrics()
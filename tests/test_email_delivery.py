@@ -0,0 +1,123 @@
+import smtplib
+
+import pytest
+
+from costco_price_scraper.utils import email_delivery, email_sender
+
+SENDER = "sender@example.com"
+# A 1x1 PNG
+PNG = (
+    b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89"
+    b"\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82"
+)
+
+
+@pytest.fixture
+def attachment(workdir):
+    path = workdir / "receipt.png"
+    path.write_bytes(PNG)
+    return str(path)
+
+
+def make_emails(count, attachment_path=None):
+    return [
+        email_delivery.OutgoingEmail(
+            f"user{index}@example.com", "Costco Price Adjustment", "<pre>body</pre>",
+            [attachment_path] if attachment_path else None,
+        )
+        for index in range(count)
+    ]
+
+
+def make_pool(server, size):
+    return email_delivery.SMTPConnectionPool(
+        "127.0.0.1", server.server_address[1], SENDER, "password", use_ssl=False, size=size, timeout=5
+    )
+
+
+def test_send_batch_reuses_pooled_connections(smtp_server, attachment):
+    server = smtp_server()
+    emails = make_emails(12, attachment)
+
+    with make_pool(server, size=3) as pool:
+        results = email_delivery.send_batch(emails, pool)
+
+    assert results == [(email.to_email, None) for email in emails]
+    assert len(server.messages) == 12
+    assert sorted(recipients for _, recipients, _ in server.messages) == sorted(
+        [email.to_email] for email in emails
+    )
+    # One login per connection, never more connections than the pool size
+    assert 1 <= pool.connections_opened <= 3
+    assert server.connections == server.logins == pool.connections_opened
+
+
+def test_send_batch_reconnects_when_the_server_drops_the_connection(smtp_server):
+    server = smtp_server(drop_after=1)
+    emails = make_emails(4)
+
+    with make_pool(server, size=1) as pool:
+        results = email_delivery.send_batch(emails, pool)
+
+    assert [error for _, error in results] == [None] * 4
+    assert len(server.messages) == 4
+    # The dropped connection is only noticed when reused, then replaced once per email
+    assert pool.connections_opened == 4
+    assert server.logins == 4
+
+
+def test_send_batch_reports_refused_recipients(smtp_server):
+    server = smtp_server(reject={"user1@example.com"})
+    emails = make_emails(3)
+
+    with make_pool(server, size=2) as pool:
+        results = email_delivery.send_batch(emails, pool)
+
+    errors = dict(results)
+    assert errors["user0@example.com"] is None
+    assert errors["user2@example.com"] is None
+    assert isinstance(errors["user1@example.com"], smtplib.SMTPRecipientsRefused)
+    assert len(server.messages) == 2
+
+
+def test_send_batch_reports_unreachable_server(smtp_server):
+    server = smtp_server()
+    port = server.server_address[1]
+    server.shutdown()
+    server.server_close()
+    pool = email_delivery.SMTPConnectionPool("127.0.0.1", port, SENDER, "password", use_ssl=False, size=2,
+                                             timeout=5)
+
+    with pool:
+        results = email_delivery.send_batch(make_emails(3), pool)
+
+    assert all(isinstance(error, OSError) for _, error in results)
+    assert pool.connections_opened == 0
+
+
+def configure_smtp(monkeypatch, server):
+    monkeypatch.setenv("COSTCO_SMTP_HOST", "127.0.0.1")
+    monkeypatch.setenv("COSTCO_SMTP_PORT", str(server.server_address[1]))
+    monkeypatch.setenv("COSTCO_SMTP_SSL", "false")
+    monkeypatch.setenv("COSTCO_CREDENTIALS_GMAIL_USERNAME", SENDER)
+    monkeypatch.setenv("COSTCO_CREDENTIALS_GMAIL_PASSWORD", "password")
+
+
+def test_send_email_uses_the_configured_server(smtp_server, attachment, monkeypatch):
+    server = smtp_server()
+    configure_smtp(monkeypatch, server)
+
+    email_sender.send_email("Costco Price Adjustment", "<pre>body</pre>", "user@example.com", [attachment])
+
+    assert [(sender, recipients) for sender, recipients, _ in server.messages] == [
+        (f"<{SENDER}>", ["user@example.com"])
+    ]
+
+
+def test_send_email_raises_the_delivery_error(smtp_server, monkeypatch):
+    server = smtp_server(reject={"user@example.com"})
+    configure_smtp(monkeypatch, server)
+
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        email_sender.send_email("Costco Price Adjustment", "<pre>body</pre>", "user@example.com")
+    assert server.messages == []
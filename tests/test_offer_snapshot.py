@@ -0,0 +1,42 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from costco_price_scraper.price_scraper import items_db, offer_snapshot
+
+CATALOG_ROWS = 20000
+
+
+def fill_catalog(rows=CATALOG_ROWS):
+    items_db.create_items_table()
+    expiry = (date.today() + timedelta(days=7)).isoformat()
+    with sqlite3.connect(items_db.DB_FILE) as conn:
+        conn.executemany(
+            "INSERT INTO items (item_id, item_name, savings, expiry_date, sale_price) VALUES (?, ?, ?, ?, ?)",
+            [(1000000 + index, f"Item {index}", 2.0, expiry, 9.99) for index in range(rows)],
+        )
+
+
+def test_concurrent_publishes_never_clash(workdir):
+    fill_catalog()
+
+    # The price and coupon scrapers publish from parallel threads
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        counts = list(executor.map(lambda _: offer_snapshot.publish(), range(20)))
+
+    assert counts == [CATALOG_ROWS] * 20
+    assert sorted(os.listdir(workdir)) == [offer_snapshot.SNAPSHOT_FILE, items_db.DB_FILE]
+    snapshot = offer_snapshot.OfferSnapshot(offer_snapshot.SNAPSHOT_FILE)
+    assert len(snapshot) == CATALOG_ROWS
+    assert snapshot.lookup(1000000 + CATALOG_ROWS - 1).item_name == f"Item {CATALOG_ROWS - 1}"
+
+
+def test_check_sale_reads_the_published_snapshot(workdir):
+    fill_catalog(10)
+    offer_snapshot.publish()
+
+    result = offer_snapshot.check_sale(["1000003", "1000001", "1000003", "42"])
+
+    assert [offer.item_id for offer in result["sale_info"]] == [1000001, 1000003]
+    assert result["total_savings"] == 4.0
@@ -0,0 +1,153 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import pytest
+import requests
+
+from costco_price_scraper.utils import http_client, rate_limiter, telemetry
+from costco_price_scraper.utils.rate_limiter import CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture
+def limiter_config(monkeypatch, fresh_http_state):
+    """Set 'RateLimit' and 'HTTP' options; every request is sent once, with short pauses."""
+    monkeypatch.setenv("COSTCO_HTTP_RETRIES", "0")
+    monkeypatch.setenv("COSTCO_HTTP_MAX_BACKOFF", "0.1")
+
+    def configure(**options):
+        for option, value in options.items():
+            monkeypatch.setenv(f"COSTCO_RATELIMIT_{option.upper()}", str(value))
+
+    return configure
+
+
+def url_of(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/online-offers.html"
+
+
+def limiter_of(url):
+    return rate_limiter.for_host(urlsplit(url).netloc)
+
+
+def burst(send, count, workers=4):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return Counter(executor.map(lambda _: send(), range(count)))
+
+
+def test_token_bucket_paces_requests_under_the_host_limit(throttling_server, limiter_config):
+    server = throttling_server(limit=5)
+    url = url_of(server)
+
+    # Unpaced, the stand-in throttles the burst
+    assert burst(lambda: requests.get(url, timeout=5).status_code, 10)[429] > 0
+    server.reset()
+
+    limiter_config(rate=4, burst=1)
+    start = time.monotonic()
+    statuses = burst(lambda: http_client.get(url).status_code, 8)
+
+    assert statuses == {200: 8}
+    assert dict(server.statuses) == {200: 8}
+    # A single token up front, then about four requests per second
+    assert time.monotonic() - start >= 7 / 4.5
+    assert limiter_of(url).state()["throttled"] == 0
+
+
+def test_token_bucket_slows_down_after_a_429_and_recovers(throttling_server, limiter_config):
+    server = throttling_server(limit=2, block_after=100)
+    url = url_of(server)
+    limiter_config(rate=8, burst=10, failure_threshold=100)
+
+    statuses = [http_client.get(url).status_code for _ in range(3)]
+
+    assert statuses == [200, 200, 429]
+    limiter = limiter_of(url)
+    assert limiter.throttled == 1
+    # Halved, and the Retry-After (capped by MAX_BACKOFF) pauses the bucket
+    assert limiter.bucket.rate == pytest.approx((8 + 2 * rate_limiter.RATE_INCREASE) / 2)
+    assert limiter.bucket.paused_until > time.monotonic() - 1
+
+    time.sleep(1.0)
+    rate_after_throttle = limiter.bucket.rate
+    assert http_client.get(url).status_code == 200
+    assert limiter.bucket.rate == pytest.approx(rate_after_throttle + rate_limiter.RATE_INCREASE)
+    assert limiter.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_opens_fails_fast_and_closes_after_a_successful_trial(throttling_server, limiter_config):
+    server = throttling_server(limit=1, block_after=2, block_seconds=1.0)
+    url = url_of(server)
+    limiter_config(rate=100, burst=10, failure_threshold=2, cooldown=1.5)
+
+    # 200, then a 429, then the stand-in starts blocking with 403s
+    assert [http_client.get(url).status_code for _ in range(3)] == [200, 429, 403]
+    limiter = limiter_of(url)
+    assert limiter.breaker.state == CircuitBreaker.OPEN
+    assert limiter.state()["times_opened"] == 1
+
+    # While open nothing reaches the host
+    with pytest.raises(CircuitOpenError):
+        http_client.get(url)
+    assert sum(server.statuses.values()) == 3
+
+    # After the cooldown (the block is over by then) one trial request closes it
+    time.sleep(1.6)
+    assert http_client.get(url).status_code == 200
+    assert limiter.breaker.state == CircuitBreaker.CLOSED
+    assert limiter.breaker.cooldown == 1.5
+
+
+def test_circuit_breaker_reopens_with_a_longer_cooldown_when_the_trial_fails(throttling_server, limiter_config):
+    server = throttling_server(limit=1, block_after=2, block_seconds=30.0)
+    url = url_of(server)
+    limiter_config(rate=100, burst=10, failure_threshold=2, cooldown=0.5)
+
+    assert [http_client.get(url).status_code for _ in range(3)] == [200, 429, 403]
+    limiter = limiter_of(url)
+    assert limiter.breaker.state == CircuitBreaker.OPEN
+
+    # The host still blocks the trial request
+    time.sleep(0.6)
+    assert http_client.get(url).status_code == 403
+    assert limiter.breaker.state == CircuitBreaker.OPEN
+    assert limiter.breaker.cooldown == 1.0
+    assert limiter.state()["times_opened"] == 2
+    with pytest.raises(CircuitOpenError):
+        http_client.get(url)
+
+
+def test_open_circuit_is_shared_through_the_database(throttling_server, limiter_config):
+    server = throttling_server(limit=1, block_after=2, block_seconds=30.0)
+    url = url_of(server)
+    limiter_config(rate=100, burst=10, failure_threshold=2, cooldown=60)
+
+    assert [http_client.get(url).status_code for _ in range(3)] == [200, 429, 403]
+
+    # A worker process starts with its own limiter and reads the breaker from the database
+    rate_limiter._limiters.clear()
+    with pytest.raises(CircuitOpenError):
+        http_client.get(url)
+    assert limiter_of(url).breaker.state == CircuitBreaker.OPEN
+    assert sum(server.statuses.values()) == 3
+
+
+def test_run_report_saves_and_exports_the_limiter_state(throttling_server, limiter_config):
+    server = throttling_server(limit=1, block_after=2, block_seconds=30.0)
+    url = url_of(server)
+    host = urlsplit(url).netloc
+    limiter_config(rate=100, burst=10, failure_threshold=2, cooldown=60)
+    telemetry.create_runs_table()
+
+    with telemetry.run_report("pipeline"):
+        assert [http_client.get(url).status_code for _ in range(3)] == [200, 429, 403]
+
+    [run] = telemetry.get_latest_runs()
+    limits = run["report"]["limits"][host]
+    assert (limits["state"], limits["throttled"], limits["blocked"]) == (CircuitBreaker.OPEN, 1, 1)
+    metrics = telemetry.prometheus_text().splitlines()
+    labels = f'{{kind="pipeline",host="{host}"}}'
+    assert f"costco_circuit_open{labels} 1" in metrics
+    assert f"costco_rate_limit_throttled{labels} 1" in metrics
+    assert f"costco_rate_limit_blocked{labels} 1" in metrics